@@ -0,0 +1,285 @@
+# asgi_app.py
+#
+# Async entry point for the birthday webhook, alongside the Flask app:
+#
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+#
+# Unlike the Flask app, which queues the job and answers 202, this handler
+# delivers inline and answers with the original contract:
+# {"status": "success", "email": bool, "sms": bool}. The voucher is rendered
+# on a thread pool, then email and SMS go out concurrently, so a request takes
+# max(email, sms) rather than the sum.
+#
+# Provider rate limits are enforced per process. Run a single process, as
+# above; with --workers N, divide the *_RATE_PER_SEC and *_BURST settings by N.
+
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    raise ImportError("asgi_app requires httpx: pip install httpx") from None
+
+import metrics
+import templates
+from async_clients import AsyncMailerSendClient, AsyncCellCastClient
+from circuit_breaker import CircuitOpenError, get_breaker
+from create_voucher_pdf import Encoding, set_encoding
+from rate_limiter import get_scheduler
+from settings import load_settings
+from validation import REJECTION_MESSAGES, validate_record
+from voucher_cache import VoucherCache
+
+logger = logging.getLogger(__name__)
+
+# Set up by startup(), inside the server's event loop: on lifespan startup,
+# or on the first request for servers without lifespan support. Importing
+# the module reads no settings and touches no files.
+settings = None
+voucher_cache = None
+render_executor = None
+http_client = None
+mailer_client = None
+cellcast_client = None
+_startup_lock = asyncio.Lock()
+
+
+async def startup():
+    """Loads the settings and creates the clients, once however many requests arrive together."""
+    global settings, voucher_cache, render_executor, http_client, mailer_client, cellcast_client
+    if http_client is not None:
+        return
+    async with _startup_lock:
+        if http_client is not None:
+            return
+        settings = load_settings()
+        logging.basicConfig(level=logging.INFO)
+        if not settings.mailersend_api_key or not settings.mailersend_sender:
+            raise RuntimeError("Missing MailerSend credentials. Please check .env file.")
+        templates.load(settings.templates_file or None)
+        set_encoding(Encoding.from_settings(settings))
+
+        mailersend_scheduler = get_scheduler(
+            "mailersend", rate=settings.mailersend_rate_per_sec, burst=settings.mailersend_burst
+        )
+        cellcast_scheduler = get_scheduler(
+            "cellcast", rate=settings.cellcast_rate_per_sec, burst=settings.cellcast_burst
+        )
+
+        # Delivery is inline here, so there is nowhere to park a send: while a
+        # provider's breaker is open its channel answers false straight away.
+        breaker_options = dict(
+            failure_threshold=settings.circuit_failure_threshold,
+            failure_rate=settings.circuit_failure_rate,
+            window=settings.circuit_window_seconds,
+            open_seconds=settings.circuit_open_seconds,
+            half_open_calls=settings.circuit_half_open_calls,
+        )
+        get_breaker("mailersend", **breaker_options)
+        get_breaker("cellcast", **breaker_options)
+
+        voucher_cache = VoucherCache(
+            settings.voucher_cache_dir,
+            max_memory_bytes=settings.voucher_cache_memory_mb * 1024 * 1024,
+            max_disk_bytes=settings.voucher_cache_disk_mb * 1024 * 1024,
+        )
+        render_executor = ThreadPoolExecutor(settings.render_workers, thread_name_prefix="render")
+
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.http_read_timeout, connect=settings.http_connect_timeout),
+            limits=httpx.Limits(max_connections=settings.http_max_connections)
+        )
+        mailer_client = AsyncMailerSendClient(
+            settings.mailersend_api_key, settings.mailersend_sender, client, scheduler=mailersend_scheduler,
+            base_url=settings.mailersend_api_url
+        )
+        cellcast_client = AsyncCellCastClient(
+            settings.cellcast_api_key, client, sender_id=settings.cellcast_sender_id, scheduler=cellcast_scheduler,
+            base_url=settings.cellcast_api_url
+        )
+        # Set last: other requests take a non-None client to mean setup is complete
+        http_client = client
+
+
+async def shutdown():
+    if http_client is not None:
+        await http_client.aclose()
+    if render_executor is not None:
+        render_executor.shutdown(wait=False)
+
+
+async def send_email_channel(name, email, voucher_code, template_type, pdf_bytes):
+    if not pdf_bytes:
+        logger.error("Failed to generate PDF voucher.")
+        return False
+    email_template_id = templates.get(template_type).email_template_id
+    logger.info(f"Sending email to {email} with template id: {email_template_id}")
+    try:
+        success = await mailer_client.send_email(
+            recipient_email=email,
+            recipient_name=name,
+            template_id=email_template_id,
+            attachment_content=pdf_bytes,
+            attachment_filename=f'voucher_{voucher_code}.pdf'
+        )
+    except CircuitOpenError as e:
+        logger.error(f"Email to {email} not sent: {e}")
+        return False
+    if success:
+        logger.info(f"Email sent successfully to {email}")
+    else:
+        logger.error(f"Failed to send email to {email}")
+    return success
+
+
+async def send_sms_channel(name, phone, voucher_code, template_type):
+    sms_template_id = templates.get(template_type).sms_template_id
+    recipient_data = {
+        "number": phone,
+        "fname": name,
+        "custom_value_1": f"{settings.public_image_base_url.rstrip('/')}/voucher_{voucher_code}.jpg"
+    }
+    logger.info(f"Sending SMS using template id: {sms_template_id} to {phone}")
+    try:
+        success = await cellcast_client.send_sms_template(sms_template_id, [recipient_data])
+    except CircuitOpenError as e:
+        logger.error(f"SMS to {phone} not sent: {e}")
+        return False
+    if success:
+        logger.info(f"SMS sent successfully to {phone}")
+    else:
+        logger.error(f"Failed to send SMS to {phone}")
+    return success
+
+
+async def not_sent():
+    return False
+
+
+async def birthday_webhook(headers, body):
+    """Returns (status code, JSON-able result)."""
+    auth_token = headers.get("authorization")
+    if not auth_token or auth_token != settings.webhook_secret_token:
+        logger.warning("Unauthorized access attempt.")
+        return 401, {"status": "error", "message": "Unauthorized."}
+
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+    if not data or not isinstance(data, dict):
+        logger.error("No JSON received")
+        return 400, {"status": "error", "message": "No JSON received"}
+
+    checked = validate_record(data)
+    name = checked["name"]
+    email = checked["email"]
+    phone = checked["phone"]
+    voucher_code = checked["voucher_code"]
+    template_type = checked["template_type"]
+
+    logger.info(f"Received data - Name: '{name}', Email: '{email}', Phone: '{phone}', Voucher: '{voucher_code}'")
+
+    for reason in checked["warnings"]:
+        logger.error(f"Dropping a channel: {reason}")
+    if checked["error"]:
+        logger.error(f"Rejected: {checked['error']}")
+        return 400, {"status": "error", "message": REJECTION_MESSAGES.get(checked["error"], checked["error"])}
+
+    do_email = bool(email)
+    do_sms = bool(phone)
+
+    # Rendering is CPU bound, so keep it off the event loop. The SMS only
+    # links to the image, but it is rendered here so the link works on arrival.
+    pdf_bytes = None
+    if do_email or do_sms:
+        try:
+            loop = asyncio.get_running_loop()
+            pdf_bytes, _ = await loop.run_in_executor(
+                render_executor, voucher_cache.get_or_render, name, voucher_code, templates.get(template_type).renderer
+            )
+        except Exception as e:
+            logger.error(f"Failed to render voucher: {e}")
+
+    email_success, sms_success = await asyncio.gather(
+        send_email_channel(name, email, voucher_code, template_type, pdf_bytes) if do_email else not_sent(),
+        send_sms_channel(name, phone, voucher_code, template_type) if do_sms else not_sent(),
+    )
+
+    result = {
+        "status": "success",
+        "email": email_success,
+        "sms": sms_success
+    }
+    logger.info(result)
+    return 200, result
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def send_body(send, status, body, content_type):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, status, payload):
+    await send_body(send, status, json.dumps(payload).encode("utf-8"), "application/json")
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await startup()
+            except Exception as e:
+                logger.exception("Startup failed.")
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] == "/metrics" and scope["method"] == "GET":
+        await send_body(send, 200, metrics.REGISTRY.render().encode("utf-8"), metrics.CONTENT_TYPE)
+        return
+    if scope["path"] != "/birthday-webhook":
+        await send_json(send, 404, {"status": "error", "message": "Not found."})
+        return
+    if scope["method"] != "POST":
+        await send_json(send, 405, {"status": "error", "message": "Method not allowed."})
+        return
+
+    try:
+        # Does nothing once lifespan startup has run
+        await startup()
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        status, result = await birthday_webhook(headers, await read_body(receive))
+    except Exception:
+        logger.exception("An unexpected error occurred in birthday_webhook.")
+        status, result = 500, {"status": "error", "message": "Internal server error."}
+    await send_json(send, status, result)
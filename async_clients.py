@@ -0,0 +1,154 @@
+# async_clients.py
+#
+# asyncio counterparts of MailerSendClient and CellCastClient for the ASGI
+# app. Payloads, result parsing and rate limits are shared with the
+# synchronous clients; only the transport (httpx.AsyncClient) differs.
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from metrics import PROVIDER_REQUEST_SECONDS, PROVIDER_SEND_SECONDS, PROVIDER_RETRIES, PROVIDER_RETRY_SLEEP_SECONDS
+from rate_limiter import ProviderScheduler, get_scheduler, backoff_delay, parse_retry_after
+from circuit_breaker import CircuitBreaker, CircuitOpenError, get_breaker
+from send_email import MAILERSEND_API_URL, build_message, encode_attachment
+from send_sms import CELLCAST_API_URL, build_template_payload, template_results
+
+logger = logging.getLogger(__name__)
+
+
+async def post_with_retries(
+    http: httpx.AsyncClient,
+    url: str,
+    headers: Dict[str, str],
+    payload: Any,
+    scheduler: ProviderScheduler,
+    description: str,
+    accept: Callable[[httpx.Response], bool],
+    retries: int = 3,
+    backoff_factor: int = 2,
+    breaker: Optional[CircuitBreaker] = None
+) -> Optional[httpx.Response]:
+    """
+    Posts JSON with the same retry, 429, backoff and circuit breaker rules as the synchronous clients.
+
+    Raises:
+        CircuitOpenError: If the provider's breaker is open.
+    """
+    provider = scheduler.name
+    breaker = breaker or get_breaker(provider)
+    send_started = time.perf_counter()
+
+    for attempt in range(1, retries + 1):
+        retry_after = None
+        logger.info(f"Attempt {attempt}: Sending {description}")
+        # Leaving the block any other way, cancellation included, hands the probe back
+        with breaker.attempt() as call:
+            try:
+                await scheduler.acquire_async()
+                started = time.perf_counter()
+                status = "error"
+                try:
+                    response = await http.post(url, headers=headers, json=payload)
+                    status = response.status_code
+                finally:
+                    PROVIDER_REQUEST_SECONDS.observe(time.perf_counter() - started, provider=provider, status=status)
+
+                if response.status_code == 429:
+                    call.release()
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    scheduler.throttle(retry_after)
+                    logger.error(f"Rate limited sending {description} on attempt {attempt}")
+                else:
+                    if response.status_code >= 500:
+                        call.failure()
+                    else:
+                        call.success()
+                    if accept(response):
+                        PROVIDER_SEND_SECONDS.observe(time.perf_counter() - send_started, provider=provider, outcome="success")
+                        return response
+                    logger.error(f"Failed to send {description} on attempt {attempt}: {response.status_code} - {response.text}")
+            except httpx.HTTPError as e:
+                call.failure()
+                logger.error(f"Exception on attempt {attempt}: {e}")
+            except ValueError as e:
+                logger.error(f"Exception on attempt {attempt}: {e}")
+
+        if attempt == retries:
+            break
+        if breaker.is_open():
+            raise CircuitOpenError(provider, breaker.retry_in())
+
+        sleep_time = max(backoff_delay(attempt, backoff_factor), retry_after or 0)
+        PROVIDER_RETRIES.inc(provider=provider)
+        PROVIDER_RETRY_SLEEP_SECONDS.inc(sleep_time, provider=provider)
+        await asyncio.sleep(sleep_time)
+
+    PROVIDER_SEND_SECONDS.observe(time.perf_counter() - send_started, provider=provider, outcome="failure")
+    logger.error(f"All {retries} attempts to send {description} have failed.")
+    return None
+
+
+class AsyncMailerSendClient:
+    def __init__(self, api_key: str, sender_email: str, http: httpx.AsyncClient,
+                 scheduler: Optional[ProviderScheduler] = None, base_url: str = MAILERSEND_API_URL):
+        self.api_key = api_key
+        self.sender_email = sender_email
+        self.endpoint = f"{base_url.rstrip('/')}/email"
+        self.http = http
+        self.scheduler = scheduler or get_scheduler("mailersend")
+
+    async def send_email(self, recipient_email: str, recipient_name: str, template_id: str,
+                         attachment_content: Optional[bytes] = None, attachment_filename: Optional[str] = None,
+                         retries: int = 3, backoff_factor: int = 2) -> bool:
+        payload = build_message(self.sender_email, recipient_email, recipient_name, template_id)
+        if attachment_content is not None:
+            payload["attachments"] = [encode_attachment(attachment_content, attachment_filename or "attachment.pdf")]
+
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        response = await post_with_retries(
+            self.http, self.endpoint, headers, payload, self.scheduler,
+            f"email to {recipient_email}", lambda r: 200 <= r.status_code < 300,
+            retries, backoff_factor
+        )
+        return response is not None
+
+
+def _cellcast_accepted(response: httpx.Response) -> bool:
+    return response.status_code == 200 and response.json().get("meta", {}).get("code") == 200
+
+
+class AsyncCellCastClient:
+    def __init__(self, app_key: str, http: httpx.AsyncClient, sender_id: Optional[str] = None,
+                 source: Optional[str] = None, custom_string: Optional[str] = None,
+                 scheduler: Optional[ProviderScheduler] = None, base_url: str = CELLCAST_API_URL):
+        self.app_key = app_key
+        self.sender_id = sender_id
+        self.source = source
+        self.custom_string = custom_string
+        self.endpoint = f"{base_url.rstrip('/')}/send-sms-template"
+        self.http = http
+        self.scheduler = scheduler or get_scheduler("cellcast")
+
+    async def send_sms_template(self, template_id: str, numbers: List[Dict[str, Any]],
+                                schedule_time: Optional[str] = None, delay: Optional[int] = None,
+                                retries: int = 3, backoff_factor: int = 2) -> bool:
+        payload = build_template_payload(
+            template_id, numbers, self.sender_id, self.source, self.custom_string, schedule_time, delay
+        )
+        headers = {
+            "APPKEY": self.app_key,
+            "Content-Type": "application/json"
+        }
+        response = await post_with_retries(
+            self.http, self.endpoint, headers, payload, self.scheduler,
+            f"template SMS to {len(numbers)} recipients", _cellcast_accepted,
+            retries, backoff_factor
+        )
+        return response is not None and all(template_results(response.json(), numbers))
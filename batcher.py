@@ -0,0 +1,119 @@
+# batcher.py
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Batcher:
+    def __init__(
+        self,
+        flush: Callable[[Hashable, List[Any]], List[Any]],
+        max_size: int = 100,
+        max_wait: float = 0.5,
+        max_pending: int = 10000,
+        flush_workers: int = 2,
+        name: str = "batcher"
+    ):
+        """
+        Groups submitted items by key and flushes each group as one batch.
+
+        A group is flushed when it reaches `max_size` items or when its oldest
+        item has waited `max_wait` seconds, whichever comes first.
+
+        Parameters:
+            - flush (callable): Called as flush(key, items) on a flush thread.
+              Must return one result per item, in order. A result that is an
+              exception is raised from that item's future; an exception raised
+              by flush itself is raised from every future in the batch.
+            - max_size (int, optional): Largest batch sent in one flush.
+            - max_wait (float, optional): Longest an item waits for its batch to fill.
+            - max_pending (int, optional): Items held in memory before submit() blocks.
+            - flush_workers (int, optional): Flushes that may run concurrently.
+            - name (str, optional): Used for thread names and log lines.
+        """
+        self.flush = flush
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.name = name
+
+        self._groups: Dict[Hashable, List[Tuple[Any, Future]]] = {}
+        self._deadlines: Dict[Hashable, float] = {}
+        self._cond = threading.Condition()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(flush_workers, thread_name_prefix=f"{name}-flush")
+        self._thread = None
+
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, key: Hashable, item: Any) -> Future:
+        """
+        Adds `item` to the batch for `key`.
+
+        Returns:
+            Future: Resolves to the flush result for this item.
+        """
+        self._slots.acquire()
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-timer", daemon=True)
+                self._thread.start()
+            group = self._groups.setdefault(key, [])
+            if not group:
+                self._deadlines[key] = time.monotonic() + self.max_wait
+            group.append((item, future))
+            if len(group) >= self.max_size:
+                self._dispatch(key)
+            else:
+                self._cond.notify()
+        return future
+
+    def pending(self) -> int:
+        with self._cond:
+            return sum(len(group) for group in self._groups.values())
+
+    def _dispatch(self, key: Hashable):
+        # Caller holds self._cond
+        entries = self._groups.pop(key)
+        del self._deadlines[key]
+        self.batches += 1
+        self.items += len(entries)
+        self._executor.submit(self._flush, key, entries)
+
+    def _flush(self, key: Hashable, entries: List[Tuple[Any, Future]]):
+        try:
+            results = self.flush(key, [item for item, _ in entries])
+            if len(results) != len(entries):
+                raise RuntimeError(f"{self.name} flush returned {len(results)} results for {len(entries)} items")
+        except Exception as e:
+            logger.exception(f"{self.name} flush of {len(entries)} items failed.")
+            for _, future in entries:
+                future.set_exception(e)
+        else:
+            for (_, future), result in zip(entries, results):
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            for _ in entries:
+                self._slots.release()
+
+    def _run(self):
+        with self._cond:
+            while True:
+                if not self._deadlines:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                due = [key for key, deadline in self._deadlines.items() if deadline <= now]
+                for key in due:
+                    self._dispatch(key)
+                if not due:
+                    self._cond.wait(min(self._deadlines.values()) - now)
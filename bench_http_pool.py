@@ -0,0 +1,82 @@
+# bench_http_pool.py
+#
+# Compares per-send latency of a fresh connection per request (module-level
+# requests.post, as the clients used to do) against the pooled keep-alive
+# session, using a local stub of the MailerSend endpoint.
+#
+#   python bench_http_pool.py --sends 500
+#
+# The stub is plain HTTP, so the numbers only show TCP connection reuse; the
+# saving against the real providers is larger because TLS is skipped too.
+
+import argparse
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from send_email import MailerSendClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"message": "ok"}).encode()
+        self.send_response(202)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/email"
+
+
+def summarize(label, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<24} mean {statistics.mean(latencies) * 1000:7.3f} ms   "
+          f"p50 {statistics.median(latencies) * 1000:7.3f} ms   p95 {p95 * 1000:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pooled vs unpooled provider send latency")
+    parser.add_argument("--sends", type=int, default=500)
+    args = parser.parse_args()
+
+    server, url = start_stub()
+    payload = {"to": [{"email": "bench@example.com"}], "template_id": "bench"}
+
+    unpooled = []
+    for _ in range(args.sends):
+        start = time.perf_counter()
+        requests.post(url, json=payload, timeout=(3.05, 15))
+        unpooled.append(time.perf_counter() - start)
+
+    # Same request through the session a MailerSendClient builds for itself
+    session = MailerSendClient("bench-key", "sender@example.com", pool_size=1).session
+    pooled = []
+    for _ in range(args.sends):
+        start = time.perf_counter()
+        session.post(url, json=payload, timeout=(3.05, 15))
+        pooled.append(time.perf_counter() - start)
+
+    server.shutdown()
+    summarize("requests.post (no pool)", unpooled)
+    summarize("pooled session", pooled)
+
+
+if __name__ == "__main__":
+    main()
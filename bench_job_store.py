@@ -0,0 +1,67 @@
+# bench_job_store.py
+#
+# Measures JobStore enqueue and claim throughput against a scratch database.
+#
+#   python bench_job_store.py --jobs 20000 --batch 500
+
+import argparse
+import os
+import tempfile
+import time
+
+from delivery import new_job
+from job_store import JobStore
+
+
+def make_jobs(count):
+    return [
+        new_job(
+            f"Customer {i}", f"customer{i}@example.com", "+61412345678",
+            f"CODE{i:08d}", "TEMPLATE_1ST_2WEEKS",
+            email_enabled=True, sms_enabled=True
+        )
+        for i in range(count)
+    ]
+
+
+def rate(count, seconds):
+    return count / seconds if seconds else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JobStore enqueue/claim benchmark")
+    parser.add_argument("--jobs", type=int, default=20000, help="Jobs per phase")
+    parser.add_argument("--batch", type=int, default=500, help="enqueue_many chunk and claim batch size")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = JobStore(os.path.join(tmp, "bench.db"))
+
+        jobs = make_jobs(args.jobs)
+        start = time.perf_counter()
+        for job in jobs:
+            store.enqueue(job)
+        single = time.perf_counter() - start
+
+        jobs = make_jobs(args.jobs)
+        start = time.perf_counter()
+        for i in range(0, len(jobs), args.batch):
+            store.enqueue_many(jobs[i:i + args.batch])
+        batched = time.perf_counter() - start
+
+        start = time.perf_counter()
+        claimed = 0
+        while True:
+            batch = store.claim(args.batch)
+            if not batch:
+                break
+            claimed += len(batch)
+        claim = time.perf_counter() - start
+
+    print(f"enqueue (one commit each):  {rate(args.jobs, single):10.0f} jobs/s")
+    print(f"enqueue_many ({args.batch}/commit): {rate(args.jobs, batched):10.0f} jobs/s")
+    print(f"claim ({args.batch}/UPDATE):       {rate(claimed, claim):10.0f} jobs/s ({claimed} claimed)")
+
+
+if __name__ == "__main__":
+    main()
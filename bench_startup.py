@@ -0,0 +1,193 @@
+# bench_startup.py
+#
+# Worker cold start: how long a new worker process takes from fork to its
+# first rendered voucher, and how much memory it holds on its own, when
+#
+#   cold     every worker imports the app and loads the voucher assets itself
+#   preload  the master loads them once (wsgi.py) and forks the workers, as
+#            under gunicorn.conf.py
+#
+# The import and create_app() cost of the app module is reported separately.
+# Each mode runs in a fresh interpreter so nothing is already imported.
+#
+#   python bench_startup.py --workers 4 --output startup.json
+#
+# Run it from a directory holding the voucher template and font. Memory
+# figures come from /proc/<pid>/smaps_rollup and are omitted elsewhere.
+
+import argparse
+import gc
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from bench_support import write_results
+
+HEAVY_MODULES = ("PIL", "fpdf", "fontTools")
+
+
+def memory() -> Dict[str, float]:
+    """Pss and private memory of this process in MB, or {} where /proc is unavailable."""
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            kb = {line.split(":")[0]: int(line.split()[1]) for line in f if line.rstrip().endswith(" kB")}
+    except OSError:
+        return {}
+    return {
+        "pss_mb": round(kb["Pss"] / 1024, 1),
+        "private_mb": round((kb["Private_Clean"] + kb["Private_Dirty"]) / 1024, 1),
+    }
+
+
+def first_render(started: float) -> Dict[str, Any]:
+    """Starts the worker's threads, renders one voucher and reports the time since `started`."""
+    import webhook_app
+    from create_voucher_pdf import render_voucher
+
+    webhook_app.start_background_tasks()
+    render_voucher("Startup Bench", f"STARTUP{os.getpid()}", include_jpg=True)
+    return {"ready_ms": round((time.perf_counter() - started) * 1000, 1), **memory()}
+
+
+def fork_workers(count: int, work: Callable[[float], Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Forks `count` workers at once; each runs work(fork time) and sends back its result."""
+    pipes = []
+    for _ in range(count):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            started = time.perf_counter()
+            os.close(read_fd)
+            try:
+                result = work(started)
+            except Exception as e:
+                result = {"error": repr(e)}
+            os.write(write_fd, json.dumps(result).encode("utf-8"))
+            os._exit(0)
+        os.close(write_fd)
+        pipes.append((pid, read_fd))
+
+    results = []
+    for pid, read_fd in pipes:
+        with os.fdopen(read_fd, "rb") as f:
+            results.append(json.loads(f.read() or b'{"error": "no result"}'))
+        os.waitpid(pid, 0)
+    return results
+
+
+def run_cold(workers: int) -> Dict[str, Any]:
+    def work(started):
+        import webhook_app
+        imported = time.perf_counter()
+        heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+        webhook_app.create_app(start_background=False)
+        created = time.perf_counter()
+        return {
+            "import_ms": round((imported - started) * 1000, 1),
+            "create_app_ms": round((created - imported) * 1000, 1),
+            "heavy_modules_after_import": heavy,
+            **first_render(started),
+        }
+
+    return {"workers": fork_workers(workers, work)}
+
+
+def run_preload(workers: int) -> Dict[str, Any]:
+    started = time.perf_counter()
+    import wsgi  # noqa: F401  create_app() and warm_up(), as in the gunicorn master
+    preloaded = time.perf_counter()
+    gc.collect()
+    gc.freeze()
+    return {
+        "master_preload_ms": round((preloaded - started) * 1000, 1),
+        "master": memory(),
+        "workers": fork_workers(workers, first_render),
+    }
+
+
+def summarize(workers: List[Dict[str, Any]]) -> Dict[str, Any]:
+    errors = [w["error"] for w in workers if "error" in w]
+    if errors:
+        raise RuntimeError(f"Worker failed: {errors[0]}")
+    summary = {}
+    if "heavy_modules_after_import" in workers[0]:
+        summary["heavy_modules_after_import"] = workers[0]["heavy_modules_after_import"]
+    for field in ("import_ms", "create_app_ms", "ready_ms", "pss_mb", "private_mb"):
+        values = [w[field] for w in workers if field in w]
+        if values:
+            summary[f"{field}_mean"] = round(statistics.mean(values), 1)
+            summary[f"{field}_max"] = round(max(values), 1)
+    return summary
+
+
+def child(mode: str, workers: int):
+    logging.disable(logging.INFO)
+    result = run_cold(workers) if mode == "cold" else run_preload(workers)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker startup time and memory, cold versus preloaded")
+    parser.add_argument("--workers", type=int, default=4, help="Workers forked at once")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per mode; the median run is reported")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--child", choices=("cold", "preload"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.workers)
+        return
+
+    from templates import ENV_TEMPLATE_IDS
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            JOB_STORE_PATH=os.path.join(workdir, "jobs.db"),
+            VOUCHER_CACHE_DIR=os.path.join(workdir, "voucher_cache"),
+            LOG_FILE=os.path.join(workdir, "app.log"),
+        )
+        env.setdefault("MAILERSEND_API_KEY", "bench-key")
+        env.setdefault("MAILERSEND_SENDER", "bench@example.com")
+        env.setdefault("CELLCAST_API_KEY", "bench-key")
+        for variables in ENV_TEMPLATE_IDS.values():
+            for variable in variables:
+                env.setdefault(variable, f"bench-{variable.lower()}")
+
+        for mode in ("cold", "preload"):
+            runs = []
+            for _ in range(args.repeat):
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--child", mode, "--workers", str(args.workers)],
+                    env=env, capture_output=True, text=True, check=True
+                ).stdout
+                run = json.loads(output.strip().splitlines()[-1])
+                run.update(summarize(run.pop("workers")))
+                runs.append(run)
+            runs.sort(key=lambda run: run["ready_ms_mean"])
+            results[mode] = runs[len(runs) // 2]
+
+    cold, preload = results["cold"], results["preload"]
+    print(f"app import           {cold['import_ms_mean']:8.1f} ms  "
+          f"(loaded after import: {', '.join(cold['heavy_modules_after_import']) or 'none of ' + '/'.join(HEAVY_MODULES)})")
+    print(f"create_app()         {cold['create_app_ms_mean']:8.1f} ms")
+    print(f"master preload       {preload['master_preload_ms']:8.1f} ms  (wsgi.py, once per deploy)")
+    for mode, run in results.items():
+        line = f"{mode:<8} fork to first render  mean {run['ready_ms_mean']:8.1f} ms  max {run['ready_ms_max']:8.1f} ms"
+        if "pss_mb_mean" in run:
+            line += f"   per worker: Pss {run['pss_mb_mean']:.1f} MB, private {run['private_mb_mean']:.1f} MB"
+        print(line)
+
+    if args.output:
+        write_results(args.output, "startup", {"workers": args.workers, "repeat": args.repeat}, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# bench_support.py
+#
+# Shared pieces for the bench_*.py scripts: local stubs of the provider APIs,
+# percentile summaries and JSON result files.
+#
+# The stubs can also run on their own, for load-testing a separately started
+# webhook (point MAILERSEND_API_URL / CELLCAST_API_URL at the printed URLs):
+#
+#   python bench_support.py --latency 0.08 --error-rate 0.01 --rate-limit-rate 0.02
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Sequence
+
+
+class ProviderStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0, port: int = 0):
+        """
+        Imitates MailerSend (/v1/email, /v1/bulk-email) and CellCast (/api/v3/send-sms-template).
+
+        Parameters:
+            - latency (float, optional): Mean seconds before each response.
+            - jitter (float, optional): Latency varies uniformly by +/- this much.
+            - error_rate (float, optional): Fraction of sends answered with HTTP 500.
+            - rate_limit_rate (float, optional): Fraction of sends answered with 429.
+            - retry_after (float, optional): Retry-After seconds sent with a 429.
+            - port (int, optional): Listen port; 0 picks a free one.
+        """
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def mailersend_url(self) -> str:
+        return f"{self.base_url}/v1"
+
+    @property
+    def cellcast_url(self) -> str:
+        return f"{self.base_url}/api/v3"
+
+    def count(self, key: str):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def start(self) -> "ProviderStubServer":
+        threading.Thread(target=self.serve_forever, name="provider-stub", daemon=True).start()
+        return self
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real providers
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        stub = self.server
+        if self.path not in ("/v1/email", "/v1/bulk-email", "/api/v3/send-sms-template"):
+            return self.reply(404, {"message": "not found"})
+
+        time.sleep(max(0.0, stub.latency + random.uniform(-stub.jitter, stub.jitter)))
+        roll = random.random()
+        if roll < stub.rate_limit_rate:
+            stub.count(f"{self.path} 429")
+            return self.reply(429, {"message": "Too Many Attempts."}, {"Retry-After": str(stub.retry_after)})
+        if roll < stub.rate_limit_rate + stub.error_rate:
+            stub.count(f"{self.path} 500")
+            return self.reply(500, {"message": "Server Error"})
+
+        stub.count(f"{self.path} ok")
+        if self.path == "/v1/email":
+            return self.reply(202, None, {"X-Message-Id": uuid.uuid4().hex})
+        if self.path == "/v1/bulk-email":
+            return self.reply(202, {"message": "The bulk email is being processed.", "bulk_email_id": uuid.uuid4().hex})
+
+        numbers = json.loads(body).get("numbers", [])
+        return self.reply(200, {
+            "meta": {"code": 200, "status": "SUCCESS"},
+            "msg": "Queued",
+            "data": {"messages": [{"message_id": uuid.uuid4().hex, "to": n.get("number")} for n in numbers]},
+        })
+
+    def do_GET(self):
+        # Bulk email status: always processed by the time it is polled
+        if not self.path.startswith("/v1/bulk-email/"):
+            return self.reply(404, {"message": "not found"})
+        self.server.count("/v1/bulk-email status")
+        self.reply(200, {"data": {"id": self.path.rsplit("/", 1)[-1], "state": "completed",
+                                  "validation_errors": None, "suppressed_recipients": None}})
+
+    def reply(self, status, payload, headers=None):
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def percentiles(samples: Sequence[float], points: Sequence[int] = (50, 95, 99)) -> Dict[str, float]:
+    """Nearest-rank percentiles of `samples`, in milliseconds, keyed "p50", "p95", ..."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{point}": None for point in points}
+    return {
+        f"p{point}": round(ordered[min(len(ordered) - 1, max(0, -(-len(ordered) * point // 100) - 1))] * 1000, 3)
+        for point in points
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def write_results(path: str, benchmark: str, params: Dict[str, Any], results: Dict[str, Any]):
+    """
+    Writes one benchmark run as JSON, tagged with the git revision, so runs
+    of different versions can be diffed.
+    """
+    document = {
+        "benchmark": benchmark,
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2)
+    print(f"Results written to {path}")
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Run local MailerSend and CellCast stubs.")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of HTTP 500 responses")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of HTTP 429 responses")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    stub = ProviderStubServer(args.latency, args.jitter, args.error_rate, args.rate_limit_rate,
+                              args.retry_after, args.port)
+    print(f"MAILERSEND_API_URL={stub.mailersend_url}")
+    print(f"CELLCAST_API_URL={stub.cellcast_url}")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(stub.counts, indent=2))
+
+
+if __name__ == "__main__":
+    main()
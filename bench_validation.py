@@ -0,0 +1,93 @@
+# bench_validation.py
+#
+# Rows per second through recipient validation: the old unnormalized checks,
+# validate_record() one row at a time (as the single webhook does), and
+# validate_batch() over a batch of rows (as the bulk import does).
+#
+#   python bench_validation.py --rows 50000 --output validation.json
+
+import argparse
+import random
+import re
+import time
+
+from bench_support import write_results
+from validation import validate_batch, validate_record
+
+PHONE_FORMS = ("0412 345 {:03d}", "+61412345{:03d}", "61 412 345 {:03d}", "(04) 1234 5{:03d}", "412345{:03d}", "12345")
+EMAIL_FORMS = ("Customer{}@Example.com", " customer{}@example.com.au ", "customer{}@example", "")
+
+
+def make_rows(count, seed=1):
+    rng = random.Random(seed)
+    return [
+        {
+            "name": f"Customer {i}",
+            "email": rng.choice(EMAIL_FORMS).format(i),
+            "phone": rng.choice(PHONE_FORMS).format(i % 1000),
+            "voucherCode": f"CODE{i:08d}" if rng.random() > 0.01 else "",
+            "templateType": "TEMPLATE_1MONTH",
+        }
+        for i in range(count)
+    ]
+
+
+def legacy(rows):
+    """The checks webhook_app.py used to make: re.match on pattern strings, no normalization."""
+    results = []
+    for row in rows:
+        email = (row.get("email") or "").strip()
+        phone = (row.get("phone") or "").strip()
+        results.append((
+            bool(email) and bool(re.match(r'^\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', email)),
+            bool(phone) and bool(re.match(r'^\+?61\d{9}$', phone)),
+        ))
+    return results
+
+
+def per_row(rows):
+    """One validate_record() call per row, as each /birthday-webhook request makes."""
+    return [validate_record(row) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recipient validation throughput")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--batch", type=int, default=500, help="Rows per validate_batch call (BULK_BATCH_SIZE)")
+    parser.add_argument("--repeat", type=int, default=3, help="Best of this many runs")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+
+    def best(fn):
+        times = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - started)
+        return min(times)
+
+    legacy_seconds = best(lambda: legacy(rows))
+    row_seconds = best(lambda: per_row(rows))
+    batch_seconds = best(lambda: [validate_batch(rows[i:i + args.batch]) for i in range(0, len(rows), args.batch)])
+
+    checked = validate_batch(rows)
+    results = {
+        "legacy_rows_per_s": round(args.rows / legacy_seconds),
+        "per_row_rows_per_s": round(args.rows / row_seconds),
+        "batch_rows_per_s": round(args.rows / batch_seconds),
+        "rejected": sum(1 for row in checked if row["error"]),
+        "with_warnings": sum(1 for row in checked if row["warnings"]),
+    }
+    print(f"legacy (no normalization) {results['legacy_rows_per_s']:>10,} rows/s")
+    print(f"per row                  {results['per_row_rows_per_s']:>10,} rows/s")
+    print(f"validate_batch           {results['batch_rows_per_s']:>10,} rows/s  (batches of {args.batch})")
+    print(f"{results['rejected']} of {args.rows} rows rejected, {results['with_warnings']} with a dropped channel")
+
+    if args.output:
+        write_results(args.output, "validation", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
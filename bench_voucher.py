@@ -0,0 +1,148 @@
+# bench_voucher.py
+#
+# Micro-benchmarks for the voucher hot path: rendering (per stage), the disk
+# wrapper generate_voucher_pdf, encoding the PDF as a MailerSend attachment
+# (base64 plus the JSON body requests builds from it), and the time and bytes
+# of each encoding mode (raster or vector PDF, JPEG or WebP SMS image, with
+# and without a target size).
+#
+#   python bench_voucher.py --iterations 50 --target-bytes 102400 --output voucher.json
+#
+# Run it from a directory holding the voucher template and font.
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from bench_support import percentiles, write_results
+from create_voucher_pdf import Encoding, generate_voucher_pdf, get_renderer, render_voucher
+from send_email import build_message, encode_attachment
+
+
+def measure(fn: Callable[[int], None], iterations: int) -> List[float]:
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def summary(samples: List[float]) -> Dict[str, float]:
+    return {"mean_ms": round(statistics.mean(samples) * 1000, 3), **percentiles(samples)}
+
+
+def encoding_modes(target_bytes: int) -> Dict[str, Encoding]:
+    return {
+        "raster_jpeg": Encoding(),
+        "vector_jpeg": Encoding(pdf_mode="vector"),
+        "vector_webp": Encoding(pdf_mode="vector", image_format="webp"),
+        "vector_jpeg_target": Encoding(pdf_mode="vector", image_target_bytes=target_bytes),
+        "vector_webp_target": Encoding(pdf_mode="vector", image_format="webp", image_target_bytes=target_bytes),
+    }
+
+
+def bench_encoding(encoding: Encoding, iterations: int) -> Dict[str, object]:
+    """Render time with and without the SMS image, and the size of what each mode sends."""
+    both = summary(measure(
+        lambda i: render_voucher(f"Customer {i}", f"BENCH{i:06d}", include_jpg=True, encoding=encoding), iterations
+    ))
+    pdf_only = summary(measure(
+        lambda i: render_voucher(f"Customer {i}", f"BENCH{i:06d}", encoding=encoding), iterations
+    ))
+    pdf_bytes, image_bytes = render_voucher("Customer", "BENCH000000", include_jpg=True, encoding=encoding)
+    return {
+        "render_ms": both["mean_ms"],
+        "render_p95_ms": both["p95"],
+        "pdf_only_ms": pdf_only["mean_ms"],
+        "pdf_bytes": len(pdf_bytes),
+        # What one email carries: the PDF after base64, inside the JSON body
+        "attachment_bytes": len(json.dumps(encode_attachment(pdf_bytes, "voucher_BENCH000000.pdf"))),
+        "image_bytes": len(image_bytes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Voucher render and attachment encode micro-benchmarks")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--target-bytes", type=int, default=100 * 1024,
+                        help="SMS image size target for the *_target encoding modes")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = {}
+
+    # Cold start: template decode and font parsing on first use
+    started = time.perf_counter()
+    get_renderer().acquire()
+    results["renderer_warm_up_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    stage_samples: Dict[str, List[float]] = {}
+
+    def render(i):
+        timings = {}
+        render_voucher(f"Customer {i}", f"BENCH{i:06d}", include_jpg=True, timings=timings)
+        for stage, seconds in timings.items():
+            stage_samples.setdefault(stage, []).append(seconds)
+
+    results["render_voucher"] = summary(measure(render, args.iterations))
+    results["render_stages"] = {stage: summary(samples) for stage, samples in stage_samples.items()}
+
+    # generate_voucher_pdf also writes into ./pdf, so run it inside a scratch
+    # directory, with the template and font pinned to where they are now
+    renderer = get_renderer()
+    renderer.image_path = os.path.abspath(renderer.image_path)
+    renderer.font_path = os.path.abspath(renderer.font_path)
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            results["generate_voucher_pdf"] = summary(measure(
+                lambda i: generate_voucher_pdf(f"Customer {i}", f"BENCH{i:06d}", output_dir="vouchers"),
+                args.iterations
+            ))
+        finally:
+            os.chdir(cwd)
+
+    pdf_bytes, _ = render_voucher("Customer", "BENCH000000")
+    message = build_message("sender@example.com", "customer@example.com", "Customer", "template")
+
+    def encode(_):
+        payload = dict(message, attachments=[encode_attachment(pdf_bytes, "voucher_BENCH000000.pdf")])
+        json.dumps(payload)
+
+    results["attachment_encode"] = summary(measure(encode, args.iterations * 10))
+    results["attachment_encode"]["pdf_bytes"] = len(pdf_bytes)
+
+    results["encodings"] = {
+        mode: bench_encoding(encoding, args.iterations)
+        for mode, encoding in encoding_modes(args.target_bytes).items()
+    }
+
+    for label, stats in [("render_voucher", results["render_voucher"])] + \
+            [(f"  {stage}", stats) for stage, stats in results["render_stages"].items()] + \
+            [("generate_voucher_pdf", results["generate_voucher_pdf"]),
+             ("attachment_encode", results["attachment_encode"])]:
+        print(f"{label:<22} mean {stats['mean_ms']:8.3f} ms   p50 {stats['p50']:8.3f}   "
+              f"p95 {stats['p95']:8.3f}   p99 {stats['p99']:8.3f}")
+    print(f"renderer warm-up {results['renderer_warm_up_ms']:.1f} ms, PDF {len(pdf_bytes)} bytes")
+
+    print(f"\n{'encoding':<20} {'render ms':>10} {'pdf only ms':>12} {'pdf bytes':>10} "
+          f"{'attachment':>11} {'image bytes':>12}")
+    for mode, stats in results["encodings"].items():
+        print(f"{mode:<20} {stats['render_ms']:10.2f} {stats['pdf_only_ms']:12.2f} {stats['pdf_bytes']:10d} "
+              f"{stats['attachment_bytes']:11d} {stats['image_bytes']:12d}")
+
+    if args.output:
+        write_results(args.output, "voucher",
+                      {"iterations": args.iterations, "target_bytes": args.target_bytes}, results)
+
+
+if __name__ == "__main__":
+    main()
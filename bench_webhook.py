@@ -0,0 +1,176 @@
+# bench_webhook.py
+#
+# Load test for POST /birthday-webhook against local provider stubs.
+#
+#   python bench_webhook.py --rps 50 --duration 20 --latency 0.08 --rate-limit-rate 0.02 --output webhook.json
+#
+# By default the Flask app runs in this process with a scratch job store and
+# voucher cache, and its MailerSend/CellCast clients point at stubs from
+# bench_support.py. Run it from a directory holding the voucher template and
+# font. With --url an already running webhook is driven instead (start the
+# stubs with `python bench_support.py` and point the app at them).
+#
+# Requests are sent open-loop: request i is due at start + i / rps whatever
+# happened to earlier ones, and latency is measured from that due time, so a
+# stall shows up in the percentiles instead of silently lowering the rate.
+
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench_support import ProviderStubServer, percentiles, write_results
+from templates import ENV_TEMPLATE_IDS
+
+_local = threading.local()
+
+
+def session() -> requests.Session:
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def start_app(stub: ProviderStubServer, workdir: str, token: str) -> str:
+    """Builds the webhook app configured for the stubs and serves it on a free port."""
+    os.environ.update(
+        MAILERSEND_API_URL=stub.mailersend_url,
+        CELLCAST_API_URL=stub.cellcast_url,
+        WEBHOOK_SECRET_TOKEN=token,
+        JOB_STORE_PATH=os.path.join(workdir, "jobs.db"),
+        VOUCHER_CACHE_DIR=os.path.join(workdir, "voucher_cache"),
+    )
+    os.environ.setdefault("MAILERSEND_API_KEY", "bench-key")
+    os.environ.setdefault("MAILERSEND_SENDER", "bench@example.com")
+    os.environ.setdefault("CELLCAST_API_KEY", "bench-key")
+    for variables in ENV_TEMPLATE_IDS.values():
+        for variable in variables:
+            os.environ.setdefault(variable, f"bench-{variable.lower()}")
+    # Measure the pipeline rather than the production rate limits, unless they are set explicitly
+    os.environ.setdefault("MAILERSEND_RATE_PER_SEC", "1000")
+    os.environ.setdefault("MAILERSEND_BURST", "100")
+    os.environ.setdefault("CELLCAST_RATE_PER_SEC", "1000")
+    os.environ.setdefault("CELLCAST_BURST", "100")
+
+    from werkzeug.serving import make_server
+    import webhook_app
+
+    server = make_server("127.0.0.1", 0, webhook_app.create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, name="webhook", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def post_one(url, token, payload, due):
+    delay = due - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+    try:
+        response = session().post(
+            f"{url}/birthday-webhook", json=payload,
+            headers={"Authorization": token, "Idempotency-Key": payload["voucherCode"]}, timeout=30
+        )
+        status = response.status_code
+    except requests.exceptions.RequestException:
+        status = "error"
+    return time.perf_counter() - due, status
+
+
+def wait_for_drain(url, timeout):
+    """Waits until the job store has nothing queued or running. Returns the jobs by state."""
+    deadline = time.monotonic() + timeout
+    while True:
+        jobs = session().get(f"{url}/health", timeout=10).json().get("jobs", {})
+        if not jobs.get("queued") and not jobs.get("running"):
+            return jobs
+        if time.monotonic() > deadline:
+            return jobs
+        time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook load test against local provider stubs")
+    parser.add_argument("--rps", type=float, default=20, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load")
+    parser.add_argument("--concurrency", type=int, default=64, help="Most requests in flight")
+    parser.add_argument("--url", help="Drive this running webhook instead of an in-process one")
+    parser.add_argument("--token", default=os.getenv("WEBHOOK_SECRET_TOKEN", "bench-token"))
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub mean latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Stub fraction of HTTP 500s")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Stub fraction of HTTP 429s")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="Seconds to wait for deliveries")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's INFO logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    stub = None
+    workdir = tempfile.TemporaryDirectory()
+    url = args.url
+    if not url:
+        stub = ProviderStubServer(args.latency, args.jitter, args.error_rate, args.rate_limit_rate).start()
+        url = start_app(stub, workdir.name, args.token)
+
+    run_id = uuid.uuid4().hex[:8]
+    total = int(args.rps * args.duration)
+    latencies, statuses = [], {}
+    started = time.perf_counter() + 0.1
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        futures = []
+        for i in range(total):
+            payload = {
+                "name": f"Bench {i}",
+                "email": f"bench{i}@example.com",
+                "phone": f"+614{i % 100000000:08d}",
+                "voucherCode": f"B{run_id}{i:07d}",
+                "templateType": "TEMPLATE_1ST_2WEEKS",
+            }
+            futures.append(pool.submit(post_one, url, args.token, payload, started + i / args.rps))
+        for future in futures:
+            latency, status = future.result()
+            latencies.append(latency)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+    sent_for = time.perf_counter() - started
+
+    jobs = wait_for_drain(url, args.drain_timeout)
+    drained_after = time.perf_counter() - started
+
+    accepted = statuses.get("202", 0) + statuses.get("200", 0)
+    results = {
+        "requests": total,
+        "seconds": round(sent_for, 3),
+        "throughput_rps": round(total / sent_for, 2) if sent_for else None,
+        "latency_ms": percentiles(latencies),
+        "statuses": statuses,
+        "error_rate": round(1 - accepted / total, 4) if total else 0,
+        "jobs": jobs,
+        "delivered_after_s": round(drained_after, 3),
+        "stub_calls": dict(stub.counts) if stub else None,
+    }
+
+    print(f"{total} requests in {sent_for:.2f}s ({results['throughput_rps']} req/s, target {args.rps})")
+    print("latency " + "   ".join(f"{k} {v:.2f} ms" for k, v in results["latency_ms"].items() if v is not None))
+    print(f"statuses {statuses}   error rate {results['error_rate']:.2%}")
+    print(f"jobs {jobs} after {drained_after:.2f}s")
+    if stub:
+        print(f"stub calls {stub.counts}")
+
+    if args.output:
+        params = {key: value for key, value in vars(args).items() if key not in ("token", "output")}
+        write_results(args.output, "webhook", params, results)
+
+    if stub:
+        stub.shutdown()
+    workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
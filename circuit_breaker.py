@@ -0,0 +1,266 @@
+# circuit_breaker.py
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Numeric state for metrics
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending while a provider's breaker is open. Nothing was sent."""
+
+    def __init__(self, name: str, retry_in: float = 0.0):
+        super().__init__(f"{name} circuit is open; retry in {retry_in:.1f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        failure_rate: float = 0.5,
+        window: float = 60.0,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 1
+    ):
+        """
+        Circuit breaker shared by every call to one provider.
+
+        Closed, calls go through and their outcomes are kept for a rolling
+        `window`. Once the window holds at least `failure_threshold` failures
+        and they make up at least `failure_rate` of its calls, the breaker
+        opens: calls are refused without touching the network for
+        `open_seconds`. It then goes half-open and lets `half_open_calls`
+        probes through; a successful probe closes it, a failed one opens it
+        again. Listeners added with on_recover() are told when it goes
+        half-open and when it closes, so work parked meanwhile can be replayed.
+
+        Parameters:
+            - name (str): Provider name, used in logs and stats.
+            - failure_threshold (int, optional): Failures in the window needed to open.
+            - failure_rate (float, optional): Share of the window's calls that must have failed.
+            - window (float, optional): Seconds of outcomes considered.
+            - open_seconds (float, optional): Seconds calls are refused before probing.
+            - half_open_calls (int, optional): Probes allowed at once while half-open.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self.state = CLOSED
+        self._outcomes: Deque[Tuple[float, bool]] = deque()  # (time, failed)
+        self._failures = 0
+        self._opened_until = 0.0
+        self._probes = 0
+        self._timer = None
+        self._listeners: List[Callable[["CircuitBreaker", str], None]] = []
+        self._lock = threading.Lock()
+
+        self.opened = 0
+        self.rejected = 0
+
+    def on_recover(self, listener: Callable[["CircuitBreaker", str], None]):
+        """
+        Calls listener(breaker, state) whenever the breaker goes half-open or
+        closes, on whichever thread made the change. Adding a listener twice
+        has no effect.
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def allow(self) -> bool:
+        """
+        Takes permission for one call.
+
+        Returns:
+            bool: False if the call must not be made. A call that was allowed
+            reports its outcome with record_success(), record_failure() or release().
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() >= self._opened_until:
+                changed = self._set_state(HALF_OPEN)
+            else:
+                changed = None
+            if self.state == CLOSED:
+                allowed = True
+            elif self.state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                allowed = True
+            else:
+                self.rejected += 1
+                allowed = False
+        self._notify(changed)
+        return allowed
+
+    def attempt(self) -> "Attempt":
+        """
+        Takes permission for one call and returns it as an Attempt, to be used
+        as a context manager around the call.
+
+        Raises:
+            CircuitOpenError: If the call must not be made.
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_in())
+        return Attempt(self)
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == OPEN and time.monotonic() < self._opened_until
+
+    def retry_in(self) -> float:
+        """Seconds until the breaker lets a probe through."""
+        with self._lock:
+            return max(0.0, self._opened_until - time.monotonic()) if self.state == OPEN else 0.0
+
+    def record_success(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                changed = self._set_state(CLOSED)
+            else:
+                changed = None
+                self._record(False)
+        self._notify(changed)
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trip()
+            elif self.state == CLOSED:
+                self._record(True)
+                calls = len(self._outcomes)
+                if self._failures >= self.failure_threshold and self._failures >= self.failure_rate * calls:
+                    self._trip()
+
+    def release(self):
+        """Ends an allowed call whose outcome says nothing about the provider's health, e.g. a 429."""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def _record(self, failed: bool):
+        # Caller holds self._lock
+        now = time.monotonic()
+        self._outcomes.append((now, failed))
+        self._failures += failed
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            _, old_failed = self._outcomes.popleft()
+            self._failures -= old_failed
+
+    def _trip(self):
+        # Caller holds self._lock
+        self._set_state(OPEN)
+        self.opened += 1
+        self._opened_until = time.monotonic() + self.open_seconds
+        # Nothing may call allow() while every send is parked, so a timer
+        # moves the breaker to half-open and tells the listeners.
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.open_seconds, self._half_open_when_due)
+        self._timer.daemon = True
+        self._timer.start()
+        logger.error(f"{self.name} circuit opened; refusing calls for {self.open_seconds:.0f}s")
+
+    def _half_open_when_due(self):
+        with self._lock:
+            due = self.state == OPEN and time.monotonic() >= self._opened_until
+            changed = self._set_state(HALF_OPEN) if due else None
+        self._notify(changed)
+
+    def _set_state(self, state: str) -> str:
+        # Caller holds self._lock
+        self.state = state
+        self._probes = 0
+        self._outcomes.clear()
+        self._failures = 0
+        if state != OPEN:
+            logger.warning(f"{self.name} circuit {state.replace('_', '-')}")
+        return state
+
+    def _notify(self, state):
+        if state is None:
+            return
+        for listener in self._listeners:
+            try:
+                listener(self, state)
+            except Exception:
+                logger.exception(f"{self.name} circuit listener failed.")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "state_code": STATE_CODES[self.state],
+                "calls": len(self._outcomes),
+                "failures": self._failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "open_for": max(0.0, round(self._opened_until - time.monotonic(), 2)) if self.state == OPEN else 0.0,
+            }
+
+
+class Attempt:
+    """
+    One call allowed by a breaker. Only its first success(), failure() or
+    release() reaches the breaker, and leaving the `with` block without any
+    of them (an unexpected exception, a cancelled task) releases it, so a
+    half-open probe slot is never lost.
+    """
+
+    def __init__(self, breaker: CircuitBreaker):
+        self._breaker = breaker
+        self.settled = False
+
+    def success(self):
+        self._settle(self._breaker.record_success)
+
+    def failure(self):
+        self._settle(self._breaker.record_failure)
+
+    def release(self):
+        self._settle(self._breaker.release)
+
+    def _settle(self, report: Callable[[], None]):
+        if not self.settled:
+            self.settled = True
+            report()
+
+    def __enter__(self) -> "Attempt":
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        self.release()
+        return False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str, **options) -> CircuitBreaker:
+    """Returns the process-wide breaker for a provider, creating it with `options` on first use."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, **options)
+        return breaker
+
+
+def all_breakers() -> Dict[str, CircuitBreaker]:
+    with _breakers_lock:
+        return dict(_breakers)
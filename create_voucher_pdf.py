@@ -1,65 +1,509 @@
-from PIL import Image, ImageDraw, ImageFont
-from fpdf import FPDF
+# Pillow and fpdf are imported on first render (see warm_up()), so importing
+# this module stays cheap for processes that never render.
+import atexit
+import hashlib
+import io
 import os
 import logging
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
-def generate_voucher_pdf(name, voucher_code, output_dir='vouchers'):
-    try:
-        # Create output directories
-        os.makedirs(output_dir, exist_ok=True)
-        new_jpg_output_dir = 'pdf'
-        os.makedirs(new_jpg_output_dir, exist_ok=True)
+# Base image
+IMAGE_PATH = os.path.join('assests', 'voucher_new.jpg')
+
+# Update the font path here
+FONT_PATH = os.path.join('path', 'to', 'your', 'font', 'DejaVuSans-Bold.ttf')  # Adjust this path
+
+# Font sizes
+FONT_SIZE_NAME = 80
+FONT_SIZE_CODE = 60
+
+# Bump when the rendering code changes its output, to invalidate cached vouchers
+RENDER_VERSION = 1
+
+# The PDF page is the base image printed at this resolution
+PDF_DPI = 300
+MM_PER_INCH = 25.4
+
+PDF_MODES = ("raster", "vector")
+IMAGE_MIMETYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+IMAGE_EXTENSIONS = {"jpeg": "jpg", "webp": "webp"}
+
+# Lowest quality the target-bytes search goes down to
+MIN_IMAGE_QUALITY = 10
+
+# WebP encoder effort, 0-6. Pillow's default of 4 is about 2.5x slower than 2
+# for files only ~1% smaller.
+WEBP_METHOD = 2
+
+# Characters kept in the cut-down font used for vector PDF text: Latin
+# (through Latin Extended-B) plus typographic punctuation. Text with anything
+# else is drawn with the full font file.
+PDF_FONT_CODEPOINTS = frozenset(
+    list(range(0x20, 0x7F)) + list(range(0xA0, 0x250))
+    + [0x2013, 0x2014, 0x2018, 0x2019, 0x201C, 0x201D, 0x2026, 0x20AC]
+)
+
+
+@dataclass(frozen=True)
+class TextLayout:
+    """Where the name and code are drawn, as fractions of the image size, and how large."""
+    name_x: float = 0.415
+    name_y: float = 0.293
+    code_x: float = 0.469
+    code_y: float = 0.424
+    font_size_name: int = FONT_SIZE_NAME
+    font_size_code: int = FONT_SIZE_CODE
+
+
+DEFAULT_LAYOUT = TextLayout()
+
+
+@dataclass(frozen=True)
+class Encoding:
+    """
+    How a rendered voucher is encoded.
+
+    pdf_mode "raster" embeds the drawn voucher as one JPEG. "vector" embeds the
+    base image, encoded once per renderer, and draws the name and code as PDF
+    text in an embedded subset of the template font, so the PDF needs no
+    per-voucher JPEG and the text stays sharp at a lower pdf_quality.
+
+    The SMS image is a JPEG or WebP at image_quality, or, when
+    image_target_bytes is set, at the highest quality (down to
+    MIN_IMAGE_QUALITY) that fits in that many bytes.
+    """
+    pdf_mode: str = "raster"
+    pdf_quality: int = 30
+    image_format: str = "jpeg"
+    image_quality: int = 30
+    image_target_bytes: int = 0
+
+    def __post_init__(self):
+        if self.pdf_mode not in PDF_MODES:
+            raise ValueError(f"pdf_mode must be one of {', '.join(PDF_MODES)}, got {self.pdf_mode!r}")
+        if self.image_format not in IMAGE_MIMETYPES:
+            raise ValueError(f"image_format must be one of {', '.join(IMAGE_MIMETYPES)}, got {self.image_format!r}")
+        for field in ("pdf_quality", "image_quality"):
+            if not 1 <= getattr(self, field) <= 100:
+                raise ValueError(f"{field} must be between 1 and 100, got {getattr(self, field)}")
+
+    @classmethod
+    def from_settings(cls, settings) -> "Encoding":
+        """Builds the encoding from the VOUCHER_PDF_* and VOUCHER_IMAGE_* fields of a Settings."""
+        return cls(
+            pdf_mode=settings.voucher_pdf_mode,
+            pdf_quality=settings.voucher_pdf_quality,
+            image_format=settings.voucher_image_format,
+            image_quality=settings.voucher_image_quality,
+            image_target_bytes=settings.voucher_image_target_bytes,
+        )
+
+    def version(self) -> str:
+        return f"{self.pdf_mode}:{self.pdf_quality}:{self.image_format}:{self.image_quality}:{self.image_target_bytes}"
+
+
+_encoding = Encoding()
+
+
+def set_encoding(encoding: Encoding):
+    """Sets how this process encodes vouchers. Cached vouchers encoded differently are not reused."""
+    global _encoding
+    _encoding = encoding
+
+
+def get_encoding() -> Encoding:
+    return _encoding
+
+
+class VoucherRenderer:
+    """
+    Holds the decoded voucher base image and font faces for the whole process.
+
+    The base image is decoded and the fonts are parsed once; every render gets
+    a cheap copy of the pixel buffer. Assets are reloaded only when the mtime
+    of the image or font file changes.
+
+    fpdf2 parses the font file again for every vector PDF, so those use a copy
+    of the font cut down once to PDF_FONT_CODEPOINTS (see pdf_font()).
+    """
+
+    def __init__(
+        self,
+        image_path: str = IMAGE_PATH,
+        font_path: str = FONT_PATH,
+        layout: TextLayout = DEFAULT_LAYOUT
+    ):
+        self.image_path = image_path
+        self.font_path = font_path
+        self.layout = layout
+
+        self._lock = threading.Lock()
+        self._image = None
+        self._font_name = None
+        self._font_code = None
+        self._mtimes = None
+        self._base_jpegs: Dict[int, bytes] = {}  # quality -> base image without text, for vector PDFs
+        self._pdf_font = None  # Path of the cut-down font, for vector PDFs
+
+        self.hits = 0
+        self.misses = 0
+
+    def _asset_mtimes(self):
+        return (
+            os.stat(self.image_path).st_mtime_ns,
+            os.stat(self.font_path).st_mtime_ns,
+        )
+
+    def _load(self, mtimes):
+        from PIL import Image, ImageFont
+
+        with Image.open(self.image_path) as image:
+            image.load()  # Force the decode now rather than on first copy
+            self._image = image.copy()
+        self._font_name = ImageFont.truetype(self.font_path, self.layout.font_size_name)
+        self._font_code = ImageFont.truetype(self.font_path, self.layout.font_size_code)
+        self._mtimes = mtimes
+        self._base_jpegs = {}
+        self._pdf_font = None
+        logger.info(f"Loaded voucher assets from {self.image_path} and {self.font_path}")
+
+    def acquire(self):
+        """
+        Returns a private copy of the base image plus the shared font faces.
+
+        Returns:
+            tuple: (image, font_name, font_code)
+        """
+        mtimes = self._asset_mtimes()
+        with self._lock:
+            if self._image is None or mtimes != self._mtimes:
+                self.misses += 1
+                self._load(mtimes)
+            else:
+                self.hits += 1
+            return self._image.copy(), self._font_name, self._font_code
+
+    def base_jpeg(self, quality: int) -> bytes:
+        """The base image without text as a JPEG, encoded once per quality and reused by every vector PDF."""
+        mtimes = self._asset_mtimes()
+        with self._lock:
+            if self._image is None or mtimes != self._mtimes:
+                self.misses += 1
+                self._load(mtimes)  # Also drops JPEGs of the old image
+            jpeg = self._base_jpegs.get(quality)
+            if jpeg is None:
+                jpeg = self._base_jpegs[quality] = encode_image(self._image, "jpeg", quality)
+            return jpeg
+
+    def pdf_font(self, texts: Iterable[str]) -> str:
+        """
+        Path of the font file to draw `texts` into a vector PDF with: the
+        cut-down copy, made once per font, when every character is in it, else
+        the full font file.
+        """
+        if any(ord(char) not in PDF_FONT_CODEPOINTS for text in texts for char in text):
+            return self.font_path
+        mtimes = self._asset_mtimes()
+        with self._lock:
+            if self._image is None or mtimes != self._mtimes:
+                self.misses += 1
+                self._load(mtimes)  # Also drops the cut-down copy of the old font
+            if self._pdf_font is None:
+                self._pdf_font = _subset_font(self.font_path, mtimes[1])
+            return self._pdf_font
+
+    def asset_version(self):
+        """
+        Identifies the current template assets, layout and encoding.
+
+        Anything rendered under a different version may look different, so
+        caches of rendered vouchers include it in their keys.
+        """
+        image_mtime, font_mtime = self._asset_mtimes()
+        layout = self.layout
+        return (
+            f"{RENDER_VERSION}:{self.image_path}:{image_mtime}:{self.font_path}:{font_mtime}:"
+            f"{layout.font_size_name}:{layout.font_size_code}:"
+            f"{layout.name_x}:{layout.name_y}:{layout.code_x}:{layout.code_y}:{_encoding.version()}"
+        )
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
 
-        # Open base image
-        img_path = 'assests/voucher_new.jpg'
-        image = Image.open(img_path)
-        img_width, img_height = image.size
-        draw = ImageDraw.Draw(image)
 
-        # Font sizes
-        font_size_name = 80
-        font_size_code = 60
+_renderers: Dict[Tuple[str, str, TextLayout], VoucherRenderer] = {}
+_renderer_lock = threading.Lock()
 
-        # Update the font path here
-        font_path = os.path.join('path', 'to', 'your', 'font', 'DejaVuSans-Bold.ttf')  # Adjust this path
-        font_name = ImageFont.truetype(font_path, font_size_name)
-        font_code = ImageFont.truetype(font_path, font_size_code)
 
-        # --- Relative positioning ---
-        name_rel_x, name_rel_y = 0.415, 0.293
-        code_rel_x, code_rel_y = 0.469, 0.424
+def get_renderer(
+    image_path: str = IMAGE_PATH,
+    font_path: str = FONT_PATH,
+    layout: TextLayout = DEFAULT_LAYOUT
+) -> VoucherRenderer:
+    """Returns the process-wide VoucherRenderer for this artwork, creating it on first use."""
+    key = (image_path, font_path, layout)
+    renderer = _renderers.get(key)
+    if renderer is None:
+        with _renderer_lock:
+            renderer = _renderers.get(key)
+            if renderer is None:
+                renderer = _renderers[key] = VoucherRenderer(image_path, font_path, layout)
+    return renderer
 
-        name_x = int(name_rel_x * img_width)
-        name_y = int(name_rel_y * img_height)
-        code_x = int(code_rel_x * img_width)
-        code_y = int(code_rel_y * img_height)
 
+_font_dir = None
+_font_dir_lock = threading.Lock()
+
+
+def _remove_font_dir(path, owner_pid):
+    # Forked workers inherit the atexit hook; only the process that made the directory removes it
+    if os.getpid() == owner_pid:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _subset_font(font_path: str, font_mtime: int) -> str:
+    """Writes a copy of the font holding only PDF_FONT_CODEPOINTS to a temporary directory and returns its path."""
+    from fontTools import subset, ttLib
+
+    global _font_dir
+    with _font_dir_lock:
+        if _font_dir is None:
+            _font_dir = tempfile.mkdtemp(prefix="voucher-fonts-")
+            atexit.register(_remove_font_dir, _font_dir, os.getpid())
+    digest = hashlib.sha1(f"{os.path.abspath(font_path)}:{font_mtime}".encode("utf-8")).hexdigest()
+    path = os.path.join(_font_dir, f"{digest}.ttf")
+    if not os.path.exists(path):
+        font = ttLib.TTFont(font_path, recalcTimestamp=False)
+        # PDF text is neither hinted nor shaped, so those tables only cost parse time
+        options = subset.Options(
+            notdef_outline=True, hinting=False, layout_features=[], name_IDs=["*"], name_languages=["*"]
+        )
+        options.drop_tables += ["FFTM"]
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=PDF_FONT_CODEPOINTS)
+        subsetter.subset(font)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        font.save(tmp_path)
+        os.replace(tmp_path, path)
+        logger.info(f"Cut {font_path} down to {os.path.getsize(path)} bytes for vector PDFs")
+    return path
+
+
+def _lap(timings, stage, started):
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + (now - started)
+    return now
+
+
+def warm_up(renderers: Optional[Iterable[VoucherRenderer]] = None):
+    """
+    Imports Pillow and fpdf and loads the voucher assets now instead of on the
+    first render. Called before forking workers so they share it all.
+
+    Parameters:
+        - renderers (iterable, optional): Renderers to load; defaults to the
+          default artwork.
+    """
+    import fpdf  # noqa: F401
+    from PIL import ImageDraw  # noqa: F401
+
+    for renderer in renderers or [get_renderer()]:
+        renderer.acquire()
+        if _encoding.pdf_mode == "vector":
+            renderer.base_jpeg(_encoding.pdf_quality)
+            renderer.pdf_font(())
+
+
+# (format, quality, target bytes) -> quality the last target-bytes search settled on
+_quality_hints: Dict[Tuple[str, int, int], int] = {}
+
+
+def encode_image(image, image_format: str = "jpeg", quality: int = 30, target_bytes: int = 0) -> bytes:
+    """
+    Encodes a Pillow image as JPEG or WebP.
+
+    Parameters:
+        - image (PIL.Image.Image): Image to encode.
+        - image_format (str, optional): "jpeg" or "webp".
+        - quality (int, optional): Encoder quality, 1-100.
+        - target_bytes (int, optional): If set, the highest quality from
+          MIN_IMAGE_QUALITY to `quality` whose encoding fits in this many bytes
+          is found by binary search; if none fits, the MIN_IMAGE_QUALITY
+          encoding is returned. Vouchers from one template compress alike, so
+          the search starts from the quality the previous one settled on and
+          usually takes two encodes.
+
+    Returns:
+        bytes: The encoded image.
+    """
+    def encode(q):
+        buffer = io.BytesIO()
+        if image_format == "webp":
+            image.save(buffer, format="WEBP", quality=q, method=WEBP_METHOD)
+        else:
+            image.save(buffer, format="JPEG", quality=q, optimize=True)
+        return buffer.getvalue()
+
+    if not target_bytes or quality <= MIN_IMAGE_QUALITY:
+        return encode(quality)
+
+    hint_key = (image_format, quality, target_bytes)
+    hint = _quality_hints.get(hint_key, quality)
+    low, high = MIN_IMAGE_QUALITY, quality
+    best = smallest = None
+    best_quality = MIN_IMAGE_QUALITY
+    # Probe the hint, then its neighbour, then bisect whatever range is left
+    probes = [hint]
+    while low <= high:
+        mid = probes.pop() if probes and low <= probes[-1] <= high else (low + high) // 2
+        candidate = encode(mid)
+        fits = len(candidate) <= target_bytes
+        if fits:
+            best, best_quality, low = candidate, mid, mid + 1
+        else:
+            high = mid - 1
+            if mid == MIN_IMAGE_QUALITY:
+                smallest = candidate
+        if mid == hint and hint_key in _quality_hints:
+            probes = [mid + 1 if fits else mid - 1]
+    _quality_hints[hint_key] = best_quality
+    return best or smallest or encode(MIN_IMAGE_QUALITY)
+
+
+def image_mimetype(data: bytes) -> str:
+    """Content type of an image produced by encode_image()."""
+    return IMAGE_MIMETYPES["webp"] if data[:4] == b"RIFF" and data[8:12] == b"WEBP" else IMAGE_MIMETYPES["jpeg"]
+
+
+def _page_mm(img_width, img_height):
+    return img_width / PDF_DPI * MM_PER_INCH, img_height / PDF_DPI * MM_PER_INCH
+
+
+def _raster_pdf(jpeg_bytes, img_width, img_height):
+    from fpdf import FPDF
+
+    pdf_width_mm, pdf_height_mm = _page_mm(img_width, img_height)
+    pdf = FPDF('P', 'mm', (pdf_width_mm, pdf_height_mm))
+    pdf.add_page()
+    pdf.image(io.BytesIO(jpeg_bytes), x=0, y=0, w=pdf_width_mm, h=pdf_height_mm)
+    return bytes(pdf.output())
+
+
+def _vector_pdf(renderer, quality, texts, img_width, img_height):
+    """PDF of the base image with each (text, x px, y px, font, size px) in `texts` drawn as PDF text."""
+    from fpdf import FPDF
+
+    pdf_width_mm, pdf_height_mm = _page_mm(img_width, img_height)
+    pdf = FPDF('P', 'mm', (pdf_width_mm, pdf_height_mm))
+    pdf.set_auto_page_break(False)
+    pdf.add_page()
+    pdf.image(io.BytesIO(renderer.base_jpeg(quality)), x=0, y=0, w=pdf_width_mm, h=pdf_height_mm)
+    # fpdf2 embeds only the glyphs used, so the font adds a few KB
+    pdf.add_font("voucher", "", renderer.pdf_font(text for text, *_ in texts))
+    pdf.set_text_color(0, 0, 0)
+    for text, x, y, font, size in texts:
+        pdf.set_font("voucher", size=size * 72 / PDF_DPI)
+        # Pillow places the ascender line at y; PDF text is placed by its baseline
+        ascent, _ = font.getmetrics()
+        pdf.text(x / PDF_DPI * MM_PER_INCH, (y + ascent) / PDF_DPI * MM_PER_INCH, text)
+    return bytes(pdf.output())
+
+
+def render_voucher(name, voucher_code, include_jpg=False, timings=None, renderer=None, encoding=None):
+    """
+    Renders a voucher entirely in memory.
+
+    Parameters:
+        - name (str): Recipient name drawn on the voucher.
+        - voucher_code (str): Voucher code drawn on the voucher.
+        - include_jpg (bool, optional): Also return the SMS image bytes (JPEG
+          or WebP, see Encoding).
+        - timings (dict, optional): If given, seconds spent in each stage are
+          added under "image_open", "text_draw", "image_encode" and "pdf_build".
+        - renderer (VoucherRenderer, optional): Artwork to draw on; defaults to
+          get_renderer().
+        - encoding (Encoding, optional): Defaults to the process-wide encoding
+          (see set_encoding()).
+
+    Returns:
+        tuple: (pdf_bytes, jpg_bytes). jpg_bytes is None unless include_jpg is set.
+    """
+    from PIL import ImageDraw
+
+    started = time.perf_counter()
+    encoding = encoding or _encoding
+
+    # Base image and fonts come from the shared renderer
+    renderer = renderer or get_renderer()
+    image, font_name, font_code = renderer.acquire()
+    started = _lap(timings, "image_open", started)
+    img_width, img_height = image.size
+
+    # --- Relative positioning ---
+    layout = renderer.layout
+    name_x = int(layout.name_x * img_width)
+    name_y = int(layout.name_y * img_height)
+    code_x = int(layout.code_x * img_width)
+    code_y = int(layout.code_y * img_height)
+
+    # A vector PDF draws its own text, so the pixels only matter for the SMS image
+    if include_jpg or encoding.pdf_mode == "raster":
+        draw = ImageDraw.Draw(image)
         draw.text((name_x, name_y), name, font=font_name, fill="black")
         draw.text((code_x, code_y), voucher_code, font=font_code, fill="black")
+        started = _lap(timings, "text_draw", started)
 
-        # Save compressed JPG
-        image_path_jpg = os.path.join(new_jpg_output_dir, f'voucher_{voucher_code}.jpg')
-        image.save(image_path_jpg, quality=30, optimize=True)
-        logger.info(f"Compressed image saved with text at: {image_path_jpg}")
+    image_bytes = None
+    if include_jpg:
+        image_bytes = encode_image(image, encoding.image_format, encoding.image_quality, encoding.image_target_bytes)
+        started = _lap(timings, "image_encode", started)
+
+    if encoding.pdf_mode == "vector":
+        pdf_bytes = _vector_pdf(renderer, encoding.pdf_quality, [
+            (name, name_x, name_y, font_name, layout.font_size_name),
+            (voucher_code, code_x, code_y, font_code, layout.font_size_code),
+        ], img_width, img_height)
+    else:
+        same_jpeg = (encoding.image_format == "jpeg" and not encoding.image_target_bytes
+                     and encoding.image_quality == encoding.pdf_quality)
+        if image_bytes is not None and same_jpeg:
+            jpeg_bytes = image_bytes
+        else:
+            jpeg_bytes = encode_image(image, "jpeg", encoding.pdf_quality)
+            started = _lap(timings, "image_encode", started)
+        pdf_bytes = _raster_pdf(jpeg_bytes, img_width, img_height)
+    _lap(timings, "pdf_build", started)
 
-        # Convert to PDF
-        class CustomPDF(FPDF):
-            def __init__(self, img_width, img_height):
-                super().__init__('P', 'mm', (img_width, img_height))
+    return pdf_bytes, image_bytes
+
+
+def generate_voucher_pdf(name, voucher_code, output_dir='vouchers'):
+    try:
+        # Create output directories
+        os.makedirs(output_dir, exist_ok=True)
+        new_jpg_output_dir = 'pdf'
+        os.makedirs(new_jpg_output_dir, exist_ok=True)
 
-        dpi = 300
-        mm_per_inch = 25.4
-        pdf_width_mm = (img_width / dpi) * mm_per_inch
-        pdf_height_mm = (img_height / dpi) * mm_per_inch
+        pdf_bytes, jpg_bytes = render_voucher(name, voucher_code, include_jpg=True)
 
-        pdf = CustomPDF(pdf_width_mm, pdf_height_mm)
-        pdf.add_page()
-        pdf.image(image_path_jpg, x=0, y=0, w=pdf_width_mm, h=pdf_height_mm)
+        # Save compressed image (JPG unless WebP is configured)
+        extension = IMAGE_EXTENSIONS[_encoding.image_format]
+        image_path_jpg = os.path.join(new_jpg_output_dir, f'voucher_{voucher_code}.{extension}')
+        with open(image_path_jpg, 'wb') as f:
+            f.write(jpg_bytes)
+        logger.info(f"Compressed image saved with text at: {image_path_jpg}")
 
         pdf_output_path = os.path.join(output_dir, f'voucher_{voucher_code}.pdf')
-        pdf.output(pdf_output_path)
+        with open(pdf_output_path, 'wb') as f:
+            f.write(pdf_bytes)
         logger.info(f"PDF saved as: {pdf_output_path}")
 
         return pdf_output_path
@@ -68,8 +512,7 @@ def generate_voucher_pdf(name, voucher_code, output_dir='vouchers'):
         logger.error(f"Failed to generate PDF: {e}")
         return None
 
-# Logging config
-logging.basicConfig(level=logging.INFO)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     generate_voucher_pdf("John Doe", "1234567890")
\ No newline at end of file
@@ -0,0 +1,196 @@
+# delivery.py
+
+import logging
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from circuit_breaker import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+CHANNELS = ("email", "sms")
+
+# Per-channel states
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+SKIPPED = "skipped"
+PARKED = "parked"  # Not attempted while the provider's breaker was open; replayed when it recovers
+UNCONFIRMED = "unconfirmed"  # Accepted by the provider, which had not reported the outcome in time; never resent
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+
+
+def new_job(
+    name: str,
+    email: str,
+    phone: str,
+    voucher_code: str,
+    template_type: str,
+    email_enabled: bool,
+    sms_enabled: bool
+) -> Dict[str, Any]:
+    """
+    Builds a delivery job for one voucher.
+
+    Channels that are not enabled (missing or invalid contact details) start
+    out as "skipped" so the job status shows why nothing was sent.
+    """
+    return {
+        "id": uuid.uuid4().hex,
+        "state": QUEUED,
+        "created_at": time.time(),
+        "name": name,
+        "email": email,
+        "phone": phone,
+        "voucher_code": voucher_code,
+        "template_type": template_type,
+        "channels": {
+            "email": {"state": PENDING if email_enabled else SKIPPED, "attempts": 0, "error": None},
+            "sms": {"state": PENDING if sms_enabled else SKIPPED, "attempts": 0, "error": None},
+        },
+    }
+
+
+class DeliveryQueue:
+    def __init__(
+        self,
+        handler: Callable[["DeliveryQueue", Dict[str, Any]], None],
+        store,
+        workers: int = 4,
+        claim_batch: int = 32,
+        poll_interval: float = 1.0,
+        retention: float = 7 * 24 * 3600
+    ):
+        """
+        Durable delivery queue drained by a pool of background worker threads.
+
+        Jobs live in a JobStore. A dispatcher thread claims queued jobs in
+        batches and hands them to the workers, so a crash at any point leaves
+        unfinished jobs in the store to be re-queued by JobStore.recover().
+
+        Parameters:
+            - handler (callable): Called as handler(queue, job) for every job. It
+              reports progress through update_channel(). It may return a list
+              of futures for sends still in flight; the job is marked done
+              once they resolve.
+            - store (JobStore): Persistent job table.
+            - workers (int, optional): Number of worker threads.
+            - claim_batch (int, optional): Maximum jobs claimed per UPDATE.
+            - poll_interval (float, optional): Seconds between store polls when idle.
+            - retention (float, optional): Seconds finished jobs are kept for status lookups.
+        """
+        self.handler = handler
+        self.store = store
+        self.workers = workers
+        self.claim_batch = claim_batch
+        self.poll_interval = poll_interval
+        self.retention = retention
+        # At most two batches' worth of claimed jobs wait in memory
+        self._ready = queue.Queue(maxsize=max(workers * 2, claim_batch))
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self.store.recover()
+        dispatcher = threading.Thread(target=self._dispatch, name="delivery-dispatcher", daemon=True)
+        dispatcher.start()
+        self._threads.append(dispatcher)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"delivery-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} delivery workers.")
+
+    def submit(self, job: Dict[str, Any]) -> str:
+        job_id = self.store.enqueue(job)
+        self._wakeup.set()
+        return job_id
+
+    def submit_many(self, jobs: List[Dict[str, Any]]) -> int:
+        count = self.store.enqueue_many(jobs)
+        self._wakeup.set()
+        return count
+
+    def wake(self):
+        """Tells the dispatcher that jobs were added to the store directly."""
+        self._wakeup.set()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Returns a snapshot of the job, or None if it is unknown."""
+        return self.store.get(job_id)
+
+    def update_channel(self, job_id: str, channel: str, **fields):
+        self.store.update_channel(job_id, channel, **fields)
+
+    def _dispatch(self):
+        last_purge = time.monotonic()
+        while True:
+            self._wakeup.clear()
+            free = self._ready.maxsize - self._ready.qsize()
+            jobs = self.store.claim(min(free, self.claim_batch)) if free > 0 else []
+            for job in jobs:
+                self._ready.put(job)
+            if time.monotonic() - last_purge > 600:
+                self.store.purge(self.retention)
+                last_purge = time.monotonic()
+            if len(jobs) < self.claim_batch:
+                # Drained (or workers are saturated): wait for a submit or the next poll
+                self._wakeup.wait(self.poll_interval)
+
+    def _run(self):
+        while True:
+            job = self._ready.get()
+            job_id = job["id"]
+            pending = None
+            try:
+                pending = self.handler(self, job)
+            except Exception as e:
+                self._fail_pending(job, e)
+            finally:
+                if pending:
+                    # Some channels were handed to a batcher; the job finishes
+                    # when their results come back, without holding this worker.
+                    self._finish_when_done(job, pending)
+                else:
+                    self._finish(job_id)
+
+    def _fail_pending(self, job: Dict[str, Any], error: BaseException):
+        logger.error(f"Delivery job {job['id']} failed unexpectedly.", exc_info=error)
+        current = self.store.get(job["id"]) or job
+        for channel, state in current["channels"].items():
+            if state["state"] == PENDING:
+                self.store.update_channel(job["id"], channel, state=FAILED, error="internal error")
+
+    def _finish_when_done(self, job: Dict[str, Any], futures: List[Future]):
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def on_done(future):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                # A parked send is not a failure: the handler already recorded it
+                errors = [f.exception() for f in futures
+                          if f.exception() and not isinstance(f.exception(), CircuitOpenError)]
+                if errors:
+                    self._fail_pending(job, errors[0])
+                self._finish(job["id"])
+
+        for future in futures:
+            future.add_done_callback(on_done)
+
+    def _finish(self, job_id: str):
+        # Back to the queue instead if a parked channel was replayed while the job ran
+        self.store.finish(job_id)
+        self._wakeup.set()
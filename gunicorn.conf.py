@@ -0,0 +1,40 @@
+# gunicorn.conf.py
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Preload-then-fork: the app and the voucher assets are loaded once in the
+# master (see wsgi.py), then frozen out of the garbage collector's reach so
+# collections in the workers do not touch, and so copy, the shared pages.
+#
+# Every worker delivers with its own provider token buckets, so each gets
+# 1/workers of MAILERSEND_RATE_PER_SEC / CELLCAST_RATE_PER_SEC (and burst).
+
+import gc
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+preload_app = True
+
+
+def when_ready(server):
+    # The app is loaded by now; everything allocated so far is shared with the workers
+    gc.collect()
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Threads do not survive fork(), so each worker starts its own
+    import rate_limiter
+    import templates
+    import webhook_app
+
+    # Together the workers stay within the configured provider limits
+    rate_limiter.share_limits(worker.cfg.workers)
+    webhook_app.start_background_tasks()
+    # Workers forked after a HUP to the master start from the preloaded
+    # templates, so re-read them; a HUP to a worker reloads them in place.
+    templates.reload()
+    templates.install_reload_handler()
@@ -0,0 +1,44 @@
+# http_pool.py
+
+from typing import Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts in seconds for provider calls
+DEFAULT_TIMEOUT: Tuple[float, float] = (3.05, 15)
+
+
+def build_session(pool_size: int = 10, connect_retries: int = 3, backoff_factor: float = 0.2) -> requests.Session:
+    """
+    Builds a keep-alive session with a connection pool for one provider.
+
+    Only connection errors are retried at this level: the request never
+    reached the provider, so resending a POST is safe. Read errors and HTTP
+    error statuses are left to the caller's own retry loop.
+
+    Parameters:
+        - pool_size (int, optional): Connections kept open per host. Size it to
+          the number of threads that send concurrently.
+        - connect_retries (int, optional): Retries for failed connection attempts.
+        - backoff_factor (float, optional): urllib3 backoff between those retries.
+
+    Returns:
+        requests.Session: Session to reuse for every call to the provider.
+    """
+    retry = Retry(
+        total=connect_retries,
+        connect=connect_retries,
+        read=0,
+        redirect=0,
+        status=0,
+        other=0,
+        backoff_factor=backoff_factor,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
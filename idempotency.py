@@ -0,0 +1,128 @@
+# idempotency.py
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def channel_key(voucher_code: str, template_type: str, channel: str) -> str:
+    return f"{voucher_code}|{template_type}|{channel}"
+
+
+def header_key(idempotency_key: str) -> str:
+    return f"header|{idempotency_key}"
+
+
+class IdempotencyIndex:
+    def __init__(self, store, max_entries: int = 100000, ttl: float = 7 * 24 * 3600):
+        """
+        Maps idempotency keys to the delivery job that first used them.
+
+        An in-memory LRU with a TTL sits in front of the JobStore key table, so
+        a retry that is still hot is recognised without touching SQLite. The
+        store is the source of truth and also settles races between workers;
+        cached entries expire `ttl` after the store recorded the key, not after
+        they were cached.
+
+        Parameters:
+            - store (JobStore): Persistent key table.
+            - max_entries (int, optional): LRU capacity.
+            - ttl (float, optional): Seconds a key stays valid.
+        """
+        self.store = store
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # key -> (job id, expires at)
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.suppressed = 0
+
+    def _cache_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            job_id, expires_at = entry
+            if expires_at < time.time():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return job_id
+
+    def _cache_put(self, key: str, job_id: str, created_at: float):
+        # Wall-clock time, like the store's created_at
+        with self._lock:
+            self._cache[key] = (job_id, created_at + self.ttl)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Returns the job id that owns `key`, or None if the key is unused."""
+        job_id = self._cache_get(key)
+        if job_id is not None:
+            self.hits += 1
+            return job_id
+        self.misses += 1
+        found = self.store.get_key(key, self.ttl)
+        if found is None:
+            return None
+        job_id, created_at = found
+        self._cache_put(key, job_id, created_at)
+        return job_id
+
+    def reserve(self, key: str, job_id: str, replace: Optional[str] = None) -> str:
+        """
+        Claims `key` for `job_id`.
+
+        Returns:
+            str: The owning job id. Anything other than `job_id` means the key
+            was already taken and this send is a duplicate.
+        """
+        owner = self._cache_get(key)
+        if owner is not None and owner != replace:
+            self.hits += 1
+            return owner
+        owner, created_at = self.store.reserve_key(key, job_id, self.ttl, replace=replace)
+        if time.monotonic() - self._last_purge > 600:
+            self._last_purge = time.monotonic()
+            self.purge()
+        self._cache_put(key, owner, created_at)
+        return owner
+
+    def release(self, job_ids: List[str]):
+        """
+        Gives up every key reserved for `job_ids`.
+
+        Called when the jobs could not be enqueued, so a retry of the same
+        request is not answered as a duplicate of a job that does not exist.
+        """
+        if not job_ids:
+            return
+        self.store.release_keys(job_ids)
+        released = set(job_ids)
+        with self._lock:
+            for key in [key for key, (job_id, _) in self._cache.items() if job_id in released]:
+                del self._cache[key]
+
+    def record_suppressed(self, count: int = 1):
+        with self._lock:
+            self.suppressed += count
+
+    def purge(self) -> int:
+        return self.store.purge_keys(self.ttl)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "suppressed": self.suppressed,
+            "cached": len(self._cache),
+        }
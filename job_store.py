@@ -0,0 +1,455 @@
+# job_store.py
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from delivery import CHANNELS, QUEUED, RUNNING, DONE, PENDING, SKIPPED, PARKED
+from reminders import SCHEDULED, FIRED
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            TEXT PRIMARY KEY,
+    state         TEXT NOT NULL,
+    voucher_code  TEXT NOT NULL,
+    name          TEXT NOT NULL,
+    email         TEXT NOT NULL,
+    phone         TEXT NOT NULL,
+    template_type TEXT NOT NULL,
+    email_state    TEXT NOT NULL,
+    email_attempts INTEGER NOT NULL DEFAULT 0,
+    email_error    TEXT,
+    sms_state      TEXT NOT NULL,
+    sms_attempts   INTEGER NOT NULL DEFAULT 0,
+    sms_error      TEXT,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    worker_pid    INTEGER,
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state_created ON jobs (state, created_at);
+CREATE INDEX IF NOT EXISTS jobs_voucher_code ON jobs (voucher_code);
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key        TEXT PRIMARY KEY,
+    job_id     TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS reminders (
+    id            TEXT PRIMARY KEY,
+    state         TEXT NOT NULL,
+    voucher_code  TEXT NOT NULL,
+    template_type TEXT NOT NULL,
+    name          TEXT NOT NULL,
+    email         TEXT NOT NULL,
+    phone         TEXT NOT NULL,
+    due_at        REAL NOT NULL,
+    job_id        TEXT,
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL,
+    UNIQUE (voucher_code, template_type)
+);
+CREATE INDEX IF NOT EXISTS reminders_state_due ON reminders (state, due_at);
+"""
+
+REMINDER_INSERT_SQL = """
+INSERT OR IGNORE INTO reminders (
+    id, state, voucher_code, template_type, name, email, phone, due_at, created_at, updated_at
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_SQL = """
+INSERT INTO jobs (
+    id, state, voucher_code, name, email, phone, template_type,
+    email_state, email_attempts, email_error, sms_state, sms_attempts, sms_error,
+    attempts, created_at, updated_at
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+"""
+
+# Claims a batch of the oldest queued jobs in one statement
+CLAIM_SQL = """
+UPDATE jobs
+SET state = ?, worker_pid = ?, attempts = attempts + 1, updated_at = ?
+WHERE id IN (
+    SELECT id FROM jobs WHERE state = ? ORDER BY created_at LIMIT ?
+)
+RETURNING *
+"""
+
+CHANNEL_FIELDS = ("state", "attempts", "error")
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "state": row["state"],
+        "created_at": row["created_at"],
+        "name": row["name"],
+        "email": row["email"],
+        "phone": row["phone"],
+        "voucher_code": row["voucher_code"],
+        "template_type": row["template_type"],
+        "attempts": row["attempts"],
+        "channels": {
+            channel: {field: row[f"{channel}_{field}"] for field in CHANNEL_FIELDS}
+            for channel in CHANNELS
+        },
+    }
+
+
+def _job_params(job: Dict[str, Any], now: float) -> tuple:
+    email = job["channels"]["email"]
+    sms = job["channels"]["sms"]
+    return (
+        job["id"], job.get("state", QUEUED), job["voucher_code"], job["name"],
+        job["email"], job["phone"], job["template_type"],
+        email["state"], email["attempts"], email["error"],
+        sms["state"], sms["attempts"], sms["error"],
+        job.get("created_at", now), now,
+    )
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    def __init__(self, path: str = "jobs.db"):
+        """
+        SQLite-backed delivery job table.
+
+        The database runs in WAL mode with synchronous=NORMAL, so a commit does
+        not wait for an fsync and readers never block the writer. Each thread
+        gets its own connection, and a forked child opens its own rather than
+        reusing its parent's, so a store built before a preforking server
+        forks its workers is safe to use in each of them.
+
+        Parameters:
+            - path (str, optional): Database file path.
+        """
+        self.path = path
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            # Forked: SQLite connections must not cross fork(), so drop the parent's
+            self._pid = os.getpid()
+            self._local = threading.local()
+            self._write_lock = threading.Lock()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        # One writer at a time inside this process; other processes are
+        # serialised by SQLite itself through busy_timeout.
+        with self._write_lock:
+            return self._conn().execute(sql, params)
+
+    def enqueue(self, job: Dict[str, Any]) -> str:
+        self._write(INSERT_SQL, _job_params(job, time.time()))
+        return job["id"]
+
+    def enqueue_many(self, jobs: Iterable[Dict[str, Any]]) -> int:
+        """Inserts many jobs in a single transaction. Returns the number inserted."""
+        now = time.time()
+        params = [_job_params(job, now) for job in jobs]
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(INSERT_SQL, params)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return len(params)
+
+    def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        Atomically moves up to `limit` queued jobs to running for this process.
+
+        Returns:
+            List[Dict[str, Any]]: The claimed jobs, oldest first.
+        """
+        with self._write_lock:
+            rows = self._conn().execute(
+                CLAIM_SQL, (RUNNING, os.getpid(), time.time(), QUEUED, limit)
+            ).fetchall()
+        jobs = [_row_to_job(row) for row in rows]
+        jobs.sort(key=lambda job: job["created_at"])
+        return jobs
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def find_by_voucher_code(self, voucher_code: str) -> Optional[Dict[str, Any]]:
+        """Returns the most recent job for a voucher code, or None."""
+        row = self._conn().execute(
+            "SELECT * FROM jobs WHERE voucher_code = ? ORDER BY created_at DESC LIMIT 1",
+            (voucher_code,)
+        ).fetchone()
+        return _row_to_job(row) if row else None
+
+    def update_channel(self, job_id: str, channel: str, **fields):
+        if channel not in CHANNELS:
+            raise ValueError(f"Unknown channel: {channel}")
+        unknown = set(fields) - set(CHANNEL_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown channel fields: {sorted(unknown)}")
+        assignments = ", ".join(f"{channel}_{field} = ?" for field in fields)
+        self._write(
+            f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ?",
+            (*fields.values(), time.time(), job_id)
+        )
+
+    def finish(self, job_id: str):
+        """Marks a job done, or queues it again if requeue_parked() gave it a pending channel while it ran."""
+        self._write(
+            "UPDATE jobs SET state = CASE WHEN email_state = ? OR sms_state = ? THEN ? ELSE ? END, "
+            "updated_at = ? WHERE id = ?",
+            (PENDING, PENDING, QUEUED, DONE, time.time(), job_id)
+        )
+
+    def requeue_parked(self, channel: str, limit: Optional[int] = None) -> int:
+        """
+        Makes parked sends on `channel` pending again and queues their jobs.
+
+        A job still running (its other channel in flight) only gets the
+        channel reset; finish() then queues it instead of marking it done.
+
+        Parameters:
+            - channel (str): "email" or "sms".
+            - limit (int, optional): Most jobs to requeue, oldest first; all if None.
+
+        Returns:
+            int: Number of jobs requeued.
+        """
+        if channel not in CHANNELS:
+            raise ValueError(f"Unknown channel: {channel}")
+        cursor = self._write(
+            f"UPDATE jobs SET {channel}_state = ?, "
+            f"state = CASE WHEN state = ? THEN ? ELSE state END, updated_at = ? "
+            f"WHERE id IN (SELECT id FROM jobs WHERE {channel}_state = ? ORDER BY created_at LIMIT ?)",
+            (PENDING, DONE, QUEUED, time.time(), PARKED, -1 if limit is None else limit)
+        )
+        return cursor.rowcount
+
+    def parked_counts(self) -> Dict[str, int]:
+        """Number of jobs with a parked send, per channel."""
+        row = self._conn().execute(
+            "SELECT SUM(email_state = ?) AS email, SUM(sms_state = ?) AS sms FROM jobs", (PARKED, PARKED)
+        ).fetchone()
+        return {channel: row[channel] or 0 for channel in CHANNELS}
+
+    def recover(self) -> int:
+        """
+        Re-queues running jobs whose worker process no longer exists.
+
+        Call once at startup: anything left running by a crashed process goes
+        back to the queue. Channels already marked sent are not sent again.
+
+        Returns:
+            int: Number of jobs re-queued.
+        """
+        pids = [
+            row["worker_pid"] for row in self._conn().execute(
+                "SELECT DISTINCT worker_pid FROM jobs WHERE state = ?", (RUNNING,)
+            )
+        ]
+        dead = [pid for pid in pids if pid is None or pid == os.getpid() or not _pid_alive(pid)]
+        requeued = 0
+        for pid in dead:
+            cursor = self._write(
+                "UPDATE jobs SET state = ?, worker_pid = NULL, updated_at = ? "
+                "WHERE state = ? AND worker_pid IS ?",
+                (QUEUED, time.time(), RUNNING, pid)
+            )
+            requeued += cursor.rowcount
+        if requeued:
+            logger.warning(f"Re-queued {requeued} unfinished delivery jobs.")
+        return requeued
+
+    def purge(self, older_than: float) -> int:
+        """Deletes finished jobs, and reminders that have fired, last updated more than `older_than` seconds ago."""
+        cutoff = time.time() - older_than
+        self._write(
+            "DELETE FROM reminders WHERE state IN (?, ?) AND updated_at < ?",
+            (FIRED, SKIPPED, cutoff)
+        )
+        # Jobs with a parked send are kept until it is replayed
+        cursor = self._write(
+            "DELETE FROM jobs WHERE state = ? AND updated_at < ? AND email_state != ? AND sms_state != ?",
+            (DONE, cutoff, PARKED, PARKED)
+        )
+        return cursor.rowcount
+
+    def reserve_key(self, key: str, job_id: str, max_age: float, replace: Optional[str] = None) -> Tuple[str, float]:
+        """
+        Records `key` as belonging to `job_id` unless it is already taken.
+
+        Parameters:
+            - key (str): Idempotency key.
+            - job_id (str): Job that wants the key.
+            - max_age (float): Keys older than this many seconds are treated as free.
+            - replace (str, optional): Take the key over if it currently belongs
+              to this job id.
+
+        Returns:
+            tuple: (job id that owns the key afterwards, time.time() it was recorded at)
+        """
+        now = time.time()
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE key = ? AND created_at < ?",
+                (key, now - max_age)
+            )
+            if replace is not None:
+                conn.execute(
+                    "UPDATE idempotency_keys SET job_id = ?, created_at = ? WHERE key = ? AND job_id = ?",
+                    (job_id, now, key, replace)
+                )
+            conn.execute(
+                "INSERT OR IGNORE INTO idempotency_keys (key, job_id, created_at) VALUES (?, ?, ?)",
+                (key, job_id, now)
+            )
+            row = conn.execute("SELECT job_id, created_at FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+        return row["job_id"], row["created_at"]
+
+    def release_keys(self, job_ids: List[str]) -> int:
+        """Frees every idempotency key owned by `job_ids`, e.g. when their jobs could not be enqueued."""
+        placeholders = ", ".join("?" * len(job_ids))
+        cursor = self._write(f"DELETE FROM idempotency_keys WHERE job_id IN ({placeholders})", tuple(job_ids))
+        return cursor.rowcount
+
+    def get_key(self, key: str, max_age: float) -> Optional[Tuple[str, float]]:
+        """Returns (job id, time.time() the key was recorded at) for a key younger than `max_age`, else None."""
+        row = self._conn().execute(
+            "SELECT job_id, created_at FROM idempotency_keys WHERE key = ? AND created_at >= ?",
+            (key, time.time() - max_age)
+        ).fetchone()
+        return (row["job_id"], row["created_at"]) if row else None
+
+    def purge_keys(self, older_than: float) -> int:
+        cursor = self._write(
+            "DELETE FROM idempotency_keys WHERE created_at < ?",
+            (time.time() - older_than,)
+        )
+        return cursor.rowcount
+
+    def add_reminders(self, reminders: Iterable[Dict[str, Any]]) -> int:
+        """
+        Stores scheduled reminders in one transaction.
+
+        A reminder for a (voucher code, template type) that is already stored
+        is left as it is, so registering the same customer twice is harmless.
+
+        Returns:
+            int: Number of reminders inserted.
+        """
+        now = time.time()
+        params = [
+            (r["id"], SCHEDULED, r["voucher_code"], r["template_type"], r["name"],
+             r["email"], r["phone"], r["due_at"], now, now)
+            for r in reminders
+        ]
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = conn.total_changes
+                conn.executemany(REMINDER_INSERT_SQL, params)
+                inserted = conn.total_changes - before
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return inserted
+
+    def reminders_for(self, voucher_code: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT * FROM reminders WHERE voucher_code = ? ORDER BY due_at", (voucher_code,)
+        )
+        return [dict(row) for row in rows]
+
+    def due_reminders(self, until: float, limit: int) -> List[tuple]:
+        """Returns (due_at, id) of up to `limit` scheduled reminders due by `until`, soonest first."""
+        rows = self._conn().execute(
+            "SELECT due_at, id FROM reminders WHERE state = ? AND due_at <= ? ORDER BY due_at LIMIT ?",
+            (SCHEDULED, until, limit)
+        )
+        return [(row["due_at"], row["id"]) for row in rows]
+
+    def get_reminders(self, reminder_ids: List[str]) -> List[Dict[str, Any]]:
+        """Returns the reminders among `reminder_ids` that are still scheduled."""
+        placeholders = ", ".join("?" * len(reminder_ids))
+        rows = self._conn().execute(
+            f"SELECT * FROM reminders WHERE state = ? AND id IN ({placeholders})",
+            (SCHEDULED, *reminder_ids)
+        )
+        return [dict(row) for row in rows]
+
+    def fire_reminders(self, jobs: Dict[str, Dict[str, Any]], skipped: List[str]) -> int:
+        """
+        Enqueues the jobs for due reminders and marks the reminders fired, in one transaction.
+
+        A reminder that another process fired first is left alone and its job
+        is not enqueued, so every worker of a preforked server may run a
+        ReminderScheduler over the same store.
+
+        Parameters:
+            - jobs (dict): Reminder id -> delivery job to enqueue for it.
+            - skipped (list): Reminder ids that fired without a job (nothing left to send).
+
+        Returns:
+            int: Number of jobs enqueued.
+        """
+        now = time.time()
+        update = "UPDATE reminders SET state = ?, job_id = ?, updated_at = ? WHERE id = ? AND state = ?"
+        enqueued = 0
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for reminder_id, job in jobs.items():
+                    if conn.execute(update, (FIRED, job["id"], now, reminder_id, SCHEDULED)).rowcount:
+                        conn.execute(INSERT_SQL, _job_params(job, now))
+                        enqueued += 1
+                conn.executemany(update, [(SKIPPED, None, now, reminder_id, SCHEDULED) for reminder_id in skipped])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return enqueued
+
+    def reminder_counts(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT state, COUNT(*) AS n FROM reminders GROUP BY state")
+        return {row["state"]: row["n"] for row in rows}
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state")
+        return {row["state"]: row["n"] for row in rows}
@@ -0,0 +1,194 @@
+# metrics.py
+#
+# Minimal in-process metrics with Prometheus text exposition. Counters and
+# histograms are plain dicts behind one lock per metric, so recording a value
+# costs a dict lookup and a bisect; the text is only built when /metrics is
+# scraped.
+
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Seconds; covers a cached render (~1 ms) up to a provider call that ran out of retries
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[LabelValues, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class GaugeCallback:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Iterable[Tuple[Sequence[str], float]]]):
+        """
+        Gauge whose samples are read from `callback` at scrape time.
+
+        Used to export the stats() dicts that components already keep, so
+        nothing extra happens on the hot path.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in self.callback():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name: str, documentation: str, labelnames: Sequence[str],
+                       callback: Callable[[], Iterable[Tuple[Sequence[str], float]]]) -> GaugeCallback:
+        return self._register(GaugeCallback(name, documentation, labelnames, callback))
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- metrics shared by the Flask and ASGI apps and the provider clients ---
+
+PROVIDER_REQUEST_SECONDS = REGISTRY.histogram(
+    "voucher_provider_request_seconds",
+    "Duration of one HTTP call to a provider, by provider and response status.",
+    ("provider", "status"),
+)
+PROVIDER_SEND_SECONDS = REGISTRY.histogram(
+    "voucher_provider_send_seconds",
+    "Duration of a provider send including retries and backoff, by provider and outcome.",
+    ("provider", "outcome"),
+)
+PROVIDER_RETRIES = REGISTRY.counter(
+    "voucher_provider_retries_total",
+    "Provider calls retried after a failure, by provider.",
+    ("provider",),
+)
+PROVIDER_RETRY_SLEEP_SECONDS = REGISTRY.counter(
+    "voucher_provider_retry_sleep_seconds_total",
+    "Seconds spent sleeping between provider retries, by provider.",
+    ("provider",),
+)
+RENDER_STAGE_SECONDS = REGISTRY.histogram(
+    "voucher_render_stage_seconds",
+    "Voucher render time per stage (image_open, text_draw, image_encode, pdf_build).",
+    ("stage",),
+)
+WEBHOOK_STAGE_SECONDS = REGISTRY.histogram(
+    "voucher_webhook_stage_seconds",
+    "Webhook request handling time per stage (auth, parse, validation, enqueue).",
+    ("stage",),
+)
+WEBHOOK_REQUESTS = REGISTRY.counter(
+    "voucher_webhook_requests_total",
+    "Webhook requests by template type and outcome.",
+    ("template_type", "outcome"),
+)
+DELIVERIES = REGISTRY.counter(
+    "voucher_deliveries_total",
+    "Channel deliveries by channel, template type and outcome.",
+    ("channel", "template_type", "outcome"),
+)
@@ -0,0 +1,193 @@
+# prerender.py
+#
+# Pre-renders a batch of vouchers across all CPU cores.
+#
+#   python prerender.py tomorrow.csv --output-dir prerendered
+#
+# Input is CSV (with "name" and "voucherCode" columns, and optionally
+# "templateType") or JSONL (one object per line with the same keys). Each
+# voucher is drawn on its template's artwork from the template registry
+# (TEMPLATES_FILE, as for the webhook). Rows are streamed, so the file is
+# never held in memory; bad rows are skipped and listed by line number in the
+# summary. Artifacts are written content-addressed under
+# <output-dir>/objects/<hh>/<sha256>.<ext>, and <output-dir>/index.jsonl maps
+# each voucher code to its files. With --cache-dir the vouchers also go into
+# the webhook's VoucherCache disk tier, so tomorrow's sends skip rendering.
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import templates
+from create_voucher_pdf import IMAGE_EXTENSIONS, Encoding, get_encoding, render_voucher, set_encoding, warm_up
+from settings import load_settings
+from validation import validate_record
+from voucher_cache import VoucherCache
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("image_open", "text_draw", "image_encode", "pdf_build", "write")
+
+
+def numbered_rows(f, fmt: str) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+    """Yields (line number, row) for each record, with None as the row for a line that is not a JSON object."""
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def read_rows(path: str, fmt: str, skipped: List[int]) -> Iterator[Tuple[str, str, str]]:
+    """
+    Yields (name, voucher_code, template_type) one row at a time.
+
+    Like the bulk endpoint, a bad row (malformed JSON, a field that is not
+    text, no voucherCode) does not stop the run: it is logged and its line
+    number appended to `skipped`.
+    """
+    # utf-8-sig drops the byte order mark Excel puts at the start of CSV exports
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for line_number, row in numbered_rows(f, fmt):
+            checked = validate_record(row) if row is not None else {"error": "not a JSON object"}
+            if checked["error"]:
+                logger.warning(f"Skipping line {line_number}: {checked['error']}")
+                skipped.append(line_number)
+                continue
+            yield checked["name"], checked["voucher_code"], checked["template_type"]
+
+
+def store_object(output_dir: str, content: bytes, ext: str) -> str:
+    """Writes content under its sha256 and returns the path relative to output_dir."""
+    digest = hashlib.sha256(content).hexdigest()
+    relative = os.path.join("objects", digest[:2], f"{digest}.{ext}")
+    path = os.path.join(output_dir, relative)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    return relative
+
+
+_cache = None
+
+
+def _warm_up(cache_dir=None):
+    global _cache
+    settings = load_settings()
+    # Encode and draw as the webhook does, so the vouchers put in its cache are found there
+    set_encoding(Encoding.from_settings(settings))
+    templates.load(settings.templates_file or None)
+    # Decode every template's artwork and parse the fonts once per worker process
+    warm_up(templates.registry().renderers())
+    if cache_dir:
+        # Memory tier disabled: this process never reads its own entries back
+        _cache = VoucherCache(cache_dir, max_memory_bytes=0)
+
+
+def render_one(name: str, voucher_code: str, template_type: str, output_dir: str, include_jpg: bool) -> Dict[str, Any]:
+    renderer = templates.get(template_type).renderer
+    timings: Dict[str, float] = {}
+    pdf_bytes, jpg_bytes = render_voucher(
+        name, voucher_code, include_jpg=include_jpg or _cache is not None, timings=timings, renderer=renderer
+    )
+
+    started = time.perf_counter()
+    entry = {"voucherCode": voucher_code, "name": name, "templateType": template_type,
+             "pdf": store_object(output_dir, pdf_bytes, "pdf")}
+    if include_jpg:
+        entry["jpg"] = store_object(output_dir, jpg_bytes, IMAGE_EXTENSIONS[get_encoding().image_format])
+    if _cache is not None:
+        _cache.put(name, voucher_code, pdf_bytes, jpg_bytes, renderer)
+    timings["write"] = time.perf_counter() - started
+    return {"entry": entry, "timings": timings}
+
+
+def detect_format(path: str) -> str:
+    return "jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-render vouchers in parallel.")
+    parser.add_argument("input", help="CSV or JSONL file with name, voucherCode and optionally templateType")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="Input format (default: from the file extension)")
+    parser.add_argument("--output-dir", default="prerendered")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--no-jpg", action="store_true", help="Only write PDFs")
+    parser.add_argument("--cache-dir", help="Also fill this VoucherCache directory (VOUCHER_CACHE_DIR)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(args.output_dir, exist_ok=True)
+    fmt = args.format or detect_format(args.input)
+
+    # Fail before starting the workers, which load the same templates
+    try:
+        templates.load(load_settings().templates_file or None)
+    except (OSError, ValueError) as e:
+        logger.error(f"{e}. Please check the template configuration.")
+        return 2
+
+    totals = {stage: 0.0 for stage in STAGES}
+    rendered = failed = 0
+    skipped: List[int] = []
+    max_in_flight = args.workers * 4
+    started = time.perf_counter()
+
+    pool = ProcessPoolExecutor(max_workers=args.workers, initializer=_warm_up, initargs=(args.cache_dir,))
+    with pool, open(os.path.join(args.output_dir, "index.jsonl"), "a", encoding="utf-8") as index:
+        in_flight = set()
+
+        def collect(done):
+            nonlocal rendered, failed
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Failed to render voucher: {e}")
+                    continue
+                rendered += 1
+                index.write(json.dumps(result["entry"]) + "\n")
+                for stage, seconds in result["timings"].items():
+                    totals[stage] += seconds
+
+        for name, voucher_code, template_type in read_rows(args.input, fmt, skipped):
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(pool.submit(render_one, name, voucher_code, template_type, args.output_dir, not args.no_jpg))
+        done, _ = wait(in_flight)
+        collect(done)
+
+    elapsed = time.perf_counter() - started
+    print(f"Rendered {rendered} vouchers ({failed} failed, {len(skipped)} rows skipped) in {elapsed:.2f}s "
+          f"with {args.workers} workers: {rendered / elapsed if elapsed else 0:.1f} vouchers/s")
+    if rendered:
+        for stage in STAGES:
+            print(f"  {stage:<12} {totals[stage] / rendered * 1000:8.2f} ms/voucher (per worker)")
+    if skipped:
+        shown = ", ".join(str(line_number) for line_number in skipped[:20])
+        print(f"  skipped lines: {shown}{' ...' if len(skipped) > 20 else ''}")
+    return 0 if not (failed or skipped) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
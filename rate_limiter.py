@@ -0,0 +1,155 @@
+# rate_limiter.py
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderScheduler:
+    def __init__(self, name: str, rate: float, burst: int):
+        """
+        Token bucket shared by every call to one provider.
+
+        Each call takes a token before it is sent; tokens refill at `rate` per
+        second up to `burst`. A 429 pauses the whole bucket for the provider's
+        Retry-After, so every worker backs off together instead of retrying
+        into the limit. The bucket is per process: when several processes send
+        to the provider, share() gives each its part of the limit.
+
+        Parameters:
+            - name (str): Provider name, used in logs and stats.
+            - rate (float): Sustained calls per second.
+            - burst (int): Calls allowed back to back after an idle period.
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._limit = (rate, burst)  # For the whole provider, before share()
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+        self.waiting = 0
+        self.acquired = 0
+        self.throttled = 0
+
+    def _refill(self, now: float):
+        # No tokens accrue while paused after a 429
+        start = max(self._updated, self._paused_until)
+        if now > start:
+            self._tokens = min(self.burst, self._tokens + (now - start) * self.rate)
+        self._updated = max(self._updated, now)
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until a token is available.
+
+        Returns:
+            bool: False if `timeout` expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now >= self._paused_until and self._tokens >= 1:
+                        self._tokens -= 1
+                        self.acquired += 1
+                        return True
+                    wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        wait = min(wait, deadline - now)
+                    self._cond.wait(wait)
+            finally:
+                self.waiting -= 1
+
+    async def acquire_async(self):
+        """acquire() for asyncio callers: waits on the event loop instead of blocking a thread."""
+        while not self.acquire(timeout=0):
+            await asyncio.sleep(max(1 / self.rate, self._paused_until - time.monotonic()))
+
+    def throttle(self, retry_after: Optional[float] = None):
+        """Records a 429 and pauses the bucket for `retry_after` seconds (one token interval if unknown)."""
+        pause = retry_after if retry_after is not None else 1 / self.rate
+        with self._cond:
+            self.throttled += 1
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        logger.warning(f"{self.name} throttled us; pausing sends for {pause:.1f}s")
+
+    def share(self, processes: int):
+        """Limits this process to 1/`processes` of the configured rate and burst, for `processes` sending at once."""
+        rate, burst = self._limit
+        with self._cond:
+            self._refill(time.monotonic())
+            self.rate = rate / processes
+            self.burst = max(1, burst // processes)
+            self._tokens = min(self._tokens, self.burst)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                "tokens": round(self._tokens, 2),
+                "queue_depth": self.waiting,
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "paused_for": max(0.0, round(self._paused_until - time.monotonic(), 2)),
+            }
+
+
+_schedulers: Dict[str, ProviderScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name: str, rate: float = 5.0, burst: int = 10) -> ProviderScheduler:
+    """Returns the process-wide scheduler for a provider, creating it on first use."""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(name)
+        if scheduler is None:
+            scheduler = _schedulers[name] = ProviderScheduler(name, rate, burst)
+        return scheduler
+
+
+def all_schedulers() -> Dict[str, ProviderScheduler]:
+    with _schedulers_lock:
+        return dict(_schedulers)
+
+
+def share_limits(processes: int):
+    """Splits every provider's limit between `processes` processes each running its own schedulers."""
+    for scheduler in all_schedulers().values():
+        scheduler.share(processes)
+    logger.info(f"Provider rate limits shared between {processes} processes.")
+
+
+def backoff_delay(attempt: int, backoff_factor: float, cap: float = 60.0) -> float:
+    """Full-jitter exponential backoff: a random delay up to backoff_factor ** attempt seconds."""
+    return random.uniform(0, min(cap, backoff_factor ** attempt))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
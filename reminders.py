@@ -0,0 +1,266 @@
+# reminders.py
+
+import datetime
+import hashlib
+import heapq
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+from delivery import new_job, PENDING
+
+logger = logging.getLogger(__name__)
+
+# Reminder states (SKIPPED from delivery.py is used when nothing was left to send)
+SCHEDULED = "scheduled"
+FIRED = "fired"
+
+# Days relative to the registered birthday. The first voucher goes out two
+# weeks before it; the other two are next year's reminders, a month and two
+# weeks before the following birthday.
+DEFAULT_STAGES = "TEMPLATE_1ST_2WEEKS:-14,TEMPLATE_1MONTH:335,TEMPLATE_2ND_2WEEKS:351"
+
+
+def parse_stages(spec: str) -> List[Tuple[str, int]]:
+    """
+    Parses "TEMPLATE_TYPE:days,..." (days relative to the birthday) into (template type, days) pairs.
+
+    Raises:
+        ValueError: If an entry is malformed.
+    """
+    stages = []
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        template_type, sep, days = entry.partition(":")
+        if not sep or not template_type.strip():
+            raise ValueError(f"Invalid reminder stage: {entry!r}")
+        stages.append((template_type.strip(), int(days)))
+    return sorted(stages, key=lambda stage: stage[1])
+
+
+def parse_birthday(value: str) -> Tuple[int, int]:
+    """
+    Accepts "YYYY-MM-DD" or "MM-DD" and returns (month, day).
+
+    Raises:
+        ValueError: If the date is not valid.
+    """
+    parts = value.strip().split("-")
+    if len(parts) == 3:
+        parts = parts[1:]
+    if len(parts) != 2:
+        raise ValueError(f"Invalid birthday: {value!r}")
+    month, day = int(parts[0]), int(parts[1])
+    datetime.date(2000, month, day)  # leap year, so 02-29 is accepted
+    return month, day
+
+
+def next_birthday(month: int, day: int, today: datetime.date) -> datetime.date:
+    """The next occurrence of the birthday on or after `today` (29 Feb falls on 28 Feb in other years)."""
+    for year in (today.year, today.year + 1):
+        try:
+            birthday = datetime.date(year, month, day)
+        except ValueError:
+            birthday = datetime.date(year, month, 28)
+        if birthday >= today:
+            return birthday
+    raise AssertionError("unreachable")
+
+
+def plan_reminders(
+    name: str,
+    email: str,
+    phone: str,
+    voucher_code: str,
+    birthday: Tuple[int, int],
+    stages: Sequence[Tuple[str, int]],
+    timezone: ZoneInfo,
+    send_hour: int = 9,
+    spread: float = 0.0,
+    now: Optional[float] = None
+) -> List[Dict[str, Any]]:
+    """
+    Works out when each reminder stage is due for one customer.
+
+    Stages are placed relative to the next birthday at `send_hour` local time,
+    plus a stable offset of up to `spread` seconds derived from the voucher
+    code, so a day's reminders reach the providers spread out instead of all
+    at once. If the customer registered late and stages are already past, only
+    the latest of them is kept and it is due immediately.
+
+    Returns:
+        list: Reminder dicts ready for JobStore.add_reminders().
+    """
+    now = time.time() if now is None else now
+    today = datetime.datetime.fromtimestamp(now, timezone).date()
+    birthday_date = next_birthday(*birthday, today)
+    offset = int(hashlib.sha1(voucher_code.encode("utf-8")).hexdigest(), 16) % int(spread) if spread >= 1 else 0
+
+    reminders = []
+    for template_type, days in stages:
+        local = datetime.datetime.combine(
+            birthday_date + datetime.timedelta(days=days), datetime.time(send_hour), tzinfo=timezone
+        )
+        reminders.append({
+            "id": uuid.uuid4().hex,
+            "voucher_code": voucher_code,
+            "template_type": template_type,
+            "name": name,
+            "email": email,
+            "phone": phone,
+            "due_at": local.timestamp() + offset,
+        })
+
+    past = [r for r in reminders if r["due_at"] <= now]
+    if past:
+        # Only the most recent overdue stage is still worth sending
+        latest = past[-1]
+        latest["due_at"] = now
+        reminders = [latest] + [r for r in reminders if r["due_at"] > now]
+    return reminders
+
+
+class ReminderScheduler:
+    def __init__(
+        self,
+        store,
+        delivery_queue,
+        reserve: Callable[[Dict[str, Any]], Any],
+        batch_size: int = 500,
+        horizon: float = 3600.0,
+        max_in_memory: int = 100000
+    ):
+        """
+        Fires stored reminders into the delivery queue when they fall due.
+
+        Reminders live in the JobStore; only those due within `horizon`
+        seconds are held in an in-memory heap, reloaded every half horizon, so
+        memory stays flat however many future reminders are stored. Due
+        reminders are fired in batches: the jobs are enqueued and the
+        reminders marked fired in one transaction.
+
+        Parameters:
+            - store (JobStore): Holds the reminders and the job table.
+            - delivery_queue (DeliveryQueue): Woken after each batch is enqueued.
+            - reserve (callable): Called with each job before it is enqueued to
+              claim its idempotency keys; channels it marks skipped are not sent.
+            - batch_size (int, optional): Most reminders fired per transaction.
+            - horizon (float, optional): Seconds ahead that reminders are kept in memory.
+            - max_in_memory (int, optional): Cap on reminders loaded per reload.
+        """
+        self.store = store
+        self.delivery_queue = delivery_queue
+        self.reserve = reserve
+        self.batch_size = batch_size
+        self.horizon = horizon
+        self.max_in_memory = max_in_memory
+
+        self._heap: List[Tuple[float, str]] = []
+        self._queued = set()
+        self._loaded_until = 0.0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        self.fired = 0
+        self.skipped = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+            self._thread.start()
+
+    def register(self, reminders: List[Dict[str, Any]]) -> int:
+        """Stores new reminders. Returns how many were new."""
+        inserted = self.store.add_reminders(reminders)
+        with self._lock:
+            for reminder in reminders:
+                if reminder["due_at"] <= self._loaded_until:
+                    self._push(reminder["due_at"], reminder["id"])
+        self._wakeup.set()
+        return inserted
+
+    def _push(self, due_at: float, reminder_id: str):
+        # Caller holds self._lock
+        if reminder_id not in self._queued:
+            self._queued.add(reminder_id)
+            heapq.heappush(self._heap, (due_at, reminder_id))
+
+    def _load(self, now: float):
+        until = now + self.horizon
+        due = self.store.due_reminders(until, limit=self.max_in_memory)
+        if len(due) == self.max_in_memory:
+            # Loaded only part of the horizon; register() must not skip the rest
+            until = due[-1][0]
+        with self._lock:
+            for due_at, reminder_id in due:
+                self._push(due_at, reminder_id)
+            self._loaded_until = until
+
+    def _pop_due(self, now: float) -> List[str]:
+        with self._lock:
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                _, reminder_id = heapq.heappop(self._heap)
+                self._queued.discard(reminder_id)
+                due.append(reminder_id)
+            return due
+
+    def _fire(self, reminder_ids: List[str]):
+        jobs, skipped = {}, []
+        for reminder in self.store.get_reminders(reminder_ids):
+            job = new_job(
+                reminder["name"], reminder["email"], reminder["phone"],
+                reminder["voucher_code"], reminder["template_type"],
+                email_enabled=bool(reminder["email"]), sms_enabled=bool(reminder["phone"])
+            )
+            # Reusing the reminder id means a batch re-fired after a crash finds
+            # the idempotency keys already reserved by this same job.
+            job["id"] = reminder["id"]
+            self.reserve(job)
+            if any(channel["state"] == PENDING for channel in job["channels"].values()):
+                jobs[reminder["id"]] = job
+            else:
+                skipped.append(reminder["id"])
+
+        enqueued = self.store.fire_reminders(jobs, skipped)
+        self.delivery_queue.wake()
+        self.fired += enqueued
+        self.skipped += len(skipped)
+        logger.info(f"Fired {enqueued} reminders ({len(skipped)} with nothing left to send).")
+
+    def _run(self):
+        next_load = 0.0
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            try:
+                if now >= next_load:
+                    self._load(now)
+                    next_load = now + self.horizon / 2
+                due = self._pop_due(now)
+                if due:
+                    self._fire(due)
+                    continue
+            except Exception:
+                logger.exception("Reminder scheduler pass failed.")
+                # Whatever was popped is still scheduled in the store; reload it shortly
+                next_load = min(next_load, now + 5)
+
+            with self._lock:
+                next_due = self._heap[0][0] if self._heap else next_load
+            self._wakeup.wait(max(0.0, min(next_due, next_load) - time.time()))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_memory = len(self._heap)
+        return {
+            "stored": self.store.reminder_counts(),
+            "in_memory": in_memory,
+            "fired": self.fired,
+            "skipped": self.skipped,
+        }
@@ -1,54 +1,165 @@
 import json
 import os
+import re
 import time
 import requests
 import logging
 import base64
-from dotenv import load_dotenv
+from http_pool import build_session, DEFAULT_TIMEOUT
+from rate_limiter import get_scheduler, backoff_delay, parse_retry_after
+from circuit_breaker import CircuitOpenError, get_breaker
+from metrics import PROVIDER_REQUEST_SECONDS, PROVIDER_SEND_SECONDS, PROVIDER_RETRIES, PROVIDER_RETRY_SLEEP_SECONDS
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+MESSAGE_INDEX = re.compile(r'^message\.(\d+)')
+
+MAILERSEND_API_URL = "https://api.mailersend.com/v1"
+
+def build_message(sender_email, recipient_email, recipient_name, template_id):
+    return {
+        "from": {"email": sender_email, "name": "Third Wave Cafe"},
+        "to": [{"email": recipient_email}],
+        "subject": "Your Birthday Voucher",
+        "template_id": template_id,
+        "variables": [
+            {
+                "email": recipient_email,
+                "substitutions": [
+                    {"var": "username", "value": recipient_name},
+                ]
+            }
+        ]
+    }
+
+
+def encode_attachment(content, filename):
+    return {
+        "filename": filename,
+        "content": base64.b64encode(content).decode('ascii'),
+        "disposition": "attachment"
+    }
+
+
+def bulk_results(data, count):
+    """Maps a completed bulk-email status to one bool per message (keys look like "message.3.to.0.email")."""
+    results = [True] * count
+    for field in ("validation_errors", "suppressed_recipients"):
+        for key in (data.get(field) or {}):
+            match = MESSAGE_INDEX.match(key)
+            if match and int(match.group(1)) < count:
+                results[int(match.group(1))] = False
+    return results
+
 
 class MailerSendClient:
-    def __init__(self, api_key, sender_email):
+    def __init__(self, api_key, sender_email, session=None, pool_size=10, timeout=DEFAULT_TIMEOUT, scheduler=None,
+                 base_url=MAILERSEND_API_URL, breaker=None):
         self.api_key = api_key
         self.sender_email = sender_email
-        self.endpoint = "https://api.mailersend.com/v1/email"
+        # base_url is overridden to point at a local stub when benchmarking
+        self.endpoint = f"{base_url.rstrip('/')}/email"
+        self.bulk_endpoint = f"{base_url.rstrip('/')}/bulk-email"
+        # Keep-alive connection pool shared by every send from this client
+        self.session = session or build_session(pool_size=pool_size)
+        self.timeout = timeout
+        # Every call (sends and bulk status polls) waits for a token from the shared MailerSend bucket
+        self.scheduler = scheduler or get_scheduler("mailersend")
+        # Sends fail fast with CircuitOpenError while MailerSend is down
+        self.breaker = breaker or get_breaker("mailersend")
 
-    def send_email(self, recipient_email, recipient_name, template_id, attachment_path=None, retries=3, backoff_factor=2):
-        logger.info(f" This is the template id {template_id}")
-        payload = {
-            "from": {"email": self.sender_email, "name": "Third Wave Cafe"},
-            "to": [{"email": recipient_email}],
-            "subject": "Your Birthday Voucher",
-            "template_id": template_id,
-            "variables": [
-                {
-                    "email": recipient_email,
-                    "substitutions": [
-                        {"var": "username", "value": recipient_name},
-                    ]
-                }
-            ]
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
         }
 
-        if attachment_path:
+    def _post(self, url, payload, description, retries, backoff_factor):
+        """
+        Posts JSON with retries. Returns the 2xx response, or None once every attempt has failed.
+
+        Raises:
+            CircuitOpenError: If the MailerSend breaker is open, before an attempt
+            or instead of backing off for the next one.
+        """
+        headers = self._headers()
+        provider = self.scheduler.name
+        send_started = time.perf_counter()
+
+        for attempt in range(1, retries + 1):
+            retry_after = None
+            logger.info(f"Attempt {attempt}: Sending {description}")
+            with self.breaker.attempt() as call:
+                try:
+                    self.scheduler.acquire()
+                    started = time.perf_counter()
+                    status = "error"
+                    try:
+                        response = self.session.post(
+                            url,
+                            headers=headers,
+                            json=payload,  # Send payload as JSON
+                            timeout=self.timeout
+                        )
+                        status = response.status_code
+                    finally:
+                        PROVIDER_REQUEST_SECONDS.observe(time.perf_counter() - started, provider=provider, status=status)
+
+                    if 200 <= response.status_code < 300:
+                        call.success()
+                        PROVIDER_SEND_SECONDS.observe(time.perf_counter() - send_started, provider=provider, outcome="success")
+                        return response
+                    elif response.status_code == 429:
+                        call.release()
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        self.scheduler.throttle(retry_after)
+                        logger.error(f"Rate limited sending {description} on attempt {attempt}")
+                    else:
+                        # A 4xx is our request's fault; only 5xx counts against MailerSend
+                        if response.status_code >= 500:
+                            call.failure()
+                        else:
+                            call.success()
+                        logger.error(f"Failed to send {description} on attempt {attempt}: {response.status_code} - {response.text}")
+
+                except requests.exceptions.RequestException as e:
+                    call.failure()
+                    logger.error(f"Exception on attempt {attempt}: {e}")
+
+            if attempt == retries:
+                break
+            if self.breaker.is_open():
+                raise CircuitOpenError(provider, self.breaker.retry_in())
+
+            # Exponential backoff with jitter, never sooner than Retry-After
+            sleep_time = max(backoff_delay(attempt, backoff_factor), retry_after or 0)
+            logger.info(f"Retrying in {sleep_time:.2f} seconds...")
+            PROVIDER_RETRIES.inc(provider=provider)
+            PROVIDER_RETRY_SLEEP_SECONDS.inc(sleep_time, provider=provider)
+            time.sleep(sleep_time)
+
+        PROVIDER_SEND_SECONDS.observe(time.perf_counter() - send_started, provider=provider, outcome="failure")
+        logger.error(f"All {retries} attempts to send {description} have failed.")
+        return None
+
+    def send_email(self, recipient_email, recipient_name, template_id, attachment_path=None, retries=3, backoff_factor=2,
+                   attachment_content=None, attachment_filename=None):
+        logger.info(f" This is the template id {template_id}")
+        payload = build_message(self.sender_email, recipient_email, recipient_name, template_id)
+
+        if attachment_content is not None:
+            # In-memory attachment, e.g. PDF bytes straight from render_voucher
+            filename = attachment_filename or "attachment.pdf"
+            payload["attachments"] = [encode_attachment(attachment_content, filename)]
+            logger.info(f"Attached in-memory file: {filename}")
+        elif attachment_path:
             if os.path.exists(attachment_path):
                 try:
                     with open(attachment_path, 'rb') as file:
                         file_content = file.read()
-                        encoded_content = base64.b64encode(file_content).decode('utf-8')
-                    
+
                     # Add the attachment to the payload
-                    payload["attachments"] = [
-                        {
-                            "filename": os.path.basename(attachment_path),
-                            "content": encoded_content,
-                            "disposition": "attachment"
-                        }
-                    ]
+                    payload["attachments"] = [encode_attachment(file_content, os.path.basename(attachment_path))]
                     logger.info(f"Attached file: {os.path.basename(attachment_path)}")
                 except Exception as e:
                     logger.error(f"Failed to read and encode attachment: {e}")
@@ -57,39 +168,136 @@ class MailerSendClient:
                 logger.error(f"Attachment path '{attachment_path}' does not exist.")
                 return False
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        response = self._post(self.endpoint, payload, f"email to {recipient_email}", retries, backoff_factor)
+        if response is None:
+            return False
+        logger.info(f"Email sent successfully to {recipient_email}")
+        return True
 
-        for attempt in range(1, retries + 1):
+    def send_bulk(self, items, chunk_size=500, max_chunk_bytes=40 * 1024 * 1024, retries=3, backoff_factor=2,
+                  poll_interval=2, poll_timeout=300):
+        """
+        Sends many voucher emails through MailerSend's bulk endpoint.
+
+        Parameters:
+            - items (list): Dicts with "recipient_email", "recipient_name",
+              "template_id" and optionally "attachment_content" (bytes) and
+              "attachment_filename".
+            - chunk_size (int, optional): Most messages per bulk request.
+            - max_chunk_bytes (int, optional): Approximate cap on one request body.
+            - retries (int, optional): Attempts for each bulk submission.
+            - backoff_factor (int, optional): Factor for exponential backoff.
+            - poll_interval (float, optional): Seconds between bulk status polls.
+            - poll_timeout (float, optional): Give up waiting for a chunk after this long.
+
+        Returns:
+            list: One entry per item: True if MailerSend accepted that message,
+            False if not, None if its bulk request was accepted but MailerSend
+            had not reported on it within poll_timeout (it may still go out),
+            or a CircuitOpenError for messages that were not sent because the
+            MailerSend breaker was open.
+        """
+        if len(items) == 1:
+            # Not worth a bulk round trip plus status polling
+            item = items[0]
             try:
-                logger.info(f"Attempt {attempt}: Sending email to {recipient_email}")
+                return [self.send_email(
+                    item["recipient_email"], item["recipient_name"], item["template_id"],
+                    retries=retries, backoff_factor=backoff_factor,
+                    attachment_content=item.get("attachment_content"),
+                    attachment_filename=item.get("attachment_filename")
+                )]
+            except CircuitOpenError as e:
+                return [e]
 
-                response = requests.post(
-                    self.endpoint,
-                    headers=headers,
-                    json=payload  # Send payload as JSON
+        results = []
+        for chunk in self._chunks(items, chunk_size, max_chunk_bytes):
+            messages = []
+            for item in chunk:
+                message = build_message(
+                    self.sender_email, item["recipient_email"], item["recipient_name"], item["template_id"]
                 )
+                if item.get("attachment_content") is not None:
+                    message["attachments"] = [encode_attachment(
+                        item["attachment_content"], item.get("attachment_filename") or "attachment.pdf"
+                    )]
+                messages.append(message)
 
-                if 200 <= response.status_code < 300:
-                    logger.info(f"Email sent successfully to {recipient_email}")
-                    return True
-                else:
-                    logger.error(f"Failed to send email on attempt {attempt}: {response.status_code} - {response.text}")
+            try:
+                response = self._post(self.bulk_endpoint, messages, f"bulk email of {len(messages)} messages",
+                                      retries, backoff_factor)
+            except CircuitOpenError as e:
+                # Earlier chunks went out; this one was never accepted, so it can be sent again later
+                results.extend([e] * len(chunk))
+                continue
+            bulk_email_id = None
+            if response is not None:
+                try:
+                    bulk_email_id = response.json().get("bulk_email_id")
+                except ValueError:
+                    logger.error(f"Unexpected bulk email response: {response.text}")
+            if not bulk_email_id:
+                results.extend([False] * len(chunk))
+                continue
 
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Exception on attempt {attempt}: {e}")
+            logger.info(f"Bulk email {bulk_email_id} accepted with {len(chunk)} messages")
+            results.extend(self._bulk_outcome(bulk_email_id, len(chunk), poll_interval, poll_timeout))
+        return results
 
-            # Exponential backoff
-            sleep_time = backoff_factor ** attempt
-            logger.info(f"Retrying in {sleep_time} seconds...")
-            time.sleep(sleep_time)
+    @staticmethod
+    def _chunks(items, chunk_size, max_chunk_bytes):
+        chunk, chunk_bytes = [], 0
+        for item in items:
+            # base64 grows attachments by a third
+            size = len(item.get("attachment_content") or b"") * 4 // 3 + 1024
+            if chunk and (len(chunk) >= chunk_size or chunk_bytes + size > max_chunk_bytes):
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(item)
+            chunk_bytes += size
+        if chunk:
+            yield chunk
 
-        logger.error(f"All {retries} attempts to send email to {recipient_email} have failed.")
-        return False
+    def _bulk_outcome(self, bulk_email_id, count, poll_interval, poll_timeout):
+        """Polls a bulk email until MailerSend has processed it and maps the result to each message (None once timed out)."""
+        url = f"{self.bulk_endpoint}/{bulk_email_id}"
+        deadline = time.monotonic() + poll_timeout
+        while True:
+            try:
+                self.scheduler.acquire()
+                response = self.session.get(url, headers=self._headers(), timeout=self.timeout)
+                if response.status_code == 429:
+                    self.scheduler.throttle(parse_retry_after(response.headers.get("Retry-After")))
+                elif 200 <= response.status_code < 300:
+                    data = response.json().get("data") or {}
+                    state = data.get("state")
+                    if state == "completed":
+                        break
+                    if state == "failed":
+                        logger.error(f"Bulk email {bulk_email_id} failed.")
+                        return [False] * count
+                else:
+                    logger.error(f"Failed to fetch bulk email status: {response.status_code} - {response.text}")
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(f"Exception fetching bulk email status: {e}")
+
+            if time.monotonic() > deadline:
+                # The messages are queued at MailerSend, so they are not failures to resend
+                logger.error(f"Timed out waiting for bulk email {bulk_email_id}; outcome unknown.")
+                return [None] * count
+            time.sleep(poll_interval)
+
+        results = bulk_results(data, count)
+        failed = results.count(False)
+        if failed:
+            logger.error(f"Bulk email {bulk_email_id}: {failed} of {count} messages were rejected.")
+        return results
 
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
     api_key = os.getenv("MAILERSEND_API_KEY")
     sender = os.getenv("MAILERSEND_SENDER")
     template_id = os.getenv("MAILERSEND_NEXT_YEAR_2WEEKS_ID")
@@ -4,27 +4,15 @@ import os
 import time
 import requests
 import logging
-from typing import List, Optional, Dict, Any
-from dotenv import load_dotenv
+from typing import List, Optional, Dict, Any, Tuple
+from http_pool import build_session, DEFAULT_TIMEOUT
+from rate_limiter import ProviderScheduler, get_scheduler, backoff_delay, parse_retry_after
+from circuit_breaker import CircuitBreaker, CircuitOpenError, get_breaker
+from metrics import PROVIDER_REQUEST_SECONDS, PROVIDER_SEND_SECONDS, PROVIDER_RETRIES, PROVIDER_RETRY_SLEEP_SECONDS
 
-# Load environment variables from .env file
-load_dotenv()
+CELLCAST_API_URL = "https://cellcast.com.au/api/v3"
 
-# Configure logging
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-# Create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-
-# Create formatter and add it to the handler
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-
-# Add the handler to the logger if not already added
-if not logger.handlers:
-    logger.addHandler(ch)
 
 
 class CellCastClient:
@@ -33,7 +21,13 @@ class CellCastClient:
         app_key: str,
         sender_id: Optional[str] = None,
         source: Optional[str] = None,
-        custom_string: Optional[str] = None
+        custom_string: Optional[str] = None,
+        session: Optional[requests.Session] = None,
+        pool_size: int = 10,
+        timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+        scheduler: Optional[ProviderScheduler] = None,
+        base_url: str = CELLCAST_API_URL,
+        breaker: Optional[CircuitBreaker] = None
     ):
         """
         Initializes the CellCastClient with necessary configurations.
@@ -43,13 +37,27 @@ class CellCastClient:
             - sender_id (str, optional): Your approved Sender ID (e.g., "TWCafe").
             - source (str, optional): Source identifier (e.g., "Zoho").
             - custom_string (str, optional): Custom string identifier (e.g., "Zoho").
+            - session (requests.Session, optional): Pooled session to send through.
+              A keep-alive session is created when omitted.
+            - pool_size (int, optional): Connection pool size for the created session.
+            - timeout (tuple, optional): (connect, read) timeouts in seconds.
+            - scheduler (ProviderScheduler, optional): Token bucket every call waits on.
+              Defaults to the shared "cellcast" scheduler.
+            - base_url (str, optional): API root, e.g. a local stub when benchmarking.
+            - breaker (CircuitBreaker, optional): Refuses sends while CellCast is down.
+              Defaults to the shared "cellcast" breaker.
         """
         self.app_key = app_key
         self.sender_id = sender_id
         self.source = source
         self.custom_string = custom_string
         # Endpoint updated for sending SMS via template
-        self.endpoint = "https://cellcast.com.au/api/v3/send-sms-template"
+        self.endpoint = f"{base_url.rstrip('/')}/send-sms-template"
+        # Keep-alive connection pool shared by every send from this client
+        self.session = session or build_session(pool_size=pool_size)
+        self.timeout = timeout
+        self.scheduler = scheduler or get_scheduler("cellcast")
+        self.breaker = breaker or get_breaker("cellcast")
 
     def send_sms_template(
         self,
@@ -85,61 +93,182 @@ class CellCastClient:
         Returns:
             bool: True if the SMS was sent successfully, False otherwise.
         """
+        response_json = self._send(template_id, numbers, schedule_time, delay, retries, backoff_factor)
+        return response_json is not None
+
+    def send_sms_template_batch(
+        self,
+        template_id: str,
+        numbers: List[Dict[str, Any]],
+        schedule_time: Optional[str] = None,
+        delay: Optional[int] = None,
+        retries: int = 3,
+        backoff_factor: int = 2
+    ) -> List[bool]:
+        """
+        Sends one template SMS call for many recipients and reports each one.
+
+        Parameters are the same as send_sms_template().
+
+        Returns:
+            List[bool]: One entry per recipient in `numbers`, True if CellCast
+            accepted a message for that number. If the CellCast breaker was
+            open, nothing was sent and every entry is the CircuitOpenError.
+        """
+        try:
+            response_json = self._send(template_id, numbers, schedule_time, delay, retries, backoff_factor)
+        except CircuitOpenError as e:
+            return [e] * len(numbers)
+        if response_json is None:
+            return [False] * len(numbers)
+
+        results = template_results(response_json, numbers)
+        rejected = results.count(False)
+        if rejected:
+            logger.error(f"CellCast rejected {rejected} of {len(numbers)} recipients.")
+        return results
+
+    def _send(
+        self,
+        template_id: str,
+        numbers: List[Dict[str, Any]],
+        schedule_time: Optional[str],
+        delay: Optional[int],
+        retries: int,
+        backoff_factor: int
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Posts to send-sms-template with retries. Returns the response JSON on success, else None.
+
+        Raises:
+            CircuitOpenError: If the CellCast breaker is open, before an attempt
+            or instead of backing off for the next one.
+        """
         headers = {
             "APPKEY": self.app_key,
             "Content-Type": "application/json"
         }
+        payload = build_template_payload(
+            template_id, numbers, self.sender_id, self.source, self.custom_string, schedule_time, delay
+        )
 
-        payload = {
-            "template_id": template_id,
-            "numbers": numbers
-        }
-
-        if self.sender_id:
-            payload["from"] = self.sender_id
-        if self.source:
-            payload["source"] = self.source
-        if self.custom_string:
-            payload["custom_string"] = self.custom_string
-        if schedule_time:
-            payload["schedule_time"] = schedule_time
-        if delay:
-            payload["delay"] = delay
+        provider = self.scheduler.name
+        send_started = time.perf_counter()
 
         for attempt in range(1, retries + 1):
-            try:
-                logger.info(f"Attempt {attempt}: Sending template SMS to recipients.")
-                response = requests.post(self.endpoint, headers=headers, json=payload)
-
-                logger.info(f"Response Code: {response.status_code}")
-                logger.info(f"Response Text: {response.text}")
-
-                if response.status_code == 200:
-                    response_json = response.json()
-                    meta = response_json.get("meta", {})
-                    code = meta.get("code")
-                    msg = response_json.get("msg", "")
-
-                    if code == 200:
-                        logger.info("Template SMS sent successfully!")
-                        return True
+            retry_after = None
+            logger.info(f"Attempt {attempt}: Sending template SMS to {len(numbers)} recipients.")
+            with self.breaker.attempt() as call:
+                try:
+                    self.scheduler.acquire()
+                    started = time.perf_counter()
+                    status = "error"
+                    try:
+                        response = self.session.post(self.endpoint, headers=headers, json=payload, timeout=self.timeout)
+                        status = response.status_code
+                    finally:
+                        PROVIDER_REQUEST_SECONDS.observe(time.perf_counter() - started, provider=provider, status=status)
+
+                    logger.info(f"Response Code: {response.status_code}")
+                    logger.info(f"Response Text: {response.text}")
+
+                    if response.status_code == 200:
+                        # CellCast answered; a rejection in the body is about the request, not an outage
+                        call.success()
+                        response_json = response.json()
+                        meta = response_json.get("meta", {})
+                        code = meta.get("code")
+                        msg = response_json.get("msg", "")
+
+                        if code == 200:
+                            logger.info("Template SMS sent successfully!")
+                            PROVIDER_SEND_SECONDS.observe(time.perf_counter() - send_started, provider=provider, outcome="success")
+                            return response_json
+                        else:
+                            logger.error(f"Failed to send Template SMS: {msg} (Code: {code})")
+                    elif response.status_code == 429:
+                        call.release()
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        self.scheduler.throttle(retry_after)
+                        logger.error("Failed to send Template SMS: rate limited (HTTP 429)")
                     else:
-                        logger.error(f"Failed to send Template SMS: {msg} (Code: {code})")
-                else:
-                    logger.error(f"Failed to send Template SMS: HTTP {response.status_code}")
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Exception on attempt {attempt}: {e}")
-
-            # Exponential backoff before retrying
-            sleep_time = backoff_factor ** attempt
-            logger.info(f"Retrying in {sleep_time} seconds...")
+                        if response.status_code >= 500:
+                            call.failure()
+                        else:
+                            call.success()
+                        logger.error(f"Failed to send Template SMS: HTTP {response.status_code}")
+                except requests.exceptions.RequestException as e:
+                    call.failure()
+                    logger.error(f"Exception on attempt {attempt}: {e}")
+
+            if attempt == retries:
+                break
+            if self.breaker.is_open():
+                raise CircuitOpenError(provider, self.breaker.retry_in())
+
+            # Exponential backoff with jitter, never sooner than Retry-After
+            sleep_time = max(backoff_delay(attempt, backoff_factor), retry_after or 0)
+            logger.info(f"Retrying in {sleep_time:.2f} seconds...")
+            PROVIDER_RETRIES.inc(provider=provider)
+            PROVIDER_RETRY_SLEEP_SECONDS.inc(sleep_time, provider=provider)
             time.sleep(sleep_time)
 
+        PROVIDER_SEND_SECONDS.observe(time.perf_counter() - send_started, provider=provider, outcome="failure")
         logger.error(f"All {retries} attempts to send the template SMS have failed.")
-        return False
+        return None
+
+
+def build_template_payload(
+    template_id: str,
+    numbers: List[Dict[str, Any]],
+    sender_id: Optional[str] = None,
+    source: Optional[str] = None,
+    custom_string: Optional[str] = None,
+    schedule_time: Optional[str] = None,
+    delay: Optional[int] = None
+) -> Dict[str, Any]:
+    payload = {
+        "template_id": template_id,
+        "numbers": numbers
+    }
+
+    if sender_id:
+        payload["from"] = sender_id
+    if source:
+        payload["source"] = source
+    if custom_string:
+        payload["custom_string"] = custom_string
+    if schedule_time:
+        payload["schedule_time"] = schedule_time
+    if delay:
+        payload["delay"] = delay
+    return payload
+
 
+def template_results(response_json: Dict[str, Any], numbers: List[Dict[str, Any]]) -> List[bool]:
+    """Maps a successful send-sms-template response to one bool per recipient."""
+    data = response_json.get("data") or {}
+    messages = data.get("messages") if isinstance(data, dict) else None
+    if not isinstance(messages, list):
+        # No per-number breakdown: the call as a whole succeeded
+        return [True] * len(numbers)
+
+    accepted = {normalize_number(message.get("to", "")) for message in messages}
+    return [normalize_number(recipient["number"]) in accepted for recipient in numbers]
+
+
+def normalize_number(number: str) -> str:
+    """Reduces a phone number to digits with the 61 country code, for matching CellCast results."""
+    digits = "".join(ch for ch in str(number) if ch.isdigit())
+    if digits.startswith("0"):
+        digits = "61" + digits[1:]
+    return digits
 
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    load_dotenv()
     CELLCAST_APPKEY = os.getenv("CELLCAST_API_KEY", "")
     TEMPLATE_ID = os.getenv("CELLCAST_1ST_2WEEKS_ID", "")
     RECIPIENTS = [
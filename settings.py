@@ -0,0 +1,106 @@
+# settings.py
+#
+# Typed configuration, read from the environment (and .env) once per process.
+# Each field is filled from the environment variable of the same name in
+# upper case, converted to the type of its default.
+
+import dataclasses
+import os
+from dataclasses import dataclass
+from typing import Mapping, Optional
+
+
+@dataclass(frozen=True)
+class Settings:
+    # Providers
+    mailersend_api_key: Optional[str] = None
+    mailersend_sender: Optional[str] = None
+    mailersend_api_url: str = "https://api.mailersend.com/v1"
+    mailersend_rate_per_sec: float = 2.0
+    mailersend_burst: int = 10
+    cellcast_api_key: Optional[str] = None
+    cellcast_sender_id: Optional[str] = None
+    cellcast_api_url: str = "https://cellcast.com.au/api/v3"
+    cellcast_rate_per_sec: float = 5.0
+    cellcast_burst: int = 10
+    http_connect_timeout: float = 3.05
+    http_read_timeout: float = 15.0
+    http_max_connections: int = 100
+    # Per-provider circuit breakers (see CircuitBreaker)
+    circuit_failure_threshold: int = 5
+    circuit_failure_rate: float = 0.5
+    circuit_window_seconds: float = 60.0
+    circuit_open_seconds: float = 30.0
+    circuit_half_open_calls: int = 1
+
+    # Webhook
+    webhook_secret_token: Optional[str] = None
+    public_image_base_url: str = "http://209.38.84.84/images"
+    log_level: str = "DEBUG"
+    log_file: str = "app.log"
+
+    # Delivery
+    delivery_workers: int = 4
+    job_store_path: str = "jobs.db"
+    idempotency_ttl_seconds: float = 7 * 24 * 3600.0
+    sms_batch_max_size: int = 100
+    sms_batch_max_wait: float = 0.5
+    email_batch_max_size: int = 50
+    email_batch_max_wait: float = 1.0
+    email_batch_max_pending: int = 500
+    bulk_batch_size: int = 500
+
+    # Rendering
+    voucher_cache_dir: str = "voucher_cache"
+    voucher_cache_memory_mb: int = 64
+    voucher_cache_disk_mb: int = 1024
+    hot_image_cache_mb: int = 32
+    render_workers: int = 4
+    # Voucher encoding (see create_voucher_pdf.Encoding)
+    voucher_pdf_mode: str = "raster"
+    voucher_pdf_quality: int = 30
+    voucher_image_format: str = "jpeg"
+    voucher_image_quality: int = 30
+    voucher_image_target_bytes: int = 0
+    templates_file: str = ""  # JSON template registry; empty reads the template ids from the environment
+
+    # Reminders
+    reminder_stages: str = "TEMPLATE_1ST_2WEEKS:-14,TEMPLATE_1MONTH:335,TEMPLATE_2ND_2WEEKS:351"
+    reminder_timezone: str = "Australia/Sydney"
+    reminder_send_hour: int = 9
+    reminder_spread_minutes: float = 120.0
+    reminder_batch_size: int = 500
+
+    @classmethod
+    def from_env(cls, env: Optional[Mapping[str, str]] = None) -> "Settings":
+        """
+        Builds settings from `env` (default: os.environ).
+
+        Raises:
+            ValueError: If a variable cannot be converted to its field's type.
+        """
+        env = os.environ if env is None else env
+        values = {}
+        for field in dataclasses.fields(cls):
+            raw = env.get(field.name.upper())
+            if raw is None:
+                continue
+            cast = type(field.default) if field.default is not None else str
+            try:
+                values[field.name] = cast(raw)
+            except ValueError:
+                raise ValueError(f"{field.name.upper()} must be a {cast.__name__}, got {raw!r}") from None
+        return cls(**values)
+
+
+_settings: Optional[Settings] = None
+
+
+def load_settings() -> Settings:
+    """Loads .env (once per process) and returns the settings read from the environment."""
+    global _settings
+    if _settings is None:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _settings = Settings.from_env()
+    return _settings
@@ -0,0 +1,206 @@
+# templates.py
+#
+# Template registry: maps each template type to its MailerSend and CellCast
+# template ids and to the voucher artwork (base image, font and text layout).
+#
+# The registry is built once, validated, and replaced as a whole by reload(),
+# so lookups are a single dict access. It is read from a JSON file when one is
+# configured (TEMPLATES_FILE):
+#
+#   {
+#     "default": {"email_template_id": "...", "sms_template_id": "..."},
+#     "templates": {
+#       "TEMPLATE_1MONTH": {
+#         "email_template_id": "...", "sms_template_id": "...",
+#         "image_path": "assests/voucher_1month.jpg",
+#         "layout": {"name_y": 0.31, "font_size_name": 72}
+#       }
+#     }
+#   }
+#
+# Artwork fields missing from a template are taken from "default", and layout
+# fields missing from both from TextLayout. Without a file the registry is
+# built from the MAILERSEND_*_ID / CELLCAST_*_ID environment variables, with
+# the default artwork for every template type.
+
+import dataclasses
+import json
+import logging
+import os
+import signal
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional
+
+from create_voucher_pdf import FONT_PATH, IMAGE_PATH, TextLayout, VoucherRenderer, get_renderer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT = "default"
+
+# Template type -> (MailerSend variable, CellCast variable), for configuration from the environment
+ENV_TEMPLATE_IDS = {
+    "TEMPLATE_1ST_2WEEKS": ("MAILERSEND_1ST_2WEEKS_ID", "CELLCAST_1ST_2WEEKS_ID"),
+    "TEMPLATE_1MONTH": ("MAILERSEND_NEXT_YEAR_1MONTH_ID", "CELLCAST_NEXT_YEAR_1MONTH_ID"),
+    "TEMPLATE_2ND_2WEEKS": ("MAILERSEND_NEXT_YEAR_2WEEKS_ID", "CELLCAST_NEXT_YEAR_2WEEKS_ID"),
+    DEFAULT: ("MAILERSEND_DEFAULT_TEMPLATE_ID", "CELLCAST_TEMPLATE_ID"),
+}
+
+TEMPLATE_FIELDS = ("email_template_id", "sms_template_id", "image_path", "font_path", "layout")
+
+
+@dataclass(frozen=True)
+class Template:
+    template_type: str
+    email_template_id: str
+    sms_template_id: str
+    image_path: str = IMAGE_PATH
+    font_path: str = FONT_PATH
+    layout: TextLayout = TextLayout()
+    renderer: Optional[VoucherRenderer] = dataclasses.field(default=None, compare=False, repr=False)
+
+
+class TemplateRegistry:
+    def __init__(self, templates: Dict[str, Template], source: str):
+        """
+        Read-only lookup of templates by type. Unknown types get the default template.
+
+        Parameters:
+            - templates (dict): Template type -> Template; must include "default".
+            - source (str): Where the templates were read from, for logs and /health.
+        """
+        self._templates = templates
+        self.default = templates[DEFAULT]
+        self.source = source
+
+    def get(self, template_type: str) -> Template:
+        return self._templates.get(template_type, self.default)
+
+    def renderers(self) -> List[VoucherRenderer]:
+        """The distinct renderers used by the templates."""
+        return list({id(t.renderer): t.renderer for t in self._templates.values()}.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {"source": self.source, "template_types": sorted(self._templates)}
+
+
+def _build(specs: Mapping[str, Mapping[str, Any]], source: str) -> TemplateRegistry:
+    """
+    Validates template specs and resolves their renderers.
+
+    Raises:
+        ValueError: Listing every problem found, e.g. a missing template id or artwork file.
+    """
+    problems = []
+    if DEFAULT not in specs:
+        problems.append(f'no "{DEFAULT}" template')
+    defaults = specs.get(DEFAULT, {})
+
+    templates = {}
+    for template_type, spec in specs.items():
+        unknown = set(spec) - set(TEMPLATE_FIELDS)
+        if unknown:
+            problems.append(f"{template_type}: unknown fields {sorted(unknown)}")
+            continue
+        for field in ("email_template_id", "sms_template_id"):
+            if not spec.get(field):
+                problems.append(f"{template_type}: missing {field}")
+        image_path = spec.get("image_path") or defaults.get("image_path") or IMAGE_PATH
+        font_path = spec.get("font_path") or defaults.get("font_path") or FONT_PATH
+        for path in (image_path, font_path):
+            if not os.path.isfile(path):
+                problems.append(f"{template_type}: {path} not found")
+        try:
+            layout = TextLayout(**{**defaults.get("layout", {}), **spec.get("layout", {})})
+        except TypeError as e:
+            problems.append(f"{template_type}: invalid layout ({e})")
+            continue
+        templates[template_type] = Template(
+            template_type, str(spec.get("email_template_id") or ""), str(spec.get("sms_template_id") or ""),
+            image_path, font_path, layout, renderer=get_renderer(image_path, font_path, layout)
+        )
+
+    if problems:
+        raise ValueError(f"Invalid templates from {source}: " + "; ".join(problems))
+    return TemplateRegistry(templates, source)
+
+
+def from_env(env: Optional[Mapping[str, str]] = None) -> TemplateRegistry:
+    env = os.environ if env is None else env
+    missing = [var for pair in ENV_TEMPLATE_IDS.values() for var in pair if not env.get(var)]
+    if missing:
+        raise ValueError(f"Missing template ids in the environment: {', '.join(missing)}")
+    specs = {
+        template_type: {"email_template_id": env[email_var], "sms_template_id": env[sms_var]}
+        for template_type, (email_var, sms_var) in ENV_TEMPLATE_IDS.items()
+    }
+    return _build(specs, "environment")
+
+
+def from_file(path: str) -> TemplateRegistry:
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    specs = dict(config.get("templates", {}))
+    if DEFAULT in config:
+        specs[DEFAULT] = config[DEFAULT]
+    return _build(specs, path)
+
+
+_registry: Optional[TemplateRegistry] = None
+_path: Optional[str] = None
+_reload_lock = threading.Lock()
+
+
+def load(path: Optional[str] = None) -> TemplateRegistry:
+    """
+    Builds the registry from `path` (or the environment if None) and makes it current.
+
+    Raises:
+        ValueError: If the templates are invalid; the current registry is kept.
+        OSError: If the file cannot be read.
+    """
+    global _registry, _path
+    registry = from_file(path) if path else from_env()
+    _registry, _path = registry, path
+    logger.info(f"Loaded templates from {registry.source}: {', '.join(registry.stats()['template_types'])}")
+    return registry
+
+
+def reload() -> bool:
+    """Re-reads the templates from where they were last loaded and pre-warms their artwork. Returns True on success."""
+    global _registry
+    with _reload_lock:
+        try:
+            registry = from_file(_path) if _path else from_env()
+            for renderer in registry.renderers():
+                renderer.acquire()
+        except (OSError, ValueError) as e:
+            logger.error(f"Template reload failed, keeping the current templates: {e}")
+            return False
+        _registry = registry
+    logger.info(f"Reloaded templates from {registry.source}.")
+    return True
+
+
+def install_reload_handler() -> bool:
+    """
+    Reloads the templates on SIGHUP, on a background thread. Only possible from the main thread.
+
+    Returns:
+        bool: Whether the handler was installed.
+    """
+    if threading.current_thread() is not threading.main_thread() or not hasattr(signal, "SIGHUP"):
+        return False
+    signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+        target=reload, name="template-reload", daemon=True
+    ).start())
+    return True
+
+
+def registry() -> TemplateRegistry:
+    """The current registry, loaded from the environment on first use if load() was not called."""
+    return _registry or load()
+
+
+def get(template_type: str) -> Template:
+    return registry().get(template_type)
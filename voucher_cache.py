@@ -0,0 +1,378 @@
+# voucher_cache.py
+
+import hashlib
+import logging
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows; one process owns the cache there
+    fcntl = None
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from create_voucher_pdf import VoucherRenderer, get_renderer, render_voucher
+from metrics import RENDER_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+Artifacts = Tuple[bytes, bytes]  # (pdf_bytes, jpg_bytes)
+
+# Share of max_disk_bytes a process writes before re-measuring the disk tier,
+# which bounds how far several processes together overshoot the limit
+DISK_RESCAN_FRACTION = 0.05
+
+
+def cache_key(name: str, voucher_code: str, asset_version: str) -> str:
+    return hashlib.sha256(f"{name}\0{voucher_code}\0{asset_version}".encode("utf-8")).hexdigest()
+
+
+def _code_digest(voucher_code: str) -> str:
+    # Voucher codes come from the CRM, so never use them as file names directly
+    return hashlib.sha1(voucher_code.encode("utf-8")).hexdigest()
+
+
+class VoucherCache:
+    def __init__(
+        self,
+        directory: str = "voucher_cache",
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        max_disk_bytes: int = 1024 * 1024 * 1024,
+        max_codes: int = 100_000
+    ):
+        """
+        Two-tier cache of rendered vouchers.
+
+        Entries are keyed by (name, voucher code, template asset version), so a
+        retry or a later reminder for the same voucher reuses the first render.
+        The memory tier is an LRU bounded by bytes; the disk tier keeps
+        <key>.pdf and <key>.jpg files and evicts the least recently used ones
+        once it grows past max_disk_bytes. The disk tier survives restarts and
+        can be filled ahead of time by prerender.py --cache-dir.
+
+        Several processes (preforked workers) may share the disk tier. Each
+        re-measures the directory after writing DISK_RESCAN_FRACTION of the
+        limit, so the others' writes count against the same bound, and
+        evictions hold an exclusive lock on <directory>/evict.lock.
+
+        The latest key of each voucher code, used to serve its image, is kept in
+        codes/<sha1 of code> and in an LRU of at most max_codes entries; files
+        pointing at evicted objects are deleted with them.
+
+        Parameters:
+            - directory (str, optional): Disk tier location.
+            - max_memory_bytes (int, optional): Memory tier capacity.
+            - max_disk_bytes (int, optional): Disk tier capacity.
+            - max_codes (int, optional): Voucher codes whose latest key is kept in memory.
+        """
+        self.directory = os.path.abspath(directory)
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_codes = max_codes
+
+        self._memory: "OrderedDict[str, Artifacts]" = OrderedDict()
+        self._memory_bytes = 0
+        self._codes: "OrderedDict[str, str]" = OrderedDict()  # voucher code -> latest key
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "codes"), exist_ok=True)
+        self._disk_bytes = self._scan_disk()
+        self._unscanned_bytes = 0  # Written by this process since the last scan
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # --- paths ---
+
+    def _object_path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, "objects", key[:2], f"{key}.{ext}")
+
+    def _code_path(self, voucher_code: str) -> str:
+        return os.path.join(self.directory, "codes", _code_digest(voucher_code))
+
+    def _scan_disk(self) -> int:
+        total = 0
+        for root, _, files in os.walk(os.path.join(self.directory, "objects")):
+            for filename in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, filename))
+                except FileNotFoundError:
+                    pass  # Evicted or renamed by another process meanwhile
+        return total
+
+    # --- memory tier ---
+
+    def _memory_get(self, key: str) -> Optional[Artifacts]:
+        with self._lock:
+            artifacts = self._memory.get(key)
+            if artifacts is not None:
+                self._memory.move_to_end(key)
+            return artifacts
+
+    def _memory_put(self, key: str, artifacts: Artifacts):
+        size = len(artifacts[0]) + len(artifacts[1])
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old[0]) + len(old[1])
+            self._memory[key] = artifacts
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                _, (pdf_bytes, jpg_bytes) = self._memory.popitem(last=False)
+                self._memory_bytes -= len(pdf_bytes) + len(jpg_bytes)
+
+    # --- disk tier ---
+
+    def _disk_get(self, key: str) -> Optional[Artifacts]:
+        try:
+            with open(self._object_path(key, "pdf"), "rb") as f:
+                pdf_bytes = f.read()
+            jpg_path = self._object_path(key, "jpg")
+            with open(jpg_path, "rb") as f:
+                jpg_bytes = f.read()
+        except FileNotFoundError:
+            return None
+        # Mark as recently used for eviction
+        os.utime(jpg_path)
+        return pdf_bytes, jpg_bytes
+
+    def _disk_put(self, key: str, artifacts: Artifacts):
+        written = 0
+        for ext, content in zip(("pdf", "jpg"), artifacts):
+            path = self._object_path(key, ext)
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+            written += len(content)
+        with self._lock:
+            self._disk_bytes += written
+            self._unscanned_bytes += written
+            rescan = self._unscanned_bytes >= self.max_disk_bytes * DISK_RESCAN_FRACTION
+        if rescan:
+            total = self._scan_disk()
+            with self._lock:
+                self._disk_bytes, self._unscanned_bytes = total, 0
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Evicts under the directory's lock; a process finding another one evicting leaves it to that one."""
+        if fcntl is None:
+            self._evict_disk_locked()
+            return
+        with open(os.path.join(self.directory, "evict.lock"), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                self._evict_disk_locked()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _evict_disk_locked(self):
+        """Deletes least recently used entries until the disk tier is 10% under its limit."""
+        total = self._scan_disk()
+        if total <= self.max_disk_bytes:
+            # Another process evicted since this one last measured
+            with self._lock:
+                self._disk_bytes, self._unscanned_bytes = total, 0
+            return
+        entries = []
+        for root, _, files in os.walk(os.path.join(self.directory, "objects")):
+            for filename in files:
+                if filename.endswith(".jpg"):
+                    path = os.path.join(root, filename)
+                    try:
+                        entries.append((os.path.getmtime(path), filename[:-4]))
+                    except FileNotFoundError:
+                        pass
+        entries.sort()
+
+        target = int(self.max_disk_bytes * 0.9)
+        evicted = set()
+        for _, key in entries:
+            if total <= target:
+                break
+            for ext in ("pdf", "jpg"):
+                path = self._object_path(key, ext)
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            evicted.add(key)
+        with self._lock:
+            self._disk_bytes, self._unscanned_bytes = total, 0
+            for voucher_code in [code for code, key in self._codes.items() if key in evicted]:
+                del self._codes[voucher_code]
+        pruned = self._prune_codes(evicted)
+        logger.info(f"Evicted {len(evicted)} vouchers and {pruned} code links from the disk cache.")
+
+    def _prune_codes(self, evicted) -> int:
+        """Deletes the codes/ files pointing at evicted keys. Eviction is rare, so a scan is cheap enough."""
+        codes_dir = os.path.join(self.directory, "codes")
+        pruned = 0
+        for filename in os.listdir(codes_dir):
+            path = os.path.join(codes_dir, filename)
+            try:
+                with open(path) as f:
+                    key = f.read().strip()
+                if key in evicted:
+                    os.remove(path)
+                    pruned += 1
+            except FileNotFoundError:
+                pass
+        return pruned
+
+    # --- public API ---
+
+    def key_for(self, name: str, voucher_code: str, renderer: Optional[VoucherRenderer] = None) -> str:
+        return cache_key(name, voucher_code, (renderer or get_renderer()).asset_version())
+
+    def get(self, name: str, voucher_code: str, renderer: Optional[VoucherRenderer] = None) -> Optional[Artifacts]:
+        key = self.key_for(name, voucher_code, renderer)
+        artifacts = self._memory_get(key)
+        if artifacts is not None:
+            self.memory_hits += 1
+            return artifacts
+        artifacts = self._disk_get(key)
+        if artifacts is not None:
+            self.disk_hits += 1
+            self._memory_put(key, artifacts)
+            return artifacts
+        self.misses += 1
+        return None
+
+    def put(self, name: str, voucher_code: str, pdf_bytes: bytes, jpg_bytes: bytes,
+            renderer: Optional[VoucherRenderer] = None):
+        key = self.key_for(name, voucher_code, renderer)
+        artifacts = (pdf_bytes, jpg_bytes)
+        self._disk_put(key, artifacts)
+        self._memory_put(key, artifacts)
+        self._remember_code(voucher_code, key)
+
+    def get_or_render(self, name: str, voucher_code: str, renderer: Optional[VoucherRenderer] = None) -> Artifacts:
+        """Returns (pdf_bytes, jpg_bytes) drawn on the renderer's artwork, rendering and caching them on a miss."""
+        artifacts = self.get(name, voucher_code, renderer)
+        if artifacts is None:
+            timings: Dict[str, float] = {}
+            pdf_bytes, jpg_bytes = render_voucher(
+                name, voucher_code, include_jpg=True, timings=timings, renderer=renderer
+            )
+            for stage, seconds in timings.items():
+                RENDER_STAGE_SECONDS.observe(seconds, stage=stage)
+            self.put(name, voucher_code, pdf_bytes, jpg_bytes, renderer)
+            artifacts = (pdf_bytes, jpg_bytes)
+        return artifacts
+
+    def _codes_put(self, voucher_code: str, key: str):
+        # Caller holds self._lock
+        self._codes[voucher_code] = key
+        self._codes.move_to_end(voucher_code)
+        while len(self._codes) > self.max_codes:
+            self._codes.popitem(last=False)
+
+    def _remember_code(self, voucher_code: str, key: str):
+        with self._lock:
+            if self._codes.get(voucher_code) == key:
+                self._codes.move_to_end(voucher_code)
+                return
+            self._codes_put(voucher_code, key)
+        path = self._code_path(voucher_code)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(key)
+        os.replace(tmp_path, path)
+
+    def _key_for_code(self, voucher_code: str) -> Optional[str]:
+        with self._lock:
+            key = self._codes.get(voucher_code)
+            if key is not None:
+                self._codes.move_to_end(voucher_code)
+                return key
+        try:
+            with open(self._code_path(voucher_code)) as f:
+                key = f.read().strip()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._codes_put(voucher_code, key)
+        return key
+
+    def image_file(self, voucher_code: str) -> Optional[Tuple[str, str]]:
+        """
+        Locates the latest voucher_<code>.jpg in the disk tier, for serving with sendfile.
+
+        Returns:
+            tuple: (cache key, file path), or None if it is not on disk. The key
+            identifies the content, so it doubles as a strong ETag.
+        """
+        key = self._key_for_code(voucher_code)
+        if key is None:
+            return None
+        path = self._object_path(key, "jpg")
+        return (key, path) if os.path.exists(path) else None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+        }
+
+
+class HotImageCache:
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        """
+        Byte-bounded LRU of voucher images most likely to be fetched next.
+
+        Filled when an SMS linking to an image goes out, so the burst of
+        recipients opening the link is served straight from memory.
+        """
+        self.max_bytes = max_bytes
+        self._images: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, voucher_code: str) -> Optional[Tuple[bytes, str]]:
+        """Returns (jpg_bytes, etag) or None."""
+        with self._lock:
+            entry = self._images.get(voucher_code)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._images.move_to_end(voucher_code)
+            self.hits += 1
+            return entry
+
+    def put(self, voucher_code: str, jpg_bytes: bytes, etag: str):
+        if len(jpg_bytes) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._images.pop(voucher_code, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._images[voucher_code] = (jpg_bytes, etag)
+            self._bytes += len(jpg_bytes)
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._images.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "bytes": self._bytes, "images": len(self._images)}
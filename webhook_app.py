@@ -1,198 +1,848 @@
 # webhook_app.py
-
-from flask import Flask, request, jsonify
+#
+# Build the app with create_app(); wsgi.py does this for production servers
+# (see gunicorn.conf.py for the preforked setup). Importing this module only
+# defines the routes: configuration is read, services are built and
+# background threads are started by create_app(), and Pillow and fpdf are not
+# imported until the first render or warm_up().
+
+from flask import Blueprint, Flask, request, jsonify, Response, send_file, stream_with_context
+import csv
+import io
+import json
 import logging
 import os
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
 from send_email import MailerSendClient
 from send_sms import CellCastClient  # This module now has send_sms_template method
-from dotenv import load_dotenv
-import re
-from create_voucher_pdf import generate_voucher_pdf  # Assuming you have this module
-
-# Load environment variables from .env file
-load_dotenv()
+from settings import Settings, load_settings
+from create_voucher_pdf import Encoding, image_mimetype, set_encoding
+import templates
+from validation import NO_CONTACT, REJECTION_MESSAGES, validate_batch, validate_record
+from voucher_cache import VoucherCache, HotImageCache
+from delivery import DeliveryQueue, new_job, CHANNELS, PENDING, SENT, FAILED, SKIPPED, PARKED, UNCONFIRMED
+from job_store import JobStore
+from batcher import Batcher
+from rate_limiter import get_scheduler, all_schedulers
+from circuit_breaker import CircuitOpenError, HALF_OPEN, get_breaker, all_breakers
+from idempotency import IdempotencyIndex, channel_key, header_key
+from reminders import ReminderScheduler, parse_stages, parse_birthday, plan_reminders
+from zoneinfo import ZoneInfo
+import metrics
+from metrics import WEBHOOK_STAGE_SECONDS, WEBHOOK_REQUESTS, DELIVERIES
+
+bp = Blueprint("webhook", __name__)
 
-app = Flask(__name__)
-
-# Initialize Logger
-logging.basicConfig(level=logging.DEBUG)  # Set to DEBUG for detailed logs
 logger = logging.getLogger(__name__)
 
-# Set up RotatingFileHandler
-from logging.handlers import RotatingFileHandler
-
-handler = RotatingFileHandler('app.log', maxBytes=1000000, backupCount=5)
-handler.setLevel(logging.DEBUG)  # Set to DEBUG to capture detailed logs
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-
-# Load MailerSend Credentials
-mailersend_api_key = os.getenv("MAILERSEND_API_KEY")
-mailersend_sender = os.getenv("MAILERSEND_SENDER")
-
-logger.info(f"MAILERSEND_API_KEY: {'Loaded' if mailersend_api_key else 'Missing'}")
-logger.info(f"MAILERSEND_SENDER: {mailersend_sender}")
-
-if not mailersend_api_key or not mailersend_sender:
-    logger.error("Missing MailerSend credentials. Please check .env file.")
-    exit(1)
-
-mailer_client = MailerSendClient(
-    api_key=mailersend_api_key,
-    sender_email=mailersend_sender,
-)
-
-# Initialize CellCast Client (SMS)
-cellcast_api_key = os.getenv("CELLCAST_API_KEY")
-cellcast_sender_id = os.getenv("CELLCAST_SENDER_ID")  # Optional
-cellcast_client = CellCastClient(app_key=cellcast_api_key, sender_id=cellcast_sender_id)
-
-WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
-
-def is_valid_email(email):
-    regex = r'^\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-    return re.match(regex, email)
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Provider breaker -> the channel it sends
+BREAKER_CHANNELS = {"mailersend": "email", "cellcast": "sms"}
+
+# Built by create_app()
+settings = None
+mailer_client = None
+cellcast_client = None
+voucher_cache = None
+hot_images = None
+sms_batcher = None
+email_batcher = None
+job_store = None
+delivery_queue = None
+idempotency = None
+reminder_scheduler = None
+
+WEBHOOK_SECRET_TOKEN = None
+# Where SMS recipients fetch their voucher image; served by /images/ below
+PUBLIC_IMAGE_BASE_URL = None
+BULK_BATCH_SIZE = 500
+# Follow-up vouchers are generated from one registration per customer. Each
+# stage is sent REMINDER_SEND_HOUR local time, offset by the stage's days from
+# the birthday and spread over REMINDER_SPREAD_MINUTES.
+REMINDER_STAGES = None
+REMINDER_TIMEZONE = None
+REMINDER_SEND_HOUR = 9
+REMINDER_SPREAD = 0.0
+
+_background_pid = None
+
+
+def configure_logging(app_settings):
+    """Console logging plus a rotating app log, set up once per process."""
+    logging.basicConfig(level=getattr(logging, app_settings.log_level.upper(), logging.DEBUG))
+    if not any(isinstance(h, RotatingFileHandler) for h in logger.handlers):
+        handler = RotatingFileHandler(app_settings.log_file, maxBytes=1000000, backupCount=5)
+        handler.setLevel(logging.DEBUG)  # Set to DEBUG to capture detailed logs
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+
+
+def create_app(app_settings: Settings = None, start_background: bool = True) -> Flask:
+    """
+    Builds the services and the Flask app.
+
+    Parameters:
+        - app_settings (Settings, optional): Defaults to load_settings(), which
+          reads .env and the environment.
+        - start_background (bool, optional): Start the delivery workers and
+          reminder scheduler now. A preforking server passes False and calls
+          start_background_tasks() in each worker after the fork; otherwise
+          they start on the first request.
+
+    Returns:
+        Flask: The app.
+    """
+    global settings, mailer_client, cellcast_client, voucher_cache, hot_images
+    global sms_batcher, email_batcher, job_store, delivery_queue, idempotency, reminder_scheduler
+    global WEBHOOK_SECRET_TOKEN, PUBLIC_IMAGE_BASE_URL, BULK_BATCH_SIZE
+    global REMINDER_STAGES, REMINDER_TIMEZONE, REMINDER_SEND_HOUR, REMINDER_SPREAD
+
+    settings = app_settings or load_settings()
+    configure_logging(settings)
+
+    logger.info(f"MAILERSEND_API_KEY: {'Loaded' if settings.mailersend_api_key else 'Missing'}")
+    logger.info(f"MAILERSEND_SENDER: {settings.mailersend_sender}")
+
+    if not settings.mailersend_api_key or not settings.mailersend_sender:
+        logger.error("Missing MailerSend credentials. Please check .env file.")
+        exit(1)
+
+    # PDF mode and SMS image format, quality and size target for every render
+    try:
+        set_encoding(Encoding.from_settings(settings))
+    except ValueError as e:
+        logger.error(f"{e}. Please check the VOUCHER_PDF_* and VOUCHER_IMAGE_* settings.")
+        exit(1)
 
-def is_valid_phone(phone):
-    return re.match(r'^\+?61\d{9}$', phone)
+    # Every template type must resolve to real template ids and artwork before anything is sent
+    try:
+        templates.load(settings.templates_file or None)
+    except (OSError, ValueError) as e:
+        logger.error(f"{e}. Please check the template configuration.")
+        exit(1)
+    templates.install_reload_handler()
+
+    # Outbound HTTP settings. Each client keeps one pooled connection per delivery worker.
+    http_timeout = (settings.http_connect_timeout, settings.http_read_timeout)
+
+    # Provider rate limits, shared by every send to the provider from this process
+    mailersend_scheduler = get_scheduler(
+        "mailersend", rate=settings.mailersend_rate_per_sec, burst=settings.mailersend_burst
+    )
+    cellcast_scheduler = get_scheduler(
+        "cellcast", rate=settings.cellcast_rate_per_sec, burst=settings.cellcast_burst
+    )
+
+    # Circuit breakers: while a provider is down its sends fail fast and are
+    # parked instead of holding delivery capacity in retries, then replayed
+    # by replay_parked() once the breaker lets calls through again.
+    breaker_options = dict(
+        failure_threshold=settings.circuit_failure_threshold,
+        failure_rate=settings.circuit_failure_rate,
+        window=settings.circuit_window_seconds,
+        open_seconds=settings.circuit_open_seconds,
+        half_open_calls=settings.circuit_half_open_calls,
+    )
+    mailersend_breaker = get_breaker("mailersend", **breaker_options)
+    cellcast_breaker = get_breaker("cellcast", **breaker_options)
+
+    mailer_client = MailerSendClient(
+        api_key=settings.mailersend_api_key,
+        sender_email=settings.mailersend_sender,
+        pool_size=settings.delivery_workers,
+        timeout=http_timeout,
+        scheduler=mailersend_scheduler,
+        base_url=settings.mailersend_api_url,
+        breaker=mailersend_breaker,
+    )
+    cellcast_client = CellCastClient(
+        app_key=settings.cellcast_api_key,
+        sender_id=settings.cellcast_sender_id,
+        pool_size=settings.delivery_workers,
+        timeout=http_timeout,
+        scheduler=cellcast_scheduler,
+        base_url=settings.cellcast_api_url,
+        breaker=cellcast_breaker,
+    )
+
+    WEBHOOK_SECRET_TOKEN = settings.webhook_secret_token
+    PUBLIC_IMAGE_BASE_URL = settings.public_image_base_url.rstrip("/")
+    BULK_BATCH_SIZE = settings.bulk_batch_size
+
+    # Rendered vouchers, keyed by name, code and template version
+    voucher_cache = VoucherCache(
+        settings.voucher_cache_dir,
+        max_memory_bytes=settings.voucher_cache_memory_mb * 1024 * 1024,
+        max_disk_bytes=settings.voucher_cache_disk_mb * 1024 * 1024,
+    )
+    hot_images = HotImageCache(settings.hot_image_cache_mb * 1024 * 1024)
+
+    # Template SMS are sent in batches: one CellCast call per template id for
+    # everything that arrives within SMS_BATCH_MAX_WAIT seconds.
+    sms_batcher = Batcher(
+        lambda template_id, numbers: cellcast_client.send_sms_template_batch(template_id, numbers),
+        max_size=settings.sms_batch_max_size,
+        max_wait=settings.sms_batch_max_wait,
+        name="sms-batcher"
+    )
+
+    # Emails go out through MailerSend's bulk endpoint. Each flush waits on the
+    # bulk status, so a few flushes run side by side; max_pending bounds the PDF
+    # attachments held in memory.
+    email_batcher = Batcher(
+        lambda _, items: mailer_client.send_bulk(items),
+        max_size=settings.email_batch_max_size,
+        max_wait=settings.email_batch_max_wait,
+        max_pending=settings.email_batch_max_pending,
+        flush_workers=4,
+        name="email-batcher"
+    )
+
+    job_store = JobStore(settings.job_store_path)
+    delivery_queue = DeliveryQueue(deliver_voucher, job_store, workers=settings.delivery_workers)
+    idempotency = IdempotencyIndex(job_store, ttl=settings.idempotency_ttl_seconds)
+    mailersend_breaker.on_recover(replay_parked)
+    cellcast_breaker.on_recover(replay_parked)
+
+    REMINDER_STAGES = parse_stages(settings.reminder_stages)
+    REMINDER_TIMEZONE = ZoneInfo(settings.reminder_timezone)
+    REMINDER_SEND_HOUR = settings.reminder_send_hour
+    REMINDER_SPREAD = settings.reminder_spread_minutes * 60
+    reminder_scheduler = ReminderScheduler(
+        job_store, delivery_queue, reserve_channels, batch_size=settings.reminder_batch_size
+    )
+
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    if start_background:
+        start_background_tasks()
+    return app
+
+
+def start_background_tasks():
+    """
+    Starts the delivery workers and the reminder scheduler in this process.
+
+    Threads do not survive fork(), so under a preforking server each worker
+    calls this after it is forked. Further calls in the same process do nothing.
+    """
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    _background_pid = os.getpid()
+    delivery_queue.start()
+    reminder_scheduler.start()
+
+
+@bp.before_app_request
+def ensure_background_tasks():
+    # Servers without a post-fork hook start the threads on the first request
+    start_background_tasks()
+
+
+def replay_parked(breaker, state):
+    """
+    Requeues sends parked while `breaker` was open. Going half-open releases
+    only as many jobs as the breaker has probes; closing releases the rest.
+    """
+    channel = BREAKER_CHANNELS.get(breaker.name)
+    if channel is None:
+        return
+    limit = breaker.half_open_calls if state == HALF_OPEN else None
+    requeued = job_store.requeue_parked(channel, limit)
+    if requeued:
+        logger.info(f"Replaying {requeued} parked {channel} sends ({breaker.name} circuit {state}).")
+        delivery_queue.wake()
+
+
+def deliver_voucher(delivery_queue, job):
+    """Renders the voucher and sends it on every pending channel. Runs on a delivery worker."""
+    name = job["name"]
+    email = job["email"]
+    phone = job["phone"]
+    voucher_code = job["voucher_code"]
+    template_type = job["template_type"]
+    send_email_channel = job["channels"]["email"]["state"] == PENDING
+    send_sms_channel = job["channels"]["sms"]["state"] == PENDING
+
+    # Sends handed to a batcher; the job finishes when these resolve
+    pending = []
+
+    # Fetch the rendered voucher from the cache, rendering it on a miss. When
+    # an SMS will link to the JPG, it is also put in the hot image cache ahead
+    # of the recipients opening the link.
+    template = templates.get(template_type)
+    # Unknown types are sent with the default template and counted under it
+    label = template.template_type
+    pdf_bytes = None
+    if send_email_channel or send_sms_channel:
+        try:
+            pdf_bytes, jpg_bytes = voucher_cache.get_or_render(name, voucher_code, template.renderer)
+            if send_sms_channel:
+                hot_images.put(voucher_code, jpg_bytes, voucher_cache.key_for(name, voucher_code, template.renderer))
+        except Exception as e:
+            logger.error(f"Failed to render voucher: {e}")
+
+    # Only send email if email is provided and valid
+    if send_email_channel:
+        email_template_id = template.email_template_id
+
+        if not pdf_bytes:
+            logger.error("Failed to generate PDF voucher.")
+            DELIVERIES.inc(channel="email", template_type=label, outcome=FAILED)
+            delivery_queue.update_channel(job["id"], "email", state=FAILED, error="render failed")
+        else:
+            logger.info(f"Generated PDF voucher ({len(pdf_bytes)} bytes)")
+            # The email joins the next bulk submission with its PDF attachment
+            logger.info(f"Queueing email to {email} with in-memory attachment")
+            logger.info(f"Email Template id: {email_template_id}")
+            email_attempts = job["channels"]["email"]["attempts"] + 1
+
+            def on_email_result(future):
+                error = future.exception()
+                if isinstance(error, CircuitOpenError):
+                    # Not attempted; replay_parked() sends it once MailerSend recovers
+                    logger.warning(f"Email to {email} parked: {error}")
+                    DELIVERIES.inc(channel="email", template_type=label, outcome=PARKED)
+                    delivery_queue.update_channel(job["id"], "email", state=PARKED, error=str(error))
+                elif not error and future.result() is None:
+                    # Queued at MailerSend but not yet reported on; a retry would send it twice
+                    logger.warning(f"Email to {email} accepted by MailerSend, outcome unknown")
+                    DELIVERIES.inc(channel="email", template_type=label, outcome=UNCONFIRMED)
+                    delivery_queue.update_channel(
+                        job["id"], "email", state=UNCONFIRMED, attempts=email_attempts, error="outcome unknown"
+                    )
+                elif not error and future.result():
+                    logger.info(f"Email sent successfully to {email}")
+                    DELIVERIES.inc(channel="email", template_type=label, outcome=SENT)
+                    delivery_queue.update_channel(job["id"], "email", state=SENT, attempts=email_attempts, error=None)
+                else:
+                    logger.error(f"Failed to send email to {email}")
+                    DELIVERIES.inc(channel="email", template_type=label, outcome=FAILED)
+                    delivery_queue.update_channel(
+                        job["id"], "email", state=FAILED, attempts=email_attempts, error="send failed"
+                    )
+
+            future = email_batcher.submit("bulk", {
+                "recipient_email": email,
+                "recipient_name": name,
+                "template_id": email_template_id,
+                "attachment_content": pdf_bytes,
+                "attachment_filename": f'voucher_{voucher_code}.pdf'
+            })
+            future.add_done_callback(on_email_result)
+            pending.append(future)
+    else:
+        logger.info("Skipping email sending due to missing or invalid email.")
+
+    # --- SMS Sending using Template ---
+    # Only send SMS if phone is provided and valid.
+    if send_sms_channel:
+        sms_template_id = template.sms_template_id
+
+        image_url = f"{PUBLIC_IMAGE_BASE_URL}/voucher_{voucher_code}.jpg"
+        # Build recipient data for the SMS template call.
+        # Adjust merge fields as required by your SMS template.
+        recipient_data = {
+            "number": phone,
+            "fname": name,
+            "custom_value_1": image_url
+        }
 
-@app.route('/birthday-webhook', methods=['POST'])
+        # The SMS joins a batch for its template; the result arrives when the
+        # batch is sent, so this worker moves on to the next job meanwhile.
+        logger.info(f"Queueing SMS using template id: {sms_template_id} to {phone}")
+        sms_attempts = job["channels"]["sms"]["attempts"] + 1
+
+        def on_sms_result(future):
+            error = future.exception()
+            if isinstance(error, CircuitOpenError):
+                logger.warning(f"SMS to {phone} parked: {error}")
+                DELIVERIES.inc(channel="sms", template_type=label, outcome=PARKED)
+                delivery_queue.update_channel(job["id"], "sms", state=PARKED, error=str(error))
+            elif not error and future.result():
+                logger.info(f"SMS sent successfully to {phone}")
+                DELIVERIES.inc(channel="sms", template_type=label, outcome=SENT)
+                delivery_queue.update_channel(job["id"], "sms", state=SENT, attempts=sms_attempts, error=None)
+            else:
+                logger.error(f"Failed to send SMS to {phone}")
+                DELIVERIES.inc(channel="sms", template_type=label, outcome=FAILED)
+                delivery_queue.update_channel(job["id"], "sms", state=FAILED, attempts=sms_attempts, error="send failed")
+
+        future = sms_batcher.submit(sms_template_id, recipient_data)
+        future.add_done_callback(on_sms_result)
+        pending.append(future)
+    else:
+        logger.info("Skipping SMS sending due to missing or invalid phone.")
+    return pending
+
+
+def is_authorized():
+    auth_token = request.headers.get('Authorization')
+    return bool(auth_token) and auth_token == WEBHOOK_SECRET_TOKEN
+
+
+def duplicate_response(job_id):
+    """Answers a retried webhook with the job created by the original request."""
+    original = delivery_queue.get(job_id)
+    result = {
+        "status": "accepted",
+        "job_id": job_id,
+        "duplicate": True,
+        "email": original["channels"]["email"]["state"] if original else PENDING,
+        "sms": original["channels"]["sms"]["state"] if original else PENDING
+    }
+    logger.info(f"Duplicate webhook suppressed ({idempotency.suppressed} so far): {result}")
+    return jsonify(result), 202
+
+
+def reserve_channels(job):
+    """
+    Claims the (voucherCode, templateType, channel) key for every pending channel.
+
+    Channels already owned by an earlier job are skipped, unless that job
+    failed on the channel, in which case this retry takes the key over.
+
+    Returns:
+        str: Job id of the first earlier job that owns one of the channels, or None.
+    """
+    duplicate_of = None
+    for channel in CHANNELS:
+        if job["channels"][channel]["state"] != PENDING:
+            continue
+        key = channel_key(job["voucher_code"], job["template_type"], channel)
+        owner = idempotency.reserve(key, job["id"])
+        if owner != job["id"]:
+            original = delivery_queue.get(owner)
+            if original and original["channels"][channel]["state"] == FAILED:
+                owner = idempotency.reserve(key, job["id"], replace=owner)
+        if owner != job["id"]:
+            job["channels"][channel].update(state=SKIPPED, error=f"duplicate of {owner}")
+            idempotency.record_suppressed()
+            duplicate_of = duplicate_of or owner
+    return duplicate_of
+
+
+def template_label(template_type):
+    """The registry key `template_type` resolves to, so metric labels are bounded by the configured templates."""
+    return templates.get(template_type).template_type
+
+
+def lap(stage, started):
+    """Records the time since `started` under a webhook stage and returns the new start."""
+    now = time.perf_counter()
+    WEBHOOK_STAGE_SECONDS.observe(now - started, stage=stage)
+    return now
+
+
+@bp.route('/birthday-webhook', methods=['POST'])
 def birthday_webhook():
+    label = ""
     try:
-        auth_token = request.headers.get('Authorization')
-        if not auth_token or auth_token != WEBHOOK_SECRET_TOKEN:
+        started = time.perf_counter()
+        authorized = is_authorized()
+        started = lap("auth", started)
+        if not authorized:
             logger.warning("Unauthorized access attempt.")
+            WEBHOOK_REQUESTS.inc(template_type=label, outcome="unauthorized")
             return jsonify({"status": "error", "message": "Unauthorized."}), 401
 
+        # A retry carrying a known Idempotency-Key never gets past this point
+        request_key = request.headers.get('Idempotency-Key')
+        if request_key:
+            original_id = idempotency.lookup(header_key(request_key))
+            if original_id:
+                idempotency.record_suppressed()
+                WEBHOOK_REQUESTS.inc(template_type=label, outcome="duplicate")
+                return duplicate_response(original_id)
+
         data = request.get_json()
-        if not data:
+        if not data or not isinstance(data, dict):
             logger.error("No JSON received")
+            WEBHOOK_REQUESTS.inc(template_type=label, outcome="invalid")
             return jsonify({"status": "error", "message": "No JSON received"}), 400
 
-        # Extract fields from the payload (default to empty string if missing)
-        name = data.get("name", "").strip()
-        email = data.get("email", "").strip()
-        phone = data.get("phone", "").strip()
-        voucher_code = data.get("voucherCode", "").strip()
-        template_type = data.get("templateType", "default").strip()
-
-        # Mapping for email templates (MailerSend)
-        email_template_mapping = {
-            "TEMPLATE_1ST_2WEEKS": os.getenv("MAILERSEND_1ST_2WEEKS_ID"),
-            "TEMPLATE_1MONTH": os.getenv("MAILERSEND_NEXT_YEAR_1MONTH_ID"),
-            "TEMPLATE_2ND_2WEEKS": os.getenv("MAILERSEND_NEXT_YEAR_2WEEKS_ID")
-        }
-        email_template_id = email_template_mapping.get(
-            template_type, 
-            os.getenv("MAILERSEND_DEFAULT_TEMPLATE_ID")
-        )
+        checked = validate_record(data)
+        name = checked["name"]
+        email = checked["email"]
+        phone = checked["phone"]
+        voucher_code = checked["voucher_code"]
+        template_type = checked["template_type"]
+        label = template_label(template_type)
+        started = lap("parse", started)
 
         logger.info(f"Received data - Name: '{name}', Email: '{email}', Phone: '{phone}', Voucher: '{voucher_code}'")
 
         # Log warnings if any fields are missing but do not abort
         if not name:
             logger.warning("Name is missing.")
-        if not email:
-            logger.warning("Email is missing.")
-        if not phone:
-            logger.warning("Phone is missing.")
-        if not voucher_code:
-            logger.info("Voucher code is missing. A new one will be generated.")
-
-        # Validate email and phone formats separately
-        email_valid = True
-        phone_valid = True
-
-        if email and not is_valid_email(email):
-            logger.error(f"Invalid email format: {email}")
-            email_valid = False
-
-        if phone and not is_valid_phone(phone):
-            logger.error(f"Invalid phone format: {phone}")
-            phone_valid = False
-
-        # If both email and phone are provided but invalid, then nothing can be sent.
-        if email and phone and not (email_valid or phone_valid):
-            logger.error("Both email and phone formats are invalid.")
-            return jsonify({"status": "error", "message": "Both email and phone formats are invalid."}), 400
-
-        # Generate voucher code if not provided
-        if not voucher_code:
-            logger.error("Missing voucher code. Aborting.")
-            return jsonify({"status": "error", "message": "Missing voucher code."}), 400
-
-        # Initialize success flags
-        email_success = False
-        sms_success = False
-
-        # Only generate the PDF voucher and send email if email is provided and valid
-        if email and email_valid:
-            pdf_path = generate_voucher_pdf(name, voucher_code)
-            if not pdf_path:
-                logger.error("Failed to generate PDF voucher.")
-            else:
-                logger.info(f"Generated PDF voucher at: {pdf_path}")
-                # Send Email with PDF attachment
-                logger.info(f"Preparing to send email to {email} with attachment {pdf_path}")
-                logger.info(f"Email Template id: {email_template_id}")
-                email_success = mailer_client.send_email(email, name, email_template_id, pdf_path)
-                if email_success:
-                    logger.info(f"Email sent successfully to {email}")
-                else:
-                    logger.error(f"Failed to send email to {email}")
-                try:
-                    os.remove(pdf_path)
-                    logger.info(f"Deleted temporary PDF file: {pdf_path}")
-                except Exception as e:
-                    logger.warning(f"Could not delete PDF file {pdf_path}: {e}")
-        else:
-            logger.info("Skipping email sending due to missing or invalid email.")
-
-        # --- SMS Sending using Template ---
-        # Only send SMS if phone is provided and valid.
-        if phone and phone_valid:
-            # Map incoming template type to the corresponding CellCast SMS template id.
-            sms_template_mapping = {
-                "TEMPLATE_1ST_2WEEKS": os.getenv("CELLCAST_1ST_2WEEKS_ID"),
-                "TEMPLATE_1MONTH": os.getenv("CELLCAST_NEXT_YEAR_1MONTH_ID"),
-                "TEMPLATE_2ND_2WEEKS": os.getenv("CELLCAST_NEXT_YEAR_2WEEKS_ID")
-            }
-            sms_template_id = sms_template_mapping.get(template_type, os.getenv("CELLCAST_TEMPLATE_ID"))
-
-            image_url = f"http://209.38.84.84/images/voucher_{voucher_code}.jpg"
-            # Build recipient data for the SMS template call.
-            # Adjust merge fields as required by your SMS template.
-            recipient_data = [{
-                "number": phone,
-                "fname": name,
-                "custom_value_1": image_url
-            }]
-
-            logger.info(f"Sending SMS using template id: {sms_template_id} to {phone}")
-            sms_success = cellcast_client.send_sms_template(
-                template_id=sms_template_id,
-                numbers=recipient_data
-            )
-            if sms_success:
-                logger.info(f"SMS sent successfully to {phone}")
-            else:
-                logger.error(f"Failed to send SMS to {phone}")
-        else:
-            logger.info("Skipping SMS sending due to missing or invalid phone.")
+        for reason in checked["warnings"]:
+            logger.error(f"Dropping a channel: {reason}")
 
-        # Return a detailed JSON response
+        # Nothing can be sent without a voucher code, or when both contacts are invalid
+        if checked["error"]:
+            logger.error(f"Rejected: {checked['error']}")
+            WEBHOOK_REQUESTS.inc(template_type=label, outcome="invalid")
+            return jsonify({"status": "error", "message": REJECTION_MESSAGES.get(checked["error"], checked["error"])}), 400
+
+        started = lap("validation", started)
+
+        job = new_job(
+            name, email, phone, voucher_code, template_type,
+            email_enabled=bool(email),
+            sms_enabled=bool(phone)
+        )
+        duplicate_of = reserve_channels(job)
+        if duplicate_of and not any(state["state"] == PENDING for state in job["channels"].values()):
+            WEBHOOK_REQUESTS.inc(template_type=label, outcome="duplicate")
+            return duplicate_response(duplicate_of)
+        if request_key:
+            idempotency.reserve(header_key(request_key), job["id"])
+
+        try:
+            job_id = delivery_queue.submit(job)
+        except Exception:
+            # The keys would otherwise answer every retry with a job that was never stored
+            idempotency.release([job["id"]])
+            raise
+        lap("enqueue", started)
+        WEBHOOK_REQUESTS.inc(template_type=label, outcome="accepted")
+
+        # Accepted for delivery; progress is available from GET /jobs/<job_id>
         result = {
-            "status": "success",
-            "email": email_success,
-            "sms": sms_success
+            "status": "accepted",
+            "job_id": job_id,
+            "email": job["channels"]["email"]["state"],
+            "sms": job["channels"]["sms"]["state"]
         }
         logger.info(result)
-        return jsonify(result), 200
+        return jsonify(result), 202
 
     except Exception as e:
         logger.exception("An unexpected error occurred in birthday_webhook.")
+        WEBHOOK_REQUESTS.inc(template_type=label, outcome="error")
         return jsonify({"status": "error", "message": "Internal server error."}), 500
 
+
+def bulk_rows(stream, fmt):
+    """Yields one dict per NDJSON line or CSV record (None for a line that is not a JSON object), reading the upload incrementally."""
+    # utf-8-sig drops the byte order mark Excel puts at the start of CSV exports
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        yield from csv.DictReader(text)
+        return
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row if isinstance(row, dict) else None
+
+
+def bulk_row_job(checked):
+    """Builds the delivery job for a row that passed validate_batch()."""
+    return new_job(
+        checked["name"], checked["email"], checked["phone"], checked["voucher_code"], checked["template_type"],
+        email_enabled=bool(checked["email"]),
+        sms_enabled=bool(checked["phone"])
+    )
+
+
+@bp.route('/birthday-webhook/bulk', methods=['POST'])
+def birthday_webhook_bulk():
+    """
+    Accepts a whole cohort as NDJSON (default) or CSV (Content-Type: text/csv
+    or ?format=csv) with the /birthday-webhook fields per row.
+
+    Rows are validated as they are read and accepted jobs are enqueued
+    BULK_BATCH_SIZE at a time. The response is NDJSON with one result per
+    row, in input order, streamed as each batch is committed.
+    """
+    if not is_authorized():
+        logger.warning("Unauthorized access attempt.")
+        return jsonify({"status": "error", "message": "Unauthorized."}), 401
+
+    fmt = request.args.get("format") or ("csv" if request.mimetype == "text/csv" else "ndjson")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"status": "error", "message": "format must be csv or ndjson."}), 400
+
+    def process(first_row, rows):
+        """Validates one batch of rows as columns, enqueues the accepted ones and returns their result lines."""
+        jobs, results = [], []
+        for row, checked in zip(rows, validate_batch([row or {} for row in rows])):
+            if row is None:
+                totals["error"] += 1
+                results.append({"status": "error", "message": "row is not a JSON object"})
+                continue
+            if checked["error"]:
+                totals["error"] += 1
+                WEBHOOK_REQUESTS.inc(template_type=template_label(checked["template_type"]), outcome="invalid")
+                results.append({"status": "error", "message": checked["error"]})
+                continue
+            job = bulk_row_job(checked)
+            duplicate_of = reserve_channels(job)
+            if duplicate_of and not any(state["state"] == PENDING for state in job["channels"].values()):
+                totals["duplicate"] += 1
+                WEBHOOK_REQUESTS.inc(template_type=template_label(job["template_type"]), outcome="duplicate")
+                result = {"status": "accepted", "job_id": duplicate_of, "duplicate": True}
+            else:
+                totals["accepted"] += 1
+                WEBHOOK_REQUESTS.inc(template_type=template_label(job["template_type"]), outcome="accepted")
+                jobs.append(job)
+                result = {"status": "accepted", "job_id": job["id"],
+                          "email": job["channels"]["email"]["state"], "sms": job["channels"]["sms"]["state"]}
+            if checked["warnings"]:
+                result["warnings"] = checked["warnings"]
+            results.append(result)
+        if jobs:
+            try:
+                delivery_queue.submit_many(jobs)
+            except Exception:
+                idempotency.release([job["id"] for job in jobs])
+                totals["accepted"] -= len(jobs)
+                raise
+        return "".join(
+            json.dumps({"row": number, **result}) + "\n"
+            for number, result in enumerate(results, start=first_row)
+        )
+
+    totals = {"accepted": 0, "duplicate": 0, "error": 0}
+
+    def results():
+        batch, first_row = [], 1
+        try:
+            for row in bulk_rows(request.stream, fmt):
+                batch.append(row)
+                if len(batch) >= BULK_BATCH_SIZE:
+                    yield process(first_row, batch)
+                    first_row += len(batch)
+                    batch = []
+            yield process(first_row, batch)
+        except Exception:
+            # Rows already streamed back stay accepted; the summary line says where it stopped
+            logger.exception("Bulk import failed.")
+            yield json.dumps({"status": "error", "message": "Internal server error.", **totals}) + "\n"
+            return
+        logger.info(f"Bulk import finished: {totals}")
+        yield json.dumps({"status": "done", **totals}) + "\n"
+
+    return Response(stream_with_context(results()), mimetype="application/x-ndjson")
+
+
+def image_response(jpg_bytes, etag):
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(jpg_bytes, mimetype=image_mimetype(jpg_bytes))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = IMAGE_CACHE_CONTROL
+    return response
+
+
+@bp.route('/images/voucher_<voucher_code>.jpg', methods=['GET'])
+def voucher_image(voucher_code):
+    """Public voucher image linked from the SMS. No auth: the link is the credential."""
+    # 1. Hot images, filled as SMS go out
+    hot = hot_images.get(voucher_code)
+    if hot:
+        return image_response(*hot)
+
+    # 2. Disk tier of the voucher cache, streamed with sendfile where the server supports it
+    cached = voucher_cache.image_file(voucher_code)
+    if cached:
+        etag, path = cached
+        if request.if_none_match.contains(etag):
+            return image_response(None, etag)
+        try:
+            # The link always ends in .jpg; the content type says whether it is JPEG or WebP
+            with open(path, "rb") as f:
+                mimetype = image_mimetype(f.read(12))
+            response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=31536000)
+        except FileNotFoundError:
+            # Evicted by another worker since the lookup; render it again below
+            logger.info(f"Cached image for voucher {voucher_code} was evicted; re-rendering")
+        else:
+            response.headers['Cache-Control'] = IMAGE_CACHE_CONTROL
+            return response
+
+    # 3. Render on demand for vouchers we have a job for
+    job = job_store.find_by_voucher_code(voucher_code)
+    if not job:
+        return jsonify({"status": "error", "message": "Not found."}), 404
+    renderer = templates.get(job["template_type"]).renderer
+    try:
+        _, jpg_bytes = voucher_cache.get_or_render(job["name"], voucher_code, renderer)
+    except Exception:
+        logger.exception(f"Failed to render image for voucher {voucher_code}")
+        return jsonify({"status": "error", "message": "Internal server error."}), 500
+    etag = voucher_cache.key_for(job["name"], voucher_code, renderer)
+    hot_images.put(voucher_code, jpg_bytes, etag)
+    return image_response(jpg_bytes, etag)
+
+
+@bp.route('/reminders', methods=['POST'])
+def register_reminders():
+    """Registers a customer's birthday; every reminder stage is then sent without further webhook calls."""
+    try:
+        if not is_authorized():
+            logger.warning("Unauthorized access attempt.")
+            return jsonify({"status": "error", "message": "Unauthorized."}), 401
+
+        data = request.get_json()
+        if not data or not isinstance(data, dict):
+            logger.error("No JSON received")
+            return jsonify({"status": "error", "message": "No JSON received"}), 400
+
+        # Same field rules as /birthday-webhook; invalid contact details are
+        # dropped here, so their channel is skipped when each stage fires
+        checked = validate_record(data)
+        name = checked["name"]
+        email = checked["email"]
+        phone = checked["phone"]
+        voucher_code = checked["voucher_code"]
+        for reason in checked["warnings"]:
+            logger.error(f"Dropping a channel: {reason}")
+        if checked["error"] and checked["error"] != NO_CONTACT:
+            return jsonify({"status": "error", "message": REJECTION_MESSAGES.get(checked["error"], checked["error"])}), 400
+
+        birthday = data.get("birthday")
+        try:
+            if not isinstance(birthday, str):
+                raise ValueError(f"Invalid birthday: {birthday!r}")
+            birthday = parse_birthday(birthday)
+        except ValueError:
+            return jsonify({"status": "error", "message": "Invalid or missing birthday (YYYY-MM-DD or MM-DD)."}), 400
+
+        if not email and not phone:
+            return jsonify({"status": "error", "message": "No valid email or phone."}), 400
+
+        reminders = plan_reminders(
+            name, email, phone, voucher_code, birthday, REMINDER_STAGES,
+            REMINDER_TIMEZONE, send_hour=REMINDER_SEND_HOUR, spread=REMINDER_SPREAD
+        )
+        inserted = reminder_scheduler.register(reminders)
+        result = {
+            "status": "scheduled",
+            "duplicate": inserted == 0,
+            "reminders": reminder_summary(voucher_code)
+        }
+        logger.info(f"Registered reminders for voucher {voucher_code}: {inserted} new")
+        return jsonify(result), 201 if inserted else 200
+
+    except Exception as e:
+        logger.exception("An unexpected error occurred in register_reminders.")
+        return jsonify({"status": "error", "message": "Internal server error."}), 500
+
+
+def reminder_summary(voucher_code):
+    return [
+        {
+            "template_type": reminder["template_type"],
+            "due_at": datetime.fromtimestamp(reminder["due_at"], REMINDER_TIMEZONE).isoformat(),
+            "state": reminder["state"],
+            "job_id": reminder["job_id"]
+        }
+        for reminder in job_store.reminders_for(voucher_code)
+    ]
+
+
+@bp.route('/reminders/<voucher_code>', methods=['GET'])
+def get_reminders(voucher_code):
+    if not is_authorized():
+        logger.warning("Unauthorized access attempt.")
+        return jsonify({"status": "error", "message": "Unauthorized."}), 401
+
+    reminders = reminder_summary(voucher_code)
+    if not reminders:
+        return jsonify({"status": "error", "message": "No reminders for this voucher."}), 404
+    return jsonify({"status": "success", "voucher_code": voucher_code, "reminders": reminders}), 200
+
+
+@bp.route('/health', methods=['GET'])
+def health():
+    return jsonify({
+        "status": "ok",
+        "jobs": job_store.counts(),
+        "providers": {name: scheduler.stats() for name, scheduler in all_schedulers().items()},
+        "circuit_breakers": {name: breaker.stats() for name, breaker in all_breakers().items()},
+        "parked": job_store.parked_counts(),
+        "idempotency": idempotency.stats(),
+        "voucher_cache": voucher_cache.stats(),
+        "hot_images": hot_images.stats(),
+        "reminders": reminder_scheduler.stats(),
+        "templates": templates.registry().stats()
+    }), 200
+
+
+# Component stats are read at scrape time, so they cost nothing per request
+metrics.REGISTRY.gauge_callback(
+    "voucher_provider_scheduler", "Provider token bucket state (see ProviderScheduler.stats).", ("provider", "stat"),
+    lambda: [((name, stat), value) for name, scheduler in all_schedulers().items()
+             for stat, value in scheduler.stats().items()],
+)
+metrics.REGISTRY.gauge_callback(
+    "voucher_circuit_breaker", "Provider circuit breaker state (0 closed, 1 half-open, 2 open) and counters.",
+    ("provider", "stat"),
+    lambda: [((name, stat), value) for name, breaker in all_breakers().items()
+             for stat, value in breaker.stats().items() if stat != "state"],
+)
+metrics.REGISTRY.gauge_callback(
+    "voucher_parked", "Jobs with a send parked while the provider's circuit was open.", ("channel",),
+    lambda: [((channel,), count) for channel, count in job_store.parked_counts().items()],
+)
+metrics.REGISTRY.gauge_callback(
+    "voucher_idempotency", "Idempotency index counters and size.", ("stat",),
+    lambda: [((stat,), value) for stat, value in idempotency.stats().items()],
+)
+metrics.REGISTRY.gauge_callback(
+    "voucher_cache", "Voucher cache hits, misses and bytes per tier.", ("cache", "stat"),
+    lambda: [(("voucher", stat), value) for stat, value in voucher_cache.stats().items()]
+    + [(("hot_images", stat), value) for stat, value in hot_images.stats().items()],
+)
+metrics.REGISTRY.gauge_callback(
+    "voucher_jobs", "Delivery jobs in the job store by state.", ("state",),
+    lambda: [((state,), count) for state, count in job_store.counts().items()],
+)
+metrics.REGISTRY.gauge_callback(
+    "voucher_reminders", "Stored reminders by state.", ("state",),
+    lambda: [((state,), count) for state, count in job_store.reminder_counts().items()],
+)
+metrics.REGISTRY.gauge_callback(
+    "voucher_batcher_pending", "Sends waiting for their batch to flush.", ("batcher",),
+    lambda: [(("sms",), sms_batcher.pending()), (("email",), email_batcher.pending())],
+)
+
+
+@bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    if not is_authorized():
+        logger.warning("Unauthorized access attempt.")
+        return jsonify({"status": "error", "message": "Unauthorized."}), 401
+
+    job = delivery_queue.get(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": "Job not found."}), 404
+
+    return jsonify({
+        "status": "success",
+        "job_id": job["id"],
+        "state": job["state"],
+        "voucher_code": job["voucher_code"],
+        "template_type": job["template_type"],
+        "channels": job["channels"]
+    }), 200
+
+
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=5000)
+    create_app().run(host='0.0.0.0', port=5000)
@@ -0,0 +1,18 @@
+# wsgi.py
+#
+# WSGI entry point for production servers:
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Under gunicorn.conf.py this module is imported once, in the master, before
+# the workers are forked. Pillow, fpdf, and the decoded base image and font
+# faces of every template's artwork are loaded here, so every worker shares
+# them copy-on-write and is ready to render as soon as it is forked. The
+# delivery threads are started in each worker after the fork.
+
+import templates
+from create_voucher_pdf import warm_up
+from webhook_app import create_app
+
+app = create_app(start_background=False)
+warm_up(templates.registry().renderers())